@@ -0,0 +1,88 @@
+"""
+Compares the threadpool (SQLAlchemy) and native (asyncpg) database backends.
+
+This needs a migrated database to run against, and will write to the `user` and `guild` tables for the fake IDs below.
+
+Usage: python benchmarks/db_backends.py <dsn> [iterations] [concurrency]
+"""
+import asyncio
+import statistics
+import sys
+import time
+import types
+
+sys.path.insert(0, ".")
+
+from joku.db.interface import DatabaseInterface
+from joku.db.native import AsyncpgDatabaseInterface
+
+# Well outside the snowflake range of anything real.
+GUILD = types.SimpleNamespace(id=1)
+MEMBERS = [types.SimpleNamespace(id=1000 + i, guild=GUILD) for i in range(50)]
+
+
+async def _time_calls(name: str, make_coro, iterations: int):
+    timings = []
+    for i in range(iterations):
+        before = time.perf_counter()
+        await make_coro(i)
+        timings.append((time.perf_counter() - before) * 1000)
+
+    print("  {:<22} mean {:>8.3f}ms  median {:>8.3f}ms  p99 {:>8.3f}ms".format(
+        name, statistics.mean(timings), statistics.median(timings),
+        sorted(timings)[int(len(timings) * 0.99) - 1]
+    ))
+
+
+async def _message_throughput(db: DatabaseInterface, iterations: int, concurrency: int):
+    """
+    Simulates the per-message database work: an XP update and a settings read.
+    """
+    queue = asyncio.Queue()
+    for i in range(iterations):
+        queue.put_nowait(MEMBERS[i % len(MEMBERS)])
+
+    async def worker():
+        while not queue.empty():
+            member = queue.get_nowait()
+            await db.update_user_xp(member, 1)
+            await db.get_setting(GUILD, "dndcop")
+
+    before = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    taken = time.perf_counter() - before
+
+    print("  {:<22} {:>8.1f} messages/sec ({} concurrent)".format("on_message", iterations / taken, concurrency))
+
+
+async def run_backend(cls, dsn: str, iterations: int, concurrency: int):
+    bot = types.SimpleNamespace(config={}, loop=asyncio.get_event_loop(), redis=types.SimpleNamespace(pool=None))
+    db = cls(bot)
+    await db.connect(dsn)
+
+    print("{}:".format(cls.__name__))
+    await db.get_or_create_guild(GUILD)
+    await db.set_setting(GUILD, "dndcop", "false")
+
+    await _time_calls("get_or_create_user", lambda i: db.get_or_create_user(MEMBERS[i % len(MEMBERS)]), iterations)
+    await _time_calls("update_user_xp", lambda i: db.update_user_xp(MEMBERS[i % len(MEMBERS)], 1), iterations)
+    # Uncached, as get_setting is served from the settings cache.
+    await _time_calls("get_all_settings", lambda i: db.get_all_settings(GUILD), iterations)
+    await _time_calls("get_tag", lambda i: db.get_tag(GUILD, "benchmark"), iterations)
+    await _message_throughput(db, iterations, concurrency)
+
+    await db.close()
+
+
+def main():
+    dsn = sys.argv[1]
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    loop = asyncio.get_event_loop()
+    for cls in (DatabaseInterface, AsyncpgDatabaseInterface):
+        loop.run_until_complete(run_backend(cls, dsn, iterations, concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the closed-form level solver against the old polynomial root solver, and checks that they agree.
+
+Every XP value from 0 up to the limit is checked, along with the XP either side of every level boundary. Where the
+two disagree, the closed form is checked against the definition of a level directly, as the root solver works in
+floating point.
+
+Usage: python benchmarks/levels.py [max xp]
+"""
+import statistics
+import sys
+import time
+from math import floor
+
+import numpy as np
+from numpy.polynomial import Polynomial as P
+
+sys.path.insert(0, ".")
+
+from joku.core.levels import INCREASING_FACTOR, get_exp_for_level, get_level_from_exp, get_levels_from_exp
+
+
+def polynomial_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    The old level solver, which found the roots of (a/2)n**2 + (a/2)n - xp with numpy.
+    """
+    if xp < a:
+        return 1
+
+    ab = a / 2
+    poly = P([-xp, ab, ab])
+
+    root = poly.roots()[1] + 1
+    return int(floor(root))
+
+
+def _time_calls(name: str, func, values):
+    timings = []
+    for value in values:
+        before = time.perf_counter()
+        func(value)
+        timings.append((time.perf_counter() - before) * 1000000)
+
+    print("  {:<22} mean {:>8.3f}us  median {:>8.3f}us".format(name, statistics.mean(timings),
+                                                              statistics.median(timings)))
+
+
+def check(max_xp: int) -> int:
+    """
+    Checks the solvers agree for every XP up to max_xp, and either side of every level boundary.
+
+    :return: The number of values where the root solver was wrong.
+    """
+    values = list(range(max_xp + 1))
+    level = 1
+    while get_exp_for_level(level) < max_xp * 1000:
+        boundary = get_exp_for_level(level)
+        values.extend((boundary - 1, boundary, boundary + 1))
+        level += 1
+
+    bulk = get_levels_from_exp(np.array(values))
+
+    wrong = 0
+    for xp, bulk_level in zip(values, bulk.tolist()):
+        new = get_level_from_exp(xp)
+        assert new == bulk_level, "bulk solver disagrees at {} XP".format(xp)
+
+        if new != polynomial_level_from_exp(xp):
+            # The level is the one whose XP range contains xp.
+            assert new == 1 or get_exp_for_level(new - 1) <= xp < get_exp_for_level(new), \
+                "closed form is wrong at {} XP".format(xp)
+            wrong += 1
+
+    print("Checked {} XP values, the root solver was wrong at {} of them.".format(len(values), wrong))
+    return wrong
+
+
+def main():
+    max_xp = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    check(max_xp)
+
+    values = np.random.randint(0, max_xp, size=10000).tolist()
+    _time_calls("polynomial roots", polynomial_level_from_exp, values)
+    _time_calls("closed form", get_level_from_exp, values)
+
+    array = np.random.randint(0, max_xp, size=1000000)
+    before = time.perf_counter()
+    get_levels_from_exp(array)
+    print("  {:<22} {:.3f}ms for {} users".format("bulk", (time.perf_counter() - before) * 1000, len(array)))
+
+
+if __name__ == "__main__":
+    main()
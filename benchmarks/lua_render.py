@@ -0,0 +1,56 @@
+"""
+Compares rendering a Lua tag in a fresh runtime against rendering it in a reused sandbox.
+
+This runs in a single process, so it measures the render itself without any process pool overhead.
+
+Usage: python benchmarks/lua_render.py [iterations]
+"""
+import statistics
+import sys
+import time
+
+sys.path.insert(0, ".")
+
+from joku.core import sandbox
+from joku.core.sandbox import LuaSandbox
+
+TEMPLATE = """
+local words = {}
+for i, arg in ipairs(args) do
+    table.insert(words, string.upper(arg))
+end
+return "Hello, " .. author.name .. "! You said: " .. table.concat(words, " ")
+"""
+
+KWARGS = {
+    "args": ["some", "tag", "arguments"],
+    "author": {"name": "Benchmark", "id": 1, "guild": {"name": "Benchmarks", "id": 1}},
+    "channel": {"name": "general", "id": 1},
+}
+
+
+def _time_calls(name: str, func, iterations: int):
+    timings = []
+    for _ in range(iterations):
+        before = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - before) * 1000)
+
+    print("  {:<22} mean {:>8.3f}ms  median {:>8.3f}ms  p99 {:>8.3f}ms".format(
+        name, statistics.mean(timings), statistics.median(timings),
+        sorted(timings)[int(len(timings) * 0.99) - 1]
+    ))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    # What every render used to cost.
+    _time_calls("fresh runtime", lambda: LuaSandbox().run(TEMPLATE, KWARGS), iterations)
+    _time_calls("reused sandbox", lambda: sandbox.run_lua(TEMPLATE, KWARGS), iterations)
+
+    assert LuaSandbox().run(TEMPLATE, KWARGS) == sandbox.run_lua(TEMPLATE, KWARGS)
+
+
+if __name__ == "__main__":
+    main()
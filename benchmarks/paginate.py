@@ -0,0 +1,95 @@
+"""
+Compares the streaming table paginator against the old one, which re-rendered the page after every row.
+
+Both are checked to keep every row and to keep every page under the limit, then timed on tables of increasing size.
+
+Usage: python benchmarks/paginate.py [max rows]
+"""
+import random
+import string
+import sys
+import time
+
+import tabulate
+
+sys.path.insert(0, ".")
+
+from joku.core.utils import paginate_table
+
+
+def old_paginate_table(rows: list, headers, table_format="orgtbl", limit=2000):
+    """
+    The old paginator, which rendered the current page again for every row added to it.
+    """
+    pages = []
+    current_rows = []
+
+    while True:
+        if not rows:
+            break
+        current_row = rows[0]
+        current_rows.append(current_row)
+        _tbl = tabulate.tabulate(current_rows, headers=headers, tablefmt=table_format)
+        fmtted = "```{}```".format(_tbl)
+        if len(fmtted) >= limit:
+            current_rows = current_rows[:-1]
+            _tbl = tabulate.tabulate(current_rows, headers=headers, tablefmt=table_format)
+            fmtted = "```{}```".format(_tbl)
+            pages.append(fmtted)
+            current_rows = []
+            continue
+        rows.pop(0)
+
+    _tbl = tabulate.tabulate(current_rows, headers=headers, tablefmt=table_format)
+    fmtted = "```{}```".format(_tbl)
+    pages.append(fmtted)
+
+    return pages
+
+
+def make_rows(count: int) -> list:
+    """
+    Makes leaderboard-like rows: position, name, XP, level.
+    """
+    rows = []
+    for n in range(count):
+        name = "".join(random.choice(string.ascii_letters) for _ in range(random.randint(2, 32)))
+        rows.append([n + 1, name, random.randint(0, 1000000), random.randint(1, 200)])
+
+    return rows
+
+
+def check(rows: list, headers: list):
+    pages = paginate_table(rows, headers)
+    assert all(len(page) < 2000 for page in pages), "a page is over the limit"
+
+    # orgtbl pages are the header, the separator, then one line per row.
+    body = sum(page.count("\n") - 1 for page in pages)
+    assert body == len(rows), "{} rows went in, {} came out".format(len(rows), body)
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    headers = ["POS", "User", "XP", "Level"]
+
+    count = 10
+    while count <= max_rows:
+        rows = make_rows(count)
+        check(rows, headers)
+
+        before = time.perf_counter()
+        old_pages = old_paginate_table(list(rows), headers)
+        old = time.perf_counter() - before
+
+        before = time.perf_counter()
+        new_pages = paginate_table(rows, headers)
+        new = time.perf_counter() - before
+
+        print("{:>6} rows: old {:>9.2f}ms ({:>3} pages)  new {:>7.2f}ms ({:>3} pages)".format(
+            count, old * 1000, len(old_pages), new * 1000, len(new_pages)
+        ))
+        count *= 5
+
+
+if __name__ == "__main__":
+    main()
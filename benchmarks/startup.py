@@ -0,0 +1,135 @@
+"""
+Measures what importing the bot and its cogs costs, without connecting to Discord.
+
+The bot, then every cog in the autoload list of config.example.yml (plus joku.cogs.core, which is always loaded), are
+imported in a fresh interpreter under ``-X importtime``. This is done a few times, and the fastest run of each module
+is kept. Each cog's time only covers what it imports that the bot and the cogs before it didn't.
+
+The timings are compared against a stored baseline, and the script exits with a non-zero status if the total has
+regressed by more than the tolerance.
+
+Usage: python benchmarks/startup.py [--runs N] [--tolerance 0.2] [--save] [extra modules...]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+try:
+    import yaml
+except ImportError:
+    import ruamel.yaml as yaml
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_baseline.json")
+
+# import time: self [us] | cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def get_targets(extra: list) -> list:
+    """
+    Gets the modules to import, in the order the bot imports them.
+    """
+    with open("config.example.yml") as f:
+        config = yaml.load(f, Loader=yaml.Loader)
+
+    cogs = list(config.get("autoload", []))
+    if "joku.cogs.core" not in cogs:
+        cogs.append("joku.cogs.core")
+
+    return ["joku.core.bot"] + cogs + [module for module in extra if module not in cogs]
+
+
+def import_once(targets: list) -> dict:
+    """
+    Imports the targets in a fresh interpreter.
+
+    :return: Module name -> (self, cumulative) microseconds, for every module imported.
+    """
+    # run.py applies gyukutai before anything else.
+    # Plain import statements are used, as -X importtime doesn't time the module importlib.import_module is given.
+    code = "import gyukutai; gyukutai.apply()\n" + "".join("import {}\n".format(name) for name in targets)
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError("Importing failed:\n{}".format(proc.stderr[-2000:]))
+
+    timings = {}
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is not None:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+
+    return timings
+
+
+def measure(targets: list, runs: int) -> dict:
+    """
+    :return: Module name -> the fastest (self, cumulative) microseconds over every run.
+    """
+    best = {}
+    for _ in range(runs):
+        for name, (own, cumulative) in import_once(targets).items():
+            if name not in best or cumulative < best[name][1]:
+                best[name] = (own, cumulative)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", help="Extra modules to import after the autoloaded cogs.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="The fraction the total can grow by before it counts as a regression.")
+    parser.add_argument("--save", action="store_true", help="Store these timings as the new baseline.")
+    args = parser.parse_args()
+
+    targets = get_targets(args.modules)
+    timings = measure(targets, args.runs)
+
+    # Modules imported by an earlier target have no entry of their own, so they cost nothing here.
+    results = {name: timings.get(name, (0, 0))[1] for name in targets}
+    total = sum(results.values())
+
+    baseline = None
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    print("{:<32} {:>10} {:>10}".format("Module", "ms", "baseline"))
+    for name, cumulative in results.items():
+        before = baseline["modules"].get(name) if baseline else None
+        print("{:<32} {:>10.1f} {:>10}".format(name, cumulative / 1000,
+                                              "{:.1f}".format(before / 1000) if before is not None else "-"))
+    print("{:<32} {:>10.1f} {:>10}".format("total", total / 1000,
+                                          "{:.1f}".format(baseline["total"] / 1000) if baseline else "-"))
+
+    print("\nSlowest modules by their own import time:")
+    for name, (own, _) in sorted(timings.items(), key=lambda item: item[1][0], reverse=True)[:15]:
+        print("  {:<50} {:>8.1f}ms".format(name, own / 1000))
+
+    if args.save:
+        with open(BASELINE, "w") as f:
+            json.dump({"total": total, "modules": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("\nSaved the baseline to {}.".format(BASELINE))
+        return
+
+    if baseline is None:
+        print("\nNo baseline yet; run with --save to store one.")
+        return
+
+    limit = baseline["total"] * (1 + args.tolerance)
+    if total > limit:
+        print("\nStartup regressed: {:.1f}ms, over the limit of {:.1f}ms.".format(total / 1000, limit / 1000))
+        sys.exit(1)
+
+    print("\nWithin {:.0%} of the baseline.".format(args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
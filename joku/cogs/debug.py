@@ -7,6 +7,7 @@ import sys
 import traceback
 
 import discord
+import tabulate
 from asyncio_extras import threadpool
 from discord.ext import commands
 from sqlalchemy import text
@@ -16,7 +17,7 @@ from sqlalchemy.exc import ProgrammingError, DatabaseError
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.checks import is_owner
-from joku.core.utils import paginate_table
+from joku.core.utils import iter_table_pages
 
 
 class Debug(Cog):
@@ -99,13 +100,62 @@ class Debug(Cog):
         Only usable by the owner.
         """
 
-    @debug.command(pass_context=True)
-    async def stuck(self, ctx: Context):
+    @debug.command()
+    async def caches(self, ctx: Context):
+        """
+        Shows the hit/miss counters for the database caches.
+        """
+        headers = ["Cache", "Entries", "Hits", "Misses", "Hit rate"]
+        rows = []
+        for cache in ctx.bot.database.caches.values():
+            stats = cache.stats()
+            rows.append([stats["name"], stats["entries"], stats["hits"], stats["misses"],
+                         "{:.2%}".format(stats["hit_rate"])])
+
+        await ctx.send("```{}```".format(tabulate.tabulate(rows, headers=headers, tablefmt="orgtbl")))
+
+    @debug.command()
+    async def pool(self, ctx: Context):
+        """
+        Shows the queue depth and latencies of the sandbox pool.
+        """
+        stats = ctx.bot.sandbox_pool.stats()
+        rows = [[name, "{:.3f}ms".format(value) if isinstance(value, float) else value]
+                for (name, value) in stats.items()]
+
+        await ctx.send("```{}```".format(tabulate.tabulate(rows, tablefmt="orgtbl")))
+
+    @debug.command()
+    async def startup(self, ctx: Context):
         """
-        Cleans stuck antispam keys.
+        Shows how long each part of startup took.
         """
-        stuck = await ctx.bot.redis.clean_stuck_antispam()
-        await ctx.send(":heavy_check_mark: Cleaned `{}` stuck anti-spam keys.".format(stuck))
+        profile = ctx.bot.startup_profile
+        await ctx.send("```{}\n\nReady after {:.3f}s.```".format("\n".join(profile.report()),
+                                                                 profile.ready_after or 0))
+
+    @debug.command()
+    async def leaderboards(self, ctx: Context):
+        """
+        Rebuilds the XP and money leaderboards from the database.
+        """
+        async with ctx.channel.typing():
+            count = await ctx.bot.redis.leaderboards.rebuild()
+
+        await ctx.send(":heavy_check_mark: Rebuilt the leaderboards for `{}` users.".format(count))
+
+    @debug.command()
+    async def msglog(self, ctx: Context):
+        """
+        Toggles logging every message in this server.
+        """
+        guilds = ctx.bot.message_log_guilds
+        if ctx.guild.id in guilds:
+            guilds.discard(ctx.guild.id)
+            await ctx.send(":heavy_check_mark: No longer logging messages in this server.")
+        else:
+            guilds.add(ctx.guild.id)
+            await ctx.send(":heavy_check_mark: Now logging messages in this server.")
 
     @debug.command(pass_context=True)
     async def update(self, ctx: Context):
@@ -136,7 +186,7 @@ class Debug(Cog):
 
         Sets their EXP to a very large negative number.
         """
-        await ctx.bot.database.update_user_xp(user, xp=-3.4756738956329854e+307)
+        await ctx.bot.database.update_user_xp(user, xp_to_add=-3.4756738956329854e+307)
         await ctx.channel.send(":skull: User **{}** has been punished.".format(user))
 
     @debug.command(pass_context=True)
@@ -144,10 +194,12 @@ class Debug(Cog):
         """
         Resets a user's EXP to 0.
         """
-        user_xp = await ctx.bot.database.get_user_xp(user)
+        # Write out any buffered XP first, so that it is reset too.
+        await ctx.bot.database.xp_buffer.flush()
+        u = await ctx.bot.database.get_or_create_user(user)
 
-        to_add = 0 - user_xp
-        await ctx.bot.database.update_user_xp(user, xp=to_add)
+        to_add = 0 - (u.xp or 0)
+        await ctx.bot.database.update_user_xp(user, xp_to_add=to_add)
         await ctx.channel.send(
             ":put_litter_in_its_place: User **{}** has had their XP set to 0.".format(user))
 
@@ -192,7 +244,7 @@ class Debug(Cog):
             await ctx.send("Query executed without results.")
             return
 
-        tables = paginate_table(all_values, headers)
+        tables = iter_table_pages(all_values, headers)
         for tbl in tables:
             await ctx.send(tbl)
 
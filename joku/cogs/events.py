@@ -153,8 +153,8 @@ class Events(Cog):
             return
 
         if msg is None:
-            es = await ctx.bot.database.get_event_setting(event)
-            await ctx.send("The current message for this event is: `{}`".format(es))
+            es = await ctx.bot.database.get_event_setting(ctx.guild, event)
+            await ctx.send("The current message for this event is: `{}`".format(es.message))
             return
 
         await ctx.bot.database.update_event_setting(ctx.guild, event,
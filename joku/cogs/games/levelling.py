@@ -3,77 +3,23 @@ cancer
 """
 import textwrap
 from io import BytesIO
-from math import ceil, floor
+from math import ceil
 
 import asyncio
 import discord
-import matplotlib as mpl
 from asyncio_extras import threadpool
 from discord.ext import commands
 
 from joku.core import checks
 from joku.core.checks import mod_command
 
-mpl.use('Agg')
-
-import matplotlib.pyplot as plt
 import numpy as np
-from numpy.polynomial import Polynomial as P
-import seaborn as sns
 
 from joku.core.bot import Jokusoramame, Context
-from joku.db.tables import User
+from joku.core.plotting import get_pyplot
+from joku.core.levels import get_exp_for_level, get_level_from_exp, get_levels_from_exp, get_next_exp_required
 from joku.cogs._common import Cog
-from joku.core.utils import paginate_table, reject_outliers
-
-INCREASING_FACTOR = 50
-
-
-def get_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
-    """
-    Gets the level from the experience number.
-
-    U(n) = a* (n*(n+1)  / 2), a ∈ ℝ, a > 0
-    :param a: The levelling up constant.
-    :param xp: The XP this user currently has.
-    """
-    # Make sure XP is below INCREASING_FACTOR.
-    if xp < a:
-        # Level 1
-        return 1
-
-    # The equation that we need to solve is (a/2)n**2 + (a/2)n - xp = 0.
-    # So we get numpy to find our roots.
-    ab = a / 2
-    # C, B, A
-    to_solve = [-xp, ab, ab]
-    poly = P(to_solve)
-
-    # Positive root + 1
-    root = poly.roots()[1] + 1
-    return int(floor(root))
-
-
-def get_next_exp_required(xp: int, a: int = INCREASING_FACTOR):
-    """
-    Gets the EXP required for the next level, based on the current EXP.
-
-    :param a: The levelling up constant.
-    :param xp: The XP this user currently has.
-    :return: The amount of XP required for the next level, and the current level.
-    """
-    # No complxes
-    if xp < a:
-        return 1, a - xp
-
-    # Solve the current level.
-    current_level = get_level_from_exp(xp, a)
-
-    # Substitute in (n+1) to a* (n*(n+1)  / 2), where n == current_level
-    # or not idk
-    exp_required = int(a * (current_level * (current_level + 1) / 2))
-
-    return current_level, exp_required - xp
+from joku.core.utils import iter_table_pages, reject_outliers
 
 
 class Levelling(Cog):
@@ -100,15 +46,16 @@ class Levelling(Cog):
         #if await self.bot.database.is_channel_ignored(message.channel, type_="levels"):
         #    return
 
-        user = await self.bot.database.update_user_xp(message.author)
+        # This is buffered, and written to the database in batches.
+        user = await self.bot.database.xp_buffer.add(message.author)
         # Get the level.
         new_level = get_level_from_exp(user.xp)
 
         if user.level < new_level:
-            user = await self.bot.database.set_user_level(message.author, new_level)
+            await self.bot.database.set_user_level(message.author, new_level)
+            user.level = new_level
 
-            all_users = await self.bot.database.get_multiple_users(*message.guild.members, order_by=User.xp.desc())
-            index, u = next(filter(lambda j: j[1].id == message.author.id, enumerate(all_users)))
+            rank, total = await self.bot.redis.leaderboards.rank("xp", message.guild, message.author.id)
 
             # check if level up notifs are disabled here
             if await self.bot.redis.level_notifs_disabled(message.channel):
@@ -122,7 +69,8 @@ class Levelling(Cog):
                 xp = user.xp
                 required = get_next_exp_required(xp)[1]
                 em.add_field(name="Required for next level", value="{} XP".format(required))
-                em.add_field(name="Rank", value="{} / {}".format(index + 1, len(all_users)))
+                if rank is not None:
+                    em.add_field(name="Rank", value="{} / {}".format(rank + 1, total))
 
                 em.colour = discord.Colour.green()
                 em.set_thumbnail(url=message.author.avatar_url)
@@ -131,7 +79,7 @@ class Levelling(Cog):
                 if message.channel.permissions_for(message.guild.me).add_reactions:
                     await msg.add_reaction("🎉")
             else:
-                await message.channel.send(":up: **{} is now level {}!**".format(message.author, user["level"]))
+                await message.channel.send(":up: **{} is now level {}!**".format(message.author, new_level))
 
     @commands.group(pass_context=True, invoke_without_command=True)
     async def level(self, ctx: Context, *, target: discord.Member = None):
@@ -149,17 +97,20 @@ class Levelling(Cog):
             await ctx.channel.send(":no_entry_sign: **Bots cannot have XP.**")
             return
 
-        all_users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members, order_by=User.xp.desc())
-
-        index, u = next(filter(lambda j: j[1].id == user.id, enumerate(all_users)))
+        u = await ctx.bot.database.get_or_create_user(user)
+        rank, total = await ctx.bot.redis.leaderboards.rank("xp", ctx.guild, user.id)
 
         embed = discord.Embed(title=user.nick or user.name)
         embed.set_thumbnail(url=user.avatar_url)
 
         embed.add_field(name="Level", value=str(u.level))
-        embed.add_field(name="Rank", value="{} / {}".format(index + 1, len(all_users)))
-        embed.add_field(name="XP", value=str(u.xp))
-        required = get_next_exp_required(u.xp)[1]
+        if rank is None:
+            embed.add_field(name="Rank", value="Unranked")
+        else:
+            embed.add_field(name="Rank", value="{} / {}".format(rank + 1, total))
+        xp = (u.xp or 0) + ctx.bot.database.xp_buffer.pending(u.id)
+        embed.add_field(name="XP", value=str(xp))
+        required = get_next_exp_required(xp)[1]
 
         embed.add_field(name="XP required for next level", value=required)
         embed.colour = user.colour
@@ -197,7 +148,10 @@ class Levelling(Cog):
 
         This uses the global XP counter.
         """
-        users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members, order_by=User.xp.desc())
+        top = await ctx.bot.redis.leaderboards.top("xp", ctx.guild, num)
+        # Only the users on the board are loaded, for their levels.
+        users = await ctx.bot.database.get_multiple_users(*(discord.Object(id=id) for (id, xp) in top))
+        levels = {u.id: u.level for u in users}
 
         base = "**Top {} users (in this server):**\n\n".format(num)
 
@@ -205,19 +159,19 @@ class Levelling(Cog):
         headers = ["POS", "User", "XP", "Level"]
         table = []
 
-        for n, u in enumerate(users[:num]):
+        for n, (id, xp) in enumerate(top):
             try:
-                member = ctx.message.guild.get_member(u.id).name
+                member = ctx.message.guild.get_member(id).name
                 # Unicode and tables suck
                 member = member.encode("ascii", errors="replace").decode()
             except AttributeError:
                 # Prevent race condition - member leaving between command invocation and here
                 continue
             # position, name, xp, level
-            table.append([n + 1, member, u.xp, u.level])
+            table.append([n + 1, member, int(xp), levels.get(id, 1)])
 
         # Format the table.
-        pages = paginate_table(table, headers)
+        pages = iter_table_pages(table, headers)
 
         await ctx.channel.send(base)
         for page in pages:
@@ -232,12 +186,15 @@ class Levelling(Cog):
             await ctx.send(":x: Fuck you")
             return
 
-        users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members, order_by=User.xp.desc())
+        scores = await ctx.bot.redis.leaderboards.scores("xp", ctx.guild)
 
         async with ctx.channel.typing():
             async with self.plot_lock:
                 async with threadpool():
-                    _lvls = np.array([user.level for user in users if user.level >= 0])
+                    plt = get_pyplot()
+                    import seaborn as sns
+
+                    _lvls = get_levels_from_exp(np.array(scores))
 
                     # 12 is reasonable for rejecting the super outliers
                     lvls = reject_outliers(_lvls, m=12)
@@ -298,11 +255,12 @@ class Levelling(Cog):
             return
 
         u = await ctx.bot.database.get_or_create_user(user)
+        xp = (u.xp or 0) + ctx.bot.database.xp_buffer.pending(user.id)
 
-        level, exp_required = get_next_exp_required(u.xp)
+        level, exp_required = get_next_exp_required(xp)
         if level < u.level:
             # for cheaters like me
-            exp_required = int(INCREASING_FACTOR * (u.level * (u.level + 1) / 2))
+            exp_required = get_exp_for_level(u.level)
             level = u.level
 
         await ctx.channel.send("**{}** needs `{}` XP to advance to level `{}`.".format(user.name, exp_required,
@@ -320,7 +278,8 @@ class Levelling(Cog):
             await ctx.channel.send(":no_entry_sign: **Bots cannot have XP.**")
             return
 
-        exp = (await ctx.bot.database.get_or_create_user(user)).xp
+        exp = (await ctx.bot.database.get_or_create_user(user)).xp or 0
+        exp += ctx.bot.database.xp_buffer.pending(user.id)
 
         await ctx.channel.send("User **{}** has `{}` XP.".format(user.name, exp))
 
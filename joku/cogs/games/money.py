@@ -6,14 +6,11 @@ import time
 import discord
 import numpy as np
 import tabulate
-from asyncio_extras import threadpool
 from discord.ext import commands
-from sqlalchemy.orm import Session
 
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.redis import with_redis_cooldown
-from joku.db.tables import User
 
 BAD_RESPONSES = [
     ":fire: Your bank account went up in flames and you lost `§{}`.",
@@ -41,16 +38,23 @@ BODY_PARTS = [
 ]
 
 
-def calculate_monetary_decay(money: int, factor: float = -0.05, hours: int = 1) -> int:
+#: The hourly decay factor.
+DECAY_FACTOR = -0.05
+
+#: Money at or below this (and above zero) doesn't decay.
+BASIC_TAX_BRACKET = 1343
+
+
+def calculate_monetary_decay(money: int, factor: float = DECAY_FACTOR, hours: int = 1) -> int:
     """
     Calculates monetary decay over X hours.
     """
     return int(np.math.ceil(money * (np.math.exp(factor * hours))))
 
 
-def get_next_decay(currency: int, factor: float=-0.05) -> int:
+def get_next_decay(currency: int, factor: float=DECAY_FACTOR) -> int:
     currency = currency if currency is not None else 0
-    if 0 < currency <= 1343:
+    if 0 < currency <= BASIC_TAX_BRACKET:
         return 0
 
     return currency - calculate_monetary_decay(currency, factor=factor)
@@ -85,21 +89,14 @@ class Currency(Cog):
                 await asyncio.sleep(to_wait)
 
                 # decay
-                total = 0
-                async with threadpool():
-                    with self.bot.database.get_session() as sess:
-                        assert isinstance(sess, Session)
-
-                        users = list(sess.query(User).filter((User.money < 0) | (User.money > 1343)).all())
-                        for user in users:
-                            decay = get_next_decay(user.money)
-                            user.money -= decay
-                            total += decay
-
-                            # update the user
-                            sess.merge(user)
+                try:
+                    users, total = await self.bot.database.apply_monetary_decay(DECAY_FACTOR,
+                                                                                floor=BASIC_TAX_BRACKET)
+                except Exception:
+                    self.logger.exception("Failed to apply decay!")
+                else:
+                    self.logger.info("Decayed §{} from {} users.".format(total, users))
 
-                self.logger.info("Decayed §{}.".format(total))
                 to_wait = 60 * 60  # 1 hr
         finally:
             self.running = False
@@ -208,7 +205,8 @@ class Currency(Cog):
         """
         Shows the top 10 poorest users in this server.
         """
-        users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members, order_by=User.money.asc())
+        users = await ctx.bot.redis.leaderboards.top("money", ctx.guild, 10, lowest=True)
+        total = await ctx.bot.redis.leaderboards.count("money", ctx.guild)
 
         base = "**Bottom 10 users (in this server):**\n\n```{}```"
 
@@ -216,15 +214,15 @@ class Currency(Cog):
         headers = ["POS", "User", "Currency"]
         table = []
 
-        for n, u in enumerate(users[:10]):
+        for n, (id, money) in enumerate(users):
             try:
-                member = ctx.message.guild.get_member(u.id).name
+                member = ctx.message.guild.get_member(id).name
                 # Unicode and tables suck
                 member = member.encode("ascii", errors="replace").decode()
             except AttributeError:
                 # Prevent race condition - member leaving between command invocation and here
                 continue
-            table.append([len(users) - (n + 1), member, u.money])
+            table.append([total - (n + 1), member, int(money)])
 
         # Format the table.
         table = tabulate.tabulate(table, headers=headers, tablefmt="orgtbl")
@@ -238,7 +236,7 @@ class Currency(Cog):
         """
         Shows the top 10 richest users in this server.
         """
-        users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members, order_by=User.money.desc())
+        users = await ctx.bot.redis.leaderboards.top("money", ctx.guild, 10)
 
         base = "**Top 10 users (in this server):**\n\n```{}```"
 
@@ -246,15 +244,15 @@ class Currency(Cog):
         headers = ["POS", "User", "Currency"]
         table = []
 
-        for n, u in enumerate(users[:10]):
+        for n, (id, money) in enumerate(users):
             try:
-                member = ctx.message.guild.get_member(u.id).name
+                member = ctx.message.guild.get_member(id).name
                 # Unicode and tables suck
                 member = member.encode("ascii", errors="replace").decode()
             except AttributeError:
                 # Prevent race condition - member leaving between command invocation and here
                 continue
-            table.append([n + 1, member, u.money])
+            table.append([n + 1, member, int(money)])
 
         # Format the table.
         table = tabulate.tabulate(table, headers=headers, tablefmt="orgtbl")
@@ -1,8 +1,6 @@
 """
 Reminders cog. Database backed to ensure persistence between bot restarts.
 """
-import asyncio
-import datetime
 import logging
 
 import discord
@@ -10,6 +8,7 @@ from discord.ext import commands
 
 from joku.cogs._common import Cog
 from joku.core.bot import Context
+from joku.core.scheduler import ReminderScheduler
 from joku.core.utils import parse_time
 from joku.db.tables import Reminder
 
@@ -17,72 +16,40 @@ logger = logging.getLogger("Jokusoramame.Reminders")
 
 
 class Reminders(Cog):
-    _is_running_reminders = asyncio.Lock()
+    def __init__(self, bot):
+        super().__init__(bot)
 
-    _currently_running = {}
+        self.scheduler = ReminderScheduler(bot, self._fire_reminder)
+
+    def __unload(self):
+        self.scheduler.stop()
+        self.session.close()
 
     async def _fire_reminder(self, reminder: Reminder):
         """
-        Fires a reminder object to be ran.
+        Sends a reminder that is due.
         """
-        # Wrap everything in a try/finally.
-        try:
-            if reminder.enabled is False:
-                # race conditions?
-                return
-
-            # check to see if the reminder is valid or not
-            channel = self.bot.get_channel(reminder.channel_id)
-            if channel is None:
-                # cancel it
-                self.logger.warning("Reminder channel was empty - not reminding...")
-                await self.bot.database.cancel_reminder(reminder.id)
-                return
-
-            guild = channel.guild  # type: discord.Guild
-            member = guild.get_member(reminder.user_id)
-            if not member:
-                self.logger.warning("Reminder member was dead - not reminding...")
-                await self.bot.database.cancel_reminder(reminder.user_id)
-                return
-
-            self._currently_running[reminder.id] = True
-
-            # lol local time
-            time_left = reminder.reminding_at.timestamp() - datetime.datetime.utcnow().timestamp()
-            # sleep for that many seconds before waking up and sending the messages.
-            await asyncio.sleep(time_left)
-
-            # send the reminder
-            try:
-                await channel.send(":alarm_clock: {}, you wanted to be reminded of: `{}`".format(member.mention,
-                                                                                                 reminder.text))
-            except discord.HTTPException:
-                logger.warning("Failed to send reminder `{}`!".format(reminder.id))
-            finally:
-                # todo: repeating reminders
-                reminder.enabled = False
-
-                # mark it as disabled
-                if reminder.enabled is False:
-                    await self.bot.database.cancel_reminder(reminder.id)
-
-        finally:
-            self._currently_running.pop(reminder.id, None)
+        # check to see if the reminder is valid or not
+        channel = self.bot.get_channel(reminder.channel_id)
+        if channel is None:
+            self.logger.warning("Reminder channel was empty - not reminding...")
+            return
 
-    async def ready(self):
-        if self._is_running_reminders.locked():
+        guild = channel.guild  # type: discord.Guild
+        member = guild.get_member(reminder.user_id)
+        if not member:
+            self.logger.warning("Reminder member was dead - not reminding...")
             return
 
-        async with self._is_running_reminders:
-            while True:
-                # Scan the reminders firing in the next 300 seconds.
-                reminders = await self.bot.database.scan_reminders(within=300)
-                for reminder in reminders:
-                    self.bot.loop.create_task(self._fire_reminder(reminder))
+        # send the reminder
+        try:
+            await channel.send(":alarm_clock: {}, you wanted to be reminded of: `{}`".format(member.mention,
+                                                                                             reminder.text))
+        except discord.HTTPException:
+            logger.warning("Failed to send reminder `{}`!".format(reminder.id))
 
-                # Sleep for 300 seconds afterwards.
-                await asyncio.sleep(300)
+    async def ready(self):
+        await self.scheduler.start()
 
     @commands.command()
     async def remind(self, ctx: Context, tstr: str, *, content: str):
@@ -100,11 +67,7 @@ class Reminders(Cog):
 
         reminder = await ctx.bot.database.create_reminder(ctx.channel, ctx.author, content,
                                                           remind_at=dt)
-        if seconds < 300:
-            # make the reminder immediately.
-            t = self.bot.loop.create_task(self._fire_reminder(reminder))
-        else:
-            t = asyncio.sleep(0)
+        self.scheduler.schedule(reminder)
 
         em = discord.Embed(title="Remembering things so you don't have to")
         em.description = content
@@ -112,7 +75,6 @@ class Reminders(Cog):
         em.timestamp = dt
 
         await ctx.send(embed=em)
-        await t
 
 
 setup = Reminders.setup
@@ -15,29 +15,29 @@ import numpy as np
 import tabulate
 from asyncio_extras import threadpool
 from discord.ext import commands
-import matplotlib as mpl
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-
-from joku.db.tables import Stock, UserStock
-
-mpl.use('Agg')
-
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
 
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.checks import has_permissions
+from joku.core.market import MarketEngine
+from joku.core.plotting import get_pyplot
 
 
 class Stocks(Cog):
     """
     A fake stocks system.
     """
-    _running = False
     _plot_lock = asyncio.Lock()
 
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.market = MarketEngine(bot)
+
+    def __unload(self):
+        self.market.stop()
+        self.session.close()
+
     @staticmethod
     def get_hist_mult(x: int) -> float:
         return x / (10 ** np.ceil(log(x, 10)))
@@ -79,124 +79,11 @@ class Stocks(Cog):
             if self._get_name(channel) == name:
                 return channel
 
-    async def flucutate_stock(self, stock: Stock, remaining: int):
-        """
-        Fluctuates a stock.
-        
-        Returns a 3 item tuple -> price, amount, crashed: bool
-        If crashed is True then price and amount are ignored
-        """
-        channel = self.bot.get_channel(stock.channel_id)
-
-        # 1 crash per 6 hours
-        if self.rng.randint(0, 2880) == 3:
-            return 2.0, stock.amount, False
-
-        # TODO: History multiplier, but properly this time?
-
-        # Initial multiplier is a random amount between 0.1 and 0.5.
-        # No lognormal here, F
-        mult = 0.5 * np.random.rand()
-        # Make it either positive or negative to make the price either decrease or increase.
-        mult = self.rng.choice([-1, 1]) * mult
-        # Add 1 to the mult to make sure it's always positive.
-        mult += 1
-        # Calculate the new final price for the stock.
-        new_price = round(max(2.0, stock.price * mult), 2)
-
-        # Amount calculation.
-        # Get the total amount remaining.
-        if remaining <= 0:
-            # Freeze the stock.
-            return new_price, stock.amount, False
-
-        # Calculate how much to go up or down.
-        dilute = int(np.random.laplace(scale=3))
-        if dilute < 0:
-            # Prevent it from going below the remaining shares.
-            dilute = max(-remaining, dilute)
-
-        # Add the amount on.
-        new_amount = min(13000, max(900, stock.amount + dilute))
-
-        return new_price, new_amount, False
-
     async def ready(self):
         """
         Begins fluctuating stock prices.
         """
-        if self._running:
-            return
-
-        self._running = True
-
-        try:
-            while True:
-                # collect all the guilds that have stocks enabled
-                guilds = await self.bot.database.get_multiple_guilds(*self.bot.guilds)
-                collected = [g for g in guilds if g.stocks_enabled]
-
-                # sleep until the minute
-                t = datetime.datetime.utcnow()
-                sleeptime = 60 - (t.second + t.microsecond / 1000000.0)
-                self.logger.info("Sleeping for {} seconds before changing stocks".format(sleeptime))
-                await asyncio.sleep(sleeptime)
-
-                # void warranty
-
-                stock_mappings = []
-                us_mappings = []
-                coros = []
-                for guild in collected:
-                    try:
-                        guild = self.bot.connection._get_guild(guild.id)  # type: discord.Guild
-                    except:
-                        guild = self.bot._connection._get_guild(guild.id)
-                    if not guild:
-                        continue
-
-                    stocks = await self.bot.database.get_stocks_for(guild)
-                    remaining = await self.bot.database.bulk_get_remaining_stocks(*stocks)
-                    for stock in stocks:
-                        # update the price
-                        channel = guild.get_channel(stock.channel_id)
-                        if channel is None:
-                            continue
-
-                        final_price, \
-                        new_amount, \
-                        crashed = await self.flucutate_stock(stock, remaining.get(stock.channel_id, stock.amount))
-
-                        if crashed:
-                            # should work :fingers_crossed:
-                            for us in stock.users:
-                                us_mappings.append({
-                                    "id": us.id,
-                                    "crashed": True,
-                                    "crashed_at": stock.price
-                                })
-
-                        # edit the stock price
-                        stock_mappings.append({
-                            "channel_id": stock.channel_id,
-                            "price": final_price,
-                            "amount": new_amount
-                        })
-                        await self.bot.redis.update_stock_prices(channel, final_price)
-
-                        self.logger.info("Stock {} gone from value {} -> {}, "
-                                         "amount {} -> {}, crashed: {}".format(stock.channel_id, stock.price,
-                                                                               final_price,
-                                                                               stock.amount, new_amount, crashed))
-
-                async with threadpool():
-                    with self.bot.database.get_session() as sess:
-                        assert isinstance(sess, Session)
-                        sess.bulk_update_mappings(Stock, stock_mappings)
-                        sess.bulk_update_mappings(UserStock, us_mappings)
-
-        finally:
-            self._running = False
+        self.market.start()
 
     async def on_message(self, message: discord.Message):
         # increment history for this channel
@@ -262,40 +149,37 @@ class Stocks(Cog):
             await ctx.send(":x: Stocks are not enabled for this server.")
             return
 
-        users = await ctx.bot.database.get_multiple_users(*ctx.message.guild.members)
+        by = "amount" if what in ("amount", "owned") else "value"
+        # Fetch a few extra, in case some of them have left.
+        rows = await self.market.memoised(
+            ("leaderboard", ctx.guild.id, by),
+            lambda: ctx.bot.database.get_stock_leaderboard(ctx.guild, by=by, limit=20)
+        )
 
-        # Append a column to users holding asset total and asset worth
-        f_users = []
-        for user in users:
-            stocks = await ctx.bot.database.get_user_stocks(user)
-            f_users.append([user, sum(userstock.amount for userstock in stocks),
-                            sum(userstock.amount * userstock.stock.price for userstock in stocks)])
-
-        if (what == "amount") or (what == "owned"):  # order by stock amount
-            f_users = list(sorted(f_users, key=lambda user: user[1], reverse=True))
-        else:  # what == default: order by asset worth
-            f_users = list(sorted(f_users, key=lambda user: user[2], reverse=True))
         base = "**Top 10 users (in this server):**\n\n```{}```"
 
         # Create a table using tabulate.
-        if (what == "amount") or (what == "owned"):
+        if by == "amount":
             headers = ["POS", "User", "Assets Owned"]
         else:  # what = default: order by value of stock worth
             headers = ["POS", "User", "Total Value"]
         table = []
 
-        for n, u in enumerate(f_users[:10]):
-            try:
-                member = ctx.message.guild.get_member(u[0].id).name
-                # Unicode and tables suck
-                member = member.encode("ascii", errors="replace").decode()
-            except AttributeError:
-                # Prevent race condition - member leaving between command invocation and here
+        for row in rows:
+            if len(table) == 10:
+                break
+
+            member = ctx.message.guild.get_member(row["user_id"])
+            if member is None:
+                # They have left since buying.
                 continue
-            if (what == "owned") or (what == "amount"):
-                table.append([n + 1, member, u[1]])
+
+            # Unicode and tables suck
+            name = member.name.encode("ascii", errors="replace").decode()
+            if by == "amount":
+                table.append([len(table) + 1, name, row["owned"]])
             else:
-                table.append([n + 1, member, "§{:.2f}".format(u[2])])
+                table.append([len(table) + 1, name, "§{:.2f}".format(row["value"])])
 
         # Format the table.
         table = tabulate.tabulate(table, headers=headers, tablefmt="orgtbl")
@@ -309,22 +193,20 @@ class Stocks(Cog):
         """
         Controls the stock market for this server.
         """
-        stocks = await ctx.bot.database.get_stocks_for(ctx.guild)
+        snapshot = await self.market.snapshot(ctx.guild)
 
         # OH BOY IT'S TABLE O CLOCK
         headers = ["Name", "Total shares", "Available shares", "Price/share", "%age remaining"]
         rows = []
 
-        async with ctx.channel.typing():
-            for stock in stocks:
-                channel = ctx.guild.get_channel(stock.channel_id)
-                if not channel:
-                    continue
+        for stock in snapshot:
+            channel = ctx.guild.get_channel(stock.channel_id)
+            if not channel:
+                continue
 
-                name = self._get_name(channel)
-                total_available = await ctx.bot.database.get_remaining_stocks(channel)
-                rows.append([name, stock.amount, total_available,
-                             "{:.2f}".format(stock.price), round(((total_available / stock.amount) * 100), 2)])
+            name = self._get_name(channel)
+            rows.append([name, stock.amount, stock.remaining,
+                         "{:.2f}".format(stock.price), round(((stock.remaining / stock.amount) * 100), 2)])
 
         table = tabulate.tabulate(rows, headers=headers, tablefmt="orgtbl", disable_numparse=True)
         await ctx.send("```{}```".format(table))
@@ -351,18 +233,15 @@ class Stocks(Cog):
                          "The **market owned percentage** is what percentage is owned by users.".format(ctx.guild)
 
         # calc market value
-        stocks = await ctx.bot.database.get_stocks_for(ctx.guild)
-        total = sum(stock.amount for stock in stocks)
-        val = sum(stock.amount * stock.price for stock in stocks)
+        snapshot = await self.market.snapshot(ctx.guild)
+        total = snapshot.total_amount
+        val = snapshot.value
+        r = snapshot.total_owned
 
-        em.add_field(name="Stocks available", value=len(stocks))
+        em.add_field(name="Stocks available", value=len(snapshot))
         em.add_field(name="Market value", value="§{:.2f}".format(val))
         em.add_field(name="Individual share cap", value=total // 10)
 
-        async with threadpool():
-            with self.bot.database.get_session() as sess:
-                r = sess.query(func.sum(UserStock.amount)).join(Stock).filter(Stock.guild_id == ctx.guild.id).scalar()
-
         em.add_field(name="Total shares", value=int(total))
 
         perc = (r / total) * 100
@@ -380,13 +259,15 @@ class Stocks(Cog):
         """
         target = target or ctx.author
         stocks = await ctx.bot.database.get_user_stocks(target, guild=ctx.guild)
+        snapshot = await self.market.snapshot(ctx.guild)
 
         headers = ["Name", "Shares", "Share price", "Total value", "%age of stock"]
         rows = []
 
         for userstock in stocks:
-            channel = ctx.guild.get_channel(userstock.stock.channel_id)
-            if not channel:
+            channel = ctx.guild.get_channel(userstock.stock_id)
+            stock = snapshot.get(userstock.stock_id)
+            if not channel or not stock:
                 continue
 
             if userstock.amount <= 0:
@@ -396,12 +277,12 @@ class Stocks(Cog):
                 share_price = "0.0 (Crashed)"
                 total = "0.0 (Crashed)"
             else:
-                share_price = userstock.stock.price
-                total = "{:.2f}".format(float(userstock.amount * userstock.stock.price))
+                share_price = stock.price
+                total = "{:.2f}".format(float(userstock.amount * stock.price))
 
             rows.append([self._get_name(channel), userstock.amount,
                          share_price, total,
-                         "{:.2f}".format((userstock.amount / userstock.stock.amount) * 100)])
+                         "{:.2f}".format((userstock.amount / stock.amount) * 100)])
 
         table = tabulate.tabulate(rows, headers=headers, tablefmt="orgtbl", disable_numparse=True)
         await ctx.send("```{}```".format(table))
@@ -416,8 +297,12 @@ class Stocks(Cog):
             await ctx.send(":x: That stock does not exist.")
             return
 
-        stock = await ctx.bot.database.get_stock(channel)
-        remaining = await ctx.bot.database.get_remaining_stocks(channel)
+        stock = (await self.market.snapshot(ctx.guild)).get(channel.id)
+        if stock is None:
+            await ctx.send(":x: That stock does not exist.")
+            return
+
+        remaining = stock.remaining
 
         last_hour = await ctx.bot.redis.get_historical_prices(channel)
         last_hour_arr = np.array(last_hour)
@@ -489,14 +374,20 @@ class Stocks(Cog):
             await ctx.send(":x: That stock does not exist.")
             return
 
+        snapshot = await self.market.snapshot(ctx.guild)
+        stock = snapshot.get(channel.id)
+        if stock is None:
+            await ctx.send(":x: That stock does not exist.")
+            return
+
         amnt = sum(us.amount for us in (await ctx.bot.database.get_user_stocks(ctx.author, guild=ctx.guild)) if us)
-        total = sum(stock.amount for stock in (await ctx.bot.database.get_stocks_for(ctx.guild)))
+        total = snapshot.total_amount
         if amnt > total // 10:
             await ctx.channel.send(":x: Monopolies do nothing but hurt the environment "
                                    "(you need less than `{}` total shares to buy any more).".format(total // 10))
             return
 
-        total_available = await ctx.bot.database.get_remaining_stocks(channel)
+        total_available = stock.remaining
         if total_available < 1:
             await ctx.send(":x: This stock is all sold out.")
             return
@@ -505,7 +396,6 @@ class Stocks(Cog):
             await ctx.send(":x: Cannot buy more shares than are in existence.")
             return
 
-        stock = await ctx.bot.database.get_stock(channel)
         us = await ctx.bot.database.get_user_stock(ctx.author, channel)
 
         if us and us.crashed is True and us.amount >= 1:
@@ -530,6 +420,7 @@ class Stocks(Cog):
             return
 
         await ctx.bot.database.change_user_stock_amount(ctx.author, channel, amount=amount, crashed=False)
+        self.market.invalidate(ctx.guild.id)
         await ctx.send(":heavy_check_mark: Brought {} stocks for `§{:.2f}`. ".format(amount, price))
 
     @stocks.command()
@@ -561,6 +452,7 @@ class Stocks(Cog):
                            "You have lost `§{:.2f}`, and all your shares in this stock.".format(absorbed))
             await ctx.bot.database.change_user_stock_amount(ctx.author, channel, amount=-us.amount, update_price=False,
                                                             crashed=False)
+            self.market.invalidate(ctx.guild.id)
             await ctx.bot.database.update_user_currency(ctx.author, currency_to_add=-absorbed)
 
             return
@@ -582,6 +474,7 @@ class Stocks(Cog):
         tax = int(tax)
 
         await ctx.bot.database.change_user_stock_amount(ctx.author, channel, amount=-amount)
+        self.market.invalidate(ctx.guild.id)
         await ctx.bot.database.update_user_currency(ctx.author, -tax)
         await ctx.send(":heavy_check_mark: Sold {} stocks for `§{:.2f}`. "
                        "Additionally, you paid `§{}` tax on this.".format(amount, us.stock.price * amount, tax))
@@ -624,6 +517,9 @@ class Stocks(Cog):
         async with ctx.channel.typing():
             async with self._plot_lock:
                 async with threadpool():
+                    plt = get_pyplot()
+                    from matplotlib import cm
+
                     # calculate the dates
                     dates = [arrow.now(pytz.UTC).replace(minutes=-i) for i in range(0, len(tds[0][1]))]
                     dates = list(reversed([dt.strftime("%H:%M") for dt in dates]))
@@ -718,6 +614,8 @@ class Stocks(Cog):
                 guild.stocks_enabled = True
                 sess.merge(guild)
 
+        self.market.invalidate(ctx.guild.id)
+
         await ctx.send(":heavy_check_mark: Injected `§{}` into the market over `{}` stocks.".format(round(
             total_value, 2), count))
 
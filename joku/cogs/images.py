@@ -6,7 +6,6 @@ import random
 from io import BytesIO
 
 import aiohttp
-import aiopixiv
 import arrow
 import discord
 import pytz
@@ -26,11 +25,21 @@ class Images(Cog):
     def __init__(self, bot):
         super().__init__(bot)
 
-        # This is the authentciated API.
-        self.pixiv = aiopixiv.PixivAPIv5()
+        self._pixiv_api = None
 
         self.sess = aiohttp.ClientSession(loop=asyncio.get_event_loop())
 
+    @property
+    def pixiv(self):
+        """
+        The authenticated pixiv API, created on first use.
+        """
+        if self._pixiv_api is None:
+            import aiopixiv
+            self._pixiv_api = aiopixiv.PixivAPIv5()
+
+        return self._pixiv_api
+
     @commands.group(pass_context=True, invoke_without_command=True, name="pixiv")
     async def _pixiv(self, ctx: Context):
         """
@@ -8,7 +8,6 @@ from urllib.parse import urlencode
 import aiohttp
 import discord
 import functools
-import googlemaps
 import pprint
 from bingmaps.apiservices import TrafficIncidentsApi
 from discord.ext import commands
@@ -40,8 +39,18 @@ class Location(Cog):
     def __init__(self, bot: Jokusoramame):
         super().__init__(bot=bot)
 
-        # Create the google maps client.
-        self.maps = googlemaps.Client(key=self.bot.config["maps_api_key"])
+        self._maps = None
+
+    @property
+    def maps(self):
+        """
+        The google maps client, created on first use.
+        """
+        if self._maps is None:
+            import googlemaps
+            self._maps = googlemaps.Client(key=self.bot.config["maps_api_key"])
+
+        return self._maps
 
     def make_mq_request(self, **kwargs):
         kwargs["key"] = self.bot.config["mapquest_api_key"]
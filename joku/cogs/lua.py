@@ -2,12 +2,8 @@
 A lua interpreter cog.
 """
 import asyncio
-import functools
-import pickle
 
-import lupa
 # this will error on pycharm, until it generates the right skeleton. Ignroe it.
-import os
 from lupa import LuaRuntime
 
 from discord.ext import commands
@@ -15,68 +11,7 @@ from discord.ext import commands
 from joku.cogs._common import Cog
 from joku.core.bot import Context
 from joku.core.checks import is_owner
-from joku.core.mp2 import ProcessPoolExecutor
-
-NO_RESULT = type("NO_RESULT", (object,), {})
-
-with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "luasandbox.lua")) as f:
-    sandbox_preamble = f.read()
-
-
-# Useful function stubs
-def getter(obj, attr_name):
-    raise AttributeError("Python object attribute retrieval is forbidden")
-
-
-def setter(obj, attr_name, value):
-    raise AttributeError("Python object attribute setting is forbidden")
-
-
-def dictify_table_recursively(t):
-    """
-    Turns a table into a dict.
-    """
-    d = {}
-
-    for (k, v) in t.items():
-        typ = lupa.lua_type(v)
-        print(k, v, typ)
-        if lupa.lua_type(v) == "table":
-            d[k] = dictify_table_recursively(v)
-        else:
-            d[k] = str(v)
-
-    return d
-
-
-def exec_lua(code: str):
-    # the attribute_handlers are probably enough to prevent access eval otherwise
-    lua = LuaRuntime(register_eval=False,
-                     unpack_returned_tuples=True,
-                     attribute_handlers=(getter, setter))
-
-    # execute the sandbox preamble
-    sandbox = lua.execute(sandbox_preamble)
-
-    # call sandbox.run with `glob.sandbox, code`
-    # and unpack the variables
-    _ = sandbox.run(code, lua.table_from({}))
-    if isinstance(_, bool):
-        # idk
-        return NO_RESULT
-
-    called, result = _
-
-    if lupa.lua_type(result) == 'table':
-        # dictify
-        result = dictify_table_recursively(result)
-
-    try:
-        pickle.dumps(result)
-    except:
-        return str(result)
-
-    return result
+from joku.core.pool import SandboxError
 
 
 class Lua(Cog):
@@ -89,8 +24,6 @@ class Lua(Cog):
 
         self.lua = LuaRuntime(unpack_returned_tuples=True)
 
-        self.mp_pool = ProcessPoolExecutor(max_workers=4)
-
     @commands.group(name="lua")
     async def _lua(self, ctx: Context):
         """
@@ -132,14 +65,13 @@ class Lua(Cog):
 
         async with ctx.channel.typing():
             try:
-                fut = self.bot.loop.run_in_executor(self.mp_pool, exec_lua, code)
-                result = await asyncio.wait_for(fut, timeout=5.0, loop=self.bot.loop)
-            except asyncio.CancelledError:
+                result = await self.bot.sandbox_pool.run_lua(code, timeout=5.0)
+            except asyncio.TimeoutError:
                 final = "Timed out waiting for result."
-            except (lupa.LuaSyntaxError, lupa.LuaError) as e:
+            except SandboxError as e:
                 final = str(e)
             else:
-                if result is NO_RESULT:
+                if result is None:
                     final = "Code executed, but returned nothing."
                 else:
                     final = result
@@ -12,6 +12,7 @@ from joku.cogs._common import Cog
 from joku.core import checks
 from joku.core.bot import Context
 from joku.core.checks import mod_command, bot_has_permissions
+from joku.core.prefix import PREFIX_SETTING
 from joku.core.utils import get_role
 
 
@@ -22,7 +23,9 @@ class Moderation(Cog):
 
     async def on_member_remove(self, member: discord.Member):
         # Rolestate
-        await self.bot.database.save_rolestate(member)
+        setting = await self.bot.database.get_setting(member.guild, "rolestate")
+        if self.str_to_bool(setting):
+            await self.bot.database.save_rolestate(member)
 
     async def on_member_join(self, member: discord.Member):
         # Rolestate
@@ -135,6 +138,35 @@ class Moderation(Cog):
         else:
             await ctx.channel.send(":heavy_check_mark: Banned user {}.".format(user.name))
 
+    @commands.command(pass_context=True)
+    @checks.has_permissions(manage_guild=True)
+    @mod_command()
+    async def prefix(self, ctx: Context, *, prefix: str = None):
+        """
+        Sets a custom command prefix for this server, alongside the normal ones.
+
+        Use `none` to remove it. Mod commands still need the mod prefix (`j::`).
+        """
+        if prefix is None:
+            current = await ctx.bot.database.get_setting(ctx.guild, PREFIX_SETTING)
+            if current:
+                await ctx.channel.send("The custom prefix is currently `{}`.".format(current))
+            else:
+                await ctx.channel.send("This server has no custom prefix.")
+            return
+
+        if prefix.lower() == "none":
+            await ctx.bot.database.set_setting(ctx.guild, PREFIX_SETTING, "")
+            await ctx.channel.send(":heavy_check_mark: Removed the custom prefix.")
+            return
+
+        if len(prefix) > 10:
+            await ctx.channel.send(":x: Prefixes can be at most 10 characters.")
+            return
+
+        await ctx.bot.database.set_setting(ctx.guild, PREFIX_SETTING, prefix)
+        await ctx.channel.send(":heavy_check_mark: Set the custom prefix to `{}`.".format(prefix))
+
     @commands.group(pass_context=True, invoke_without_command=True)
     @checks.has_permissions(manage_guild=True, manage_roles=True)
     @mod_command()
@@ -320,27 +352,78 @@ class Moderation(Cog):
     async def massnick(self, ctx: Context, prefix: str = "", suffix: str = ""):
         """
         Mass-nicknames an entire server.
+
+        If a previous run with the same prefix and suffix was cancelled, it carries on from where it stopped.
         """
-        coros = []
+        key = (ctx.guild.id, "massnick")
+        job = ctx.bot.bulk.get(key)
+        if job is not None and job.running:
+            await ctx.channel.send(":x: A mass nickname is already running (`{}/{}` done).".format(job.done,
+                                                                                                  job.total))
+            return
+
+        me = ctx.guild.me
+        forbidden = too_long = 0
+        members = []
+
+        # Skip anything that would fail, or do nothing, without making a request for it.
+        for member in ctx.guild.members:
+            nick = prefix + member.name + suffix
+            if member == ctx.guild.owner or (member != me and member.top_role >= me.top_role):
+                forbidden += 1
+            elif len(nick) > 32:
+                too_long += 1
+            elif member.nick != nick:
+                members.append(member)
+
+        async def edit(member: discord.Member):
+            await member.edit(nick=prefix + member.name + suffix)
 
-        for member in ctx.message.guild.members:
-            coros.append(member.edit(nick=prefix + member.name + suffix))
+        status = await ctx.channel.send(":hourglass: Updating nicknames...")
 
-        fut = asyncio.gather(*coros, return_exceptions=True, loop=ctx.bot.loop)
+        async def progress(job):
+            await status.edit(content=":hourglass: Updated `{}/{}` nicknames...".format(job.done, job.total))
 
-        async with ctx.channel.typing():
-            await fut
+        try:
+            job = await ctx.bot.bulk.run(key, members, edit, params=(prefix, suffix), progress=progress)
+        except RuntimeError:
+            # Another run started whilst the members were being checked.
+            job = ctx.bot.bulk.get(key)
+            await status.edit(content=":x: A mass nickname is already running (`{}/{}` done).".format(job.done,
+                                                                                                     job.total))
+            return
 
-        count = sum(1 for i in fut.result() if not isinstance(i, Exception))
-        forbidden = sum(1 for i in fut.result() if isinstance(i, discord.Forbidden))
-        httperror = sum(1 for i in fut.result() if isinstance(i, discord.HTTPException)) - forbidden
-        failed = ctx.message.guild.member_count - count
+        count = job.succeeded
+        forbidden += job.count_failed(discord.Forbidden)
+        httperror = too_long + job.count_failed(discord.HTTPException) - job.count_failed(discord.Forbidden)
+        failed = forbidden + httperror
+
+        if job.cancelled:
+            await status.edit(
+                content=":x: Cancelled after updating `{}/{}` nicknames. Run the same command again to carry "
+                        "on.".format(job.done, job.total)
+            )
+            return
 
-        await ctx.channel.send(
-            ":heavy_check_mark: Updated `{}` nicknames - failed to change `{}` nicknames. "
-            "(`{}` forbidden, `{}` too long/other)".format(count, failed, forbidden, httperror)
+        await status.edit(
+            content=":heavy_check_mark: Updated `{}` nicknames - failed to change `{}` nicknames. "
+                    "(`{}` forbidden, `{}` too long/other)".format(count, failed, forbidden, httperror)
         )
 
+    @commands.command(pass_context=True)
+    @checks.has_permissions(manage_nicknames=True)
+    @mod_command()
+    async def bulkcancel(self, ctx: Context):
+        """
+        Cancels any mass operations running on this server.
+        """
+        cancelled = sum(1 for job in ctx.bot.bulk.jobs_for(ctx.guild.id) if ctx.bot.bulk.cancel(job.key))
+        if not cancelled:
+            await ctx.channel.send(":x: Nothing is running on this server.")
+            return
+
+        await ctx.channel.send(":heavy_check_mark: Cancelled `{}` operations.".format(cancelled))
+
     def str_to_bool(self, s: str):
         if s is None:
             return False
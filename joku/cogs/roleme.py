@@ -225,6 +225,12 @@ class Roleme(Cog):
         """
         Cleans out old colourme roles for users no longer in the server.
         """
+        key = (ctx.guild.id, "colourme_clean")
+        job = ctx.bot.bulk.get(key)
+        if job is not None and job.running:
+            await ctx.send(":x: A clean is already running (`{}/{}` done).".format(job.done, job.total))
+            return
+
         async with threadpool():
             with ctx.bot.database.get_session() as sess:
                 assert isinstance(sess, Session)
@@ -232,17 +238,30 @@ class Roleme(Cog):
 
         modchoice_enabled = await ctx.bot.database.get_setting(ctx.guild,
                                                                "colourme_modchoice_enabled")
+        to_remove = []
+        for usercolour in roles:
+            member = ctx.guild.get_member(usercolour.user_id)
+            if member is None or modchoice_enabled:
+                role = ctx.guild.roles.find | (lambda r: r.id == usercolour.role_id)
+                if not role:
+                    continue
+
+                to_remove.append(role)
+
         removed = []
-        async with ctx.channel.typing():
-            for usercolour in roles:
-                member = ctx.guild.get_member(usercolour.user_id)
-                if member is None or modchoice_enabled:
-                    role = ctx.guild.roles.find | (lambda r: r.id == usercolour.role_id)
-                    if not role:
-                        continue
 
-                    await role.delete()
-                    removed.append(role)
+        async def delete(role: discord.Role):
+            await role.delete()
+            removed.append(role)
+
+        try:
+            async with ctx.channel.typing():
+                job = await ctx.bot.bulk.run(key, to_remove, delete)
+        except RuntimeError:
+            # Another clean started whilst the roles were being looked up.
+            job = ctx.bot.bulk.get(key)
+            await ctx.send(":x: A clean is already running (`{}/{}` done).".format(job.done, job.total))
+            return
 
         rids = [role.id for role in removed]
 
@@ -251,6 +270,10 @@ class Roleme(Cog):
                 assert isinstance(sess, Session)
                 sess.query(UserColour).filter(UserColour.role_id.in_(rids)).delete()
 
+        if job.cancelled:
+            await ctx.send(":x: Cancelled after deleting `{}/{}` roles.".format(len(removed), job.total))
+            return
+
         await ctx.send(":heavy_check_mark: Deleted `{}` roles.".format(len(removed)))
 
     @colourme.command(aliases=['add'])
@@ -3,6 +3,7 @@ Generic tag bot, yay.
 """
 import asyncio
 import copy
+import datetime
 import shlex
 import traceback
 
@@ -15,6 +16,16 @@ from joku.core.bot import Context, Jokusoramame
 from joku.core.tagengine import TagEngine
 
 
+def _datetime_fields(name: str, dt: datetime.datetime) -> dict:
+    """
+    Converts a naive UTC datetime into template arguments: an ISO 8601 string, and a Unix timestamp.
+    """
+    if dt is None:
+        return {name: None, name + "_timestamp": None}
+
+    return {name: dt.isoformat(), name + "_timestamp": dt.replace(tzinfo=datetime.timezone.utc).timestamp()}
+
+
 class Tags(Cog):
     def __init__(self, bot: Jokusoramame):
         super().__init__(bot)
@@ -197,17 +208,20 @@ class Tags(Cog):
         cmd = cmd.split(" ")[0]
 
         # Create the arguments for the template.
-
+        # These are sent to the sandbox as JSON, so everything is converted to a plain value here. Datetimes are ISO
+        # 8601 strings, with a matching Unix timestamp, and colours are their integer value.
         guild = {"name": ctx.message.guild.name, "icon_url": ctx.message.guild.icon_url,
                  "id": ctx.message.guild.id, "member_count": ctx.message.guild.member_count,
-                 "created_at": ctx.message.guild.created_at}
-
-        author = {"name": ctx.message.author.name, "nick": ctx.message.author.nick,
-                  "discriminator": ctx.message.author.discriminator, "id": ctx.message.author.id,
-                  "colour": ctx.message.author.colour, "mention": ctx.message.author.mention,
-                  "permissions": ctx.message.channel.permissions_for(ctx.message.author),
-                  "guild_permissions": ctx.message.author.guild_permissions,
-                  "joined_at": ctx.message.author.joined_at, "created_at": ctx.message.author.created_at,
+                 **_datetime_fields("created_at", ctx.message.guild.created_at)}
+
+        member = ctx.message.author
+        author = {"name": member.name, "nick": member.nick,
+                  "discriminator": member.discriminator, "id": member.id,
+                  "colour": member.colour.value, "mention": member.mention,
+                  "permissions": dict(ctx.message.channel.permissions_for(member)),
+                  "guild_permissions": dict(member.guild_permissions),
+                  **_datetime_fields("joined_at", member.joined_at),
+                  **_datetime_fields("created_at", member.created_at),
                   "guild": guild}
 
         channel = {"name": ctx.message.channel.name, "id": ctx.message.channel.id,
@@ -6,7 +6,7 @@ from discord.ext import commands
 
 from joku.cogs._common import Cog
 from joku.core.bot import Context
-from joku.core.utils import paginate_table
+from joku.core.utils import iter_table_pages
 
 
 class Todos(Cog):
@@ -30,7 +30,7 @@ class Todos(Cog):
         for item in todos:
             rows.append([item["priority"], item["content"]])
 
-        pages = paginate_table(rows, headers)
+        pages = iter_table_pages(rows, headers)
 
         await ctx.channel.send(header)
         for page in pages:
@@ -4,7 +4,6 @@ Wikipedia cog.
 from urllib.parse import urlencode, quote
 
 import discord
-import wikipedia
 from discord.ext import commands
 
 from joku.cogs._common import Cog
@@ -31,6 +30,7 @@ class Wikipedia(Cog):
         """
         Looks something up on Wikipedia.
         """
+        import wikipedia
 
         def _get_wp_page():
             # always preload so that we dont accidentally block
@@ -74,6 +74,8 @@ class Wikipedia(Cog):
         """
         Searches for something on wikipedia.
         """
+        import wikipedia
+
         async with ctx.channel.typing():
             result = await self.bot.loop.run_in_executor(None, wikipedia.search, search_str)
 
@@ -4,7 +4,6 @@ Main bot class.
 import asyncio
 import itertools
 import logging
-import sys
 import time
 import traceback
 from collections import OrderedDict
@@ -18,11 +17,17 @@ from discord.ext.commands import AutoShardedBot, CheckFailure, CommandInvokeErro
     CommandOnCooldown, \
     MissingRequiredArgument, UserInputError, Command, Group
 from kyoukai import Kyoukai
-from logbook import StreamHandler
 from logbook.compat import redirect_logging
 
+from joku.core.bulk import BulkExecutor
 from joku.core.commands import DoNotRun
+from joku.core.log import MESSAGE_CHANNEL, setup_logging
+from joku.core.memberindex import MemberIndex
+from joku.core.prefix import MOD_PREFIXES, PrefixResolver
+from joku.core.pool import SandboxPool
 from joku.core.redis import RedisAdapter
+from joku.core.startup import StartupProfile
+from joku.db.cache import INVALIDATION_CHANNEL
 from joku.db.interface import DatabaseInterface
 
 try:
@@ -32,8 +37,6 @@ except ImportError:
 
 redirect_logging()
 
-StreamHandler(sys.stderr).push_application()
-
 
 class Jokusoramame(AutoShardedBot):
     def __init__(self, config_file: str, *args, **kwargs):
@@ -49,9 +52,17 @@ class Jokusoramame(AutoShardedBot):
             self.config = yaml.load(f, Loader=yaml.Loader)
 
         # Logging stuff
+        log_config = self.config.get("logging", {})
+        self.log_handler = setup_logging(log_config)
+
         self.logger = logbook.Logger("Jokusoramame")
         self.logger.level = logbook.INFO
 
+        # Every message is only logged if asked for, either everywhere or for specific guilds.
+        self.message_logger = logbook.Logger(MESSAGE_CHANNEL)
+        self.log_all_messages = log_config.get("messages", {}).get("all", False)
+        self.message_log_guilds = set(log_config.get("messages", {}).get("guilds", []))
+
         logging.root.setLevel(logging.INFO)
 
         # Call init.
@@ -63,11 +74,29 @@ class Jokusoramame(AutoShardedBot):
         self.invite_url = ""
 
         self.startup_time = time.time()
+        # How long each part of startup took.
+        self.startup_profile = StartupProfile(self.startup_time)
 
         # Create our connections.
-        self.database = DatabaseInterface(self)
+        if self.config.get("db_backend", "threadpool") == "asyncpg":
+            from joku.db.native import AsyncpgDatabaseInterface
+            self.database = AsyncpgDatabaseInterface(self)
+        else:
+            self.database = DatabaseInterface(self)
         self.redis = RedisAdapter(self)
 
+        # The worker processes used for running Lua and tags.
+        self.sandbox_pool = SandboxPool(self, **self.config.get("sandbox_pool", {}))
+
+        # Matches command prefixes, including custom ones.
+        self.prefix_resolver = PrefixResolver(self)
+
+        # Which guilds each user is in, for looking up members by ID.
+        self.member_index = MemberIndex(self)
+
+        # Runs mass operations, such as massnick.
+        self.bulk = BulkExecutor(self, **self.config.get("bulk", {}))
+
         # Re-assign commands and extensions.
         self.all_commands = OrderedDict()
         self.extensions = OrderedDict()
@@ -102,15 +131,22 @@ class Jokusoramame(AutoShardedBot):
         """
         Gets a member from all members.
         """
-        return discord.utils.get(self.get_all_members(), id=id)
+        return self.member_index.get_member(id)
 
     @staticmethod
     async def get_command_prefix(self: 'Jokusoramame', message: discord.Message):
-        if self.config.get("developer_mode", False):
-            # Use `jd!` prefix.
-            return ["jd!", "jd::"]
+        return await self.prefix_resolver.get_prefixes(message)
+
+    def add_command(self, command: Command):
+        from joku.core.checks import md_check
+
+        # Work out which commands need the mod prefix once, rather than on every invocation.
+        command.mod_only = md_check in command.checks
+        if isinstance(command, Group):
+            for subcommand in command.walk_commands():
+                subcommand.mod_only = md_check in subcommand.checks
 
-        return ["j" + s for s in ["!", "?", "::", "->"]] + ["J" + s for s in ["!", "?", "::", "->"]]
+        super().add_command(command)
 
     async def rotate_game_text(self):
         for i in itertools.cycle(self.config.get("game_rotation", [])):
@@ -182,9 +218,8 @@ class Jokusoramame(AutoShardedBot):
             self.config = yaml.load(f, Loader=yaml.Loader)
 
     def _global_check(self, ctx: 'Context'):
-        from joku.core.checks import md_check
-        if ctx.prefix.endswith("::") and ctx.command.name != "help":
-            if md_check not in ctx.command.checks:
+        if ctx.prefix in MOD_PREFIXES and ctx.command.name != "help":
+            if not getattr(ctx.command, "mod_only", False):
                 raise DoNotRun(":x: This command requires the normal prefix (`j!`).")
 
         return True
@@ -195,19 +230,44 @@ class Jokusoramame(AutoShardedBot):
         else:
             await self.rotate_game_text()
 
+    async def _timed(self, name: str, coro):
+        with self.startup_profile.phase(name):
+            return await coro
+
     async def on_ready(self):
         # Only ever load once.
         if self.loaded is True:
             return
 
-        self.loaded = False
+        self.loaded = True
+
+        profile = self.startup_profile
+        profile.record("gateway", time.time() - profile.started)
 
         self.logger.info("Loaded Jokusoramame, logged in as {}#{}.".format(self.user.name,
                                                                            self.user.discriminator))
         self.logger.info("Guilds: {}".format(len(self.guilds)))
-        self.logger.info("Users: {}".format(len(set(self.get_all_members()))))
+        with profile.phase("member index"):
+            self.logger.info("Users: {}".format(self.member_index.rebuild()))
+
+        # None of these depend on each other, so wait on them all at once.
+        app_info, db_result, redis_result = await asyncio.gather(
+            self._timed("application info", self.application_info()),
+            self._timed("postgres", self.database.connect(self.config.get("dsn", None))),
+            self._timed("redis", self.redis.connect(**self.config.get("redis", {}))),
+            return_exceptions=True
+        )
+
+        for name, result in (("PostgreSQL", db_result), ("Redis", redis_result)):
+            if isinstance(result, Exception):
+                self.logger.error("Unable to connect to {}!".format(name))
+                traceback.print_exception(type(result), result, result.__traceback__)
+                await self.logout()
+                return
+
+        if isinstance(app_info, Exception):
+            raise app_info
 
-        app_info = await self.application_info()
         self.app_id = app_info.id
         self.owner_id = app_info.owner.id
 
@@ -219,21 +279,21 @@ class Jokusoramame(AutoShardedBot):
 
         self.logger.info("Invite link: {}".format(discord.utils.oauth_url(self.invite_url)))
 
+        # Listen for cache invalidations from other processes.
+        with profile.phase("subscribe"):
+            await self.redis.subscribe(INVALIDATION_CHANNEL, self.database.handle_invalidation)
+
+        # Load every guild's event settings up front, as member joins and leaves read them.
         try:
-            await self.database.connect(self.config.get("dsn", None))
+            with profile.phase("event settings"):
+                count = await self.database.event_cache.preload(guild.id for guild in self.guilds)
         except Exception:
-            self.logger.error("Unable to connect to PostgreSQL!")
-            traceback.print_exc()
-            await self.logout()
-            return
+            self.logger.exception("Failed to preload event settings!")
+        else:
+            self.logger.info("Preloaded event settings for {} guilds.".format(count))
 
-        try:
-            await self.redis.connect(**self.config.get("redis", {}))
-        except ConnectionRefusedError:
-            self.logger.error("Unable to connect to Redis!")
-            traceback.print_exc()
-            await self.logout()
-            return
+        # Build or re-index the leaderboards in the background.
+        self.loop.create_task(self.redis.leaderboards.sync())
 
         autoload = self.config.get("autoload", [])
         if "joku.cogs.core" not in autoload:
@@ -241,7 +301,8 @@ class Jokusoramame(AutoShardedBot):
 
         for cog in autoload:
             try:
-                self.load_extension(cog)
+                with profile.phase(cog):
+                    self.load_extension(cog)
             except Exception as e:
                 self.logger.exception("Failed to load cog {}!".format(cog))
             else:
@@ -255,38 +316,79 @@ class Jokusoramame(AutoShardedBot):
                 self.loop.create_task(cog.ready())
 
         self.logger.info("Booting up Kyoukai internal webserver...")
-        # always add oauth2 bp
-        from joku.web.oauth import bp as oauth2_bp
-        self.webserver.register_blueprint(oauth2_bp)
-        from joku.web.root import root as root_bp
-        self.webserver.register_blueprint(root_bp)
-
-        self.webserver.finalize()
-        ws_cfg = self.config.get("webserver", {})
-        try:
-            await self.webserver.start(ip=ws_cfg.get("ip", "127.0.0.1"),
-                                       port=ws_cfg.get("port", 4444))
-        except Exception as e:
-            self.logger.exception("Failed to load Kyoukai!")
-
-        new_time = time.time() - self.startup_time
-
-        self.logger.info("Bot ready in {} seconds.".format(new_time))
+        with profile.phase("webserver"):
+            # always add oauth2 bp
+            from joku.web.oauth import bp as oauth2_bp
+            self.webserver.register_blueprint(oauth2_bp)
+            from joku.web.root import root as root_bp
+            self.webserver.register_blueprint(root_bp)
+
+            self.webserver.finalize()
+            ws_cfg = self.config.get("webserver", {})
+            try:
+                await self.webserver.start(ip=ws_cfg.get("ip", "127.0.0.1"),
+                                           port=ws_cfg.get("port", 4444))
+            except Exception as e:
+                self.logger.exception("Failed to load Kyoukai!")
+
+        self.logger.info("Bot ready in {:.3f} seconds.".format(profile.finish()))
+        for line in profile.report():
+            self.logger.info("  {}".format(line))
+
+    def _log_message(self, message: Message):
+        guild = message.guild
+        # The message is formatted later, off the event loop.
+        self.message_logger.info(
+            "Received message: {0.content} from {0.author.display_name} ({0.author.name}) on #{0.channel}", message,
+            extra={
+                "message_id": message.id,
+                "author_id": message.author.id,
+                "bot": message.author.bot,
+                "channel_id": message.channel.id,
+                "guild_id": guild.id if guild is not None else None,
+            }
+        )
 
     async def on_message(self, message: Message):
-        self.logger.info("Recieved message: {message.content} "
-                         "from {message.author.display_name} ({message.author.name}){bot}"
-                         .format(message=message, bot=" [BOT]" if message.author.bot else ""))
-        self.logger.info(" On channel: #{message.channel.name}".format(message=message))
-
-        if message.guild is not None:
-            self.logger.info(" On server: {} ({})".format(message.guild.name, message.guild.id))
+        if self.log_all_messages or (message.guild is not None and message.guild.id in self.message_log_guilds):
+            self._log_message(message)
 
         # if await self.database.is_channel_ignored(message.channel, type_="commands"):
         #    return
 
         await super().on_message(message)
 
+    # Keep the member index and the leaderboards' guild membership up to date.
+    async def on_member_join(self, member: discord.Member):
+        self.member_index.add(member.guild.id, member.id)
+
+        if not member.bot:
+            await self.redis.leaderboards.add_members(member.guild.id, [member.id])
+
+    async def on_member_remove(self, member: discord.Member):
+        self.member_index.remove(member.guild.id, member.id)
+        await self.redis.leaderboards.remove_members(member.guild.id, [member.id])
+
+    async def on_guild_available(self, guild: discord.Guild):
+        # Guilds that come back after an outage, or finish chunking late, may have members we haven't seen.
+        self.member_index.add_guild(guild)
+
+    async def on_guild_join(self, guild: discord.Guild):
+        self.member_index.add_guild(guild)
+        await self.redis.leaderboards.index_guild(guild)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.member_index.remove_guild(guild)
+        await self.redis.leaderboards.reset_guild(guild.id)
+
+    async def close(self):
+        await self.database.close()
+        await self.redis.close()
+        self.sandbox_pool.close()
+        await super().close()
+        # Write out anything still queued.
+        self.log_handler.close()
+
     def run(self):
         token = self.config["bot_token"]
         super().run(token)
@@ -0,0 +1,217 @@
+"""
+Bulk actions against the Discord API, such as editing every member of a guild.
+
+Every action in a job usually hits the same route bucket (e.g. every member edit in a guild shares one), so firing
+them all at once only queues them up behind the bucket's lock, thousands at a time. Instead, each job is worked
+through by a small number of workers, bounded across every job by a global limit, and never holds more than a few
+requests in flight.
+"""
+import asyncio
+import collections
+import time
+import typing
+
+import discord
+import logbook
+
+logger = logbook.Logger("Jokusoramame.Bulk")
+
+
+class BulkJob(object):
+    """
+    A bulk action that is being worked through.
+
+    A job that was cancelled keeps its place, so it can be resumed.
+    """
+
+    def __init__(self, key: tuple, items: typing.Sequence, params: typing.Hashable = None):
+        #: The key of this job. The first item is the guild ID.
+        self.key = key
+
+        #: The items this job acts on.
+        self.items = items
+
+        #: What this job was started with, so that it is only resumed by the same action.
+        self.params = params
+
+        #: The index of the next item.
+        self.position = 0
+
+        #: The number of items acted on successfully.
+        self.succeeded = 0
+
+        #: Exception class -> the number of items that failed with it.
+        self.failed = collections.Counter()
+
+        #: Is this job currently running?
+        self.running = False
+
+        #: Has this job been cancelled?
+        self.cancelled = False
+
+        self.started = time.monotonic()
+
+        # Items that need trying again, because they were rate limited.
+        self._retry = collections.deque()
+
+    def __repr__(self):
+        return "<BulkJob key={} done={}/{}>".format(self.key, self.done, self.total)
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    @property
+    def done(self) -> int:
+        """
+        :return: The number of items that have been acted on, successfully or not.
+        """
+        return self.succeeded + sum(self.failed.values())
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.items) and not self._retry
+
+    def count_failed(self, exc_type: typing.Type[Exception]) -> int:
+        """
+        :return: The number of items that failed with an exception of this type, or a subclass.
+        """
+        return sum(count for (kind, count) in self.failed.items() if issubclass(kind, exc_type))
+
+    def _next(self):
+        if self._retry:
+            return self._retry.popleft()
+
+        item = self.items[self.position]
+        self.position += 1
+        return item
+
+
+class BulkExecutor(object):
+    """
+    Runs bulk jobs with bounded concurrency.
+    """
+
+    def __init__(self, bot, *, workers: int = 2, max_concurrency: int = 10, retry_after: float = 5):
+        self.bot = bot
+
+        #: The number of requests each job can have in flight.
+        self.workers = workers
+
+        #: The number of seconds to wait after being rate limited, before trying again.
+        self.retry_after = retry_after
+
+        # Bounds requests across every job, so that many jobs at once don't hit the global rate limit.
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._jobs = {}  # type: typing.Dict[tuple, BulkJob]
+
+    def get(self, key: tuple) -> typing.Union[BulkJob, None]:
+        """
+        Gets a job that is running, or was cancelled part way through.
+        """
+        return self._jobs.get(key)
+
+    def jobs_for(self, guild_id: int) -> typing.List[BulkJob]:
+        """
+        Gets every running or resumable job for a guild.
+        """
+        return [job for (key, job) in self._jobs.items() if key[0] == guild_id]
+
+    def cancel(self, key: tuple) -> bool:
+        """
+        Cancels a running job. Requests that are in flight are allowed to finish.
+
+        :return: If a job was cancelled.
+        """
+        job = self._jobs.get(key)
+        if job is None or not job.running:
+            return False
+
+        job.cancelled = True
+        return True
+
+    async def _worker(self, job: BulkJob, action: typing.Callable[[typing.Any], typing.Awaitable]):
+        while not job.cancelled and not job.finished:
+            item = job._next()
+            rate_limited = False
+
+            async with self._global:
+                try:
+                    await action(item)
+                except discord.HTTPException as e:
+                    if e.response is not None and e.response.status == 429:
+                        # The library gave up retrying, so try it again later.
+                        rate_limited = True
+                    else:
+                        job.failed[type(e)] += 1
+                except Exception as e:
+                    logger.exception("Bulk action {} failed on {}".format(job.key, item))
+                    job.failed[type(e)] += 1
+                else:
+                    job.succeeded += 1
+
+            if rate_limited:
+                # Back off without holding up the other jobs, and only hand the item back afterwards, so that no
+                # other worker retries it early.
+                try:
+                    await asyncio.sleep(self.retry_after)
+                finally:
+                    job._retry.append(item)
+
+    async def _report(self, job: BulkJob, progress: typing.Callable[[BulkJob], typing.Awaitable], interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await progress(job)
+            except Exception:
+                logger.exception("Failed to report progress for {}".format(job.key))
+
+    async def run(self, key: tuple, items: typing.Iterable, action: typing.Callable[[typing.Any], typing.Awaitable],
+                  *, params: typing.Hashable = None,
+                  progress: typing.Callable[[BulkJob], typing.Awaitable] = None,
+                  interval: float = 5) -> BulkJob:
+        """
+        Runs an action on every item, at the rate the API allows.
+
+        If a job with the same key and params was cancelled part way through, it is resumed from where it stopped
+        instead, and ``items`` is ignored.
+
+        :param key: The key for this job. The first item must be the guild ID.
+        :param action: Called with each item.
+        :param params: What the action was made from, for deciding if a job can be resumed.
+        :param progress: Called with the job every ``interval`` seconds whilst it runs.
+        :return: The job, once it has finished or been cancelled.
+        :raises RuntimeError: If a job with this key is already running.
+        """
+        job = self._jobs.get(key)
+        if job is not None and job.running:
+            raise RuntimeError("A bulk job for {} is already running".format(key))
+
+        if job is None or job.params != params:
+            job = BulkJob(key, list(items), params)
+            self._jobs[key] = job
+
+        job.running = True
+        job.cancelled = False
+
+        reporter = None
+        if progress is not None:
+            reporter = self.bot.loop.create_task(self._report(job, progress, interval))
+
+        try:
+            await asyncio.gather(*(self._worker(job, action) for _ in range(self.workers)))
+        finally:
+            job.running = False
+            if reporter is not None:
+                reporter.cancel()
+
+            # Only cancelled jobs are kept, to be resumed.
+            if job.finished or not job.cancelled:
+                self._jobs.pop(key, None)
+
+        logger.info("Bulk job {} finished: {} succeeded, {} failed in {:.2f}s{}".format(
+            key, job.succeeded, sum(job.failed.values()), time.monotonic() - job.started,
+            " (cancelled)" if job.cancelled else ""
+        ))
+
+        return job
@@ -4,6 +4,7 @@ Specific checks.
 from discord.ext.commands import CheckFailure, check
 
 from joku.core.commands import DoNotRun
+from joku.core.prefix import MOD_PREFIXES
 
 
 def is_owner(ctx):
@@ -49,7 +50,7 @@ def bot_has_permissions(**perms):
 
 
 def md_check(ctx):
-    if ctx.prefix not in ["j::", "J::", "jd::"]:
+    if ctx.prefix not in MOD_PREFIXES:
         raise DoNotRun(":x: This command requires the mod prefix (`j::`).")
 
     return True
@@ -57,7 +58,7 @@ def md_check(ctx):
 
 def non_md_check(ctx):
     # never directly added to a class
-    if ctx.prefix in ["j::", "J::", "jd::"]:
+    if ctx.prefix in MOD_PREFIXES:
         raise DoNotRun(":x: This command requires the normal prefix (`j!`).")
 
     return True
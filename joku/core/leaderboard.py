@@ -0,0 +1,347 @@
+"""
+Per-guild XP and money leaderboards, kept in Redis sorted sets.
+
+XP and money are global, so every score lives in one global sorted set per field (``lb:xp``, ``lb:money``). Each
+guild has its own sorted sets (``lb:xp:<guild>``, ``lb:money:<guild>``) holding the scores of its members, and each
+user has a set of the guilds they are in (``lb:guilds:<user>``), so that a score change can be fanned out to every
+guild the user is in without the client knowing which those are.
+
+Ranks are then a ZREVRANK, and the top N users a ZREVRANGE, instead of loading every member of the guild from the
+database.
+"""
+import asyncio
+import typing
+
+import aioredis
+import discord
+
+#: The fields that have leaderboards.
+FIELDS = ("xp", "money")
+
+#: The number of users or scores sent to Redis in one command.
+CHUNK_SIZE = 1000
+
+# Sets the scores of users, in the global set and every guild they are in.
+# ARGV[1] is the field, followed by pairs of user ID and score.
+SET_SCORES_SCRIPT = """
+local field = ARGV[1]
+for i = 2, #ARGV, 2 do
+    local user, score = ARGV[i], ARGV[i + 1]
+    redis.call("ZADD", "lb:" .. field, score, user)
+    for _, guild in ipairs(redis.call("SMEMBERS", "lb:guilds:" .. user)) do
+        redis.call("ZADD", "lb:" .. field .. ":" .. guild, score, user)
+    end
+end
+return 1
+"""
+
+# Adds users to a guild's leaderboards, with their current scores.
+# ARGV[1] is the guild ID, followed by user IDs.
+ADD_MEMBERS_SCRIPT = """
+local guild = ARGV[1]
+for i = 2, #ARGV do
+    local user = ARGV[i]
+    redis.call("SADD", "lb:members:" .. guild, user)
+    redis.call("SADD", "lb:guilds:" .. user, guild)
+    for _, field in ipairs({"xp", "money"}) do
+        local score = redis.call("ZSCORE", "lb:" .. field, user)
+        if score then
+            redis.call("ZADD", "lb:" .. field .. ":" .. guild, score, user)
+        end
+    end
+end
+return 1
+"""
+
+# Removes users from a guild's leaderboards.
+# ARGV[1] is the guild ID, followed by user IDs.
+REMOVE_MEMBERS_SCRIPT = """
+local guild = ARGV[1]
+for i = 2, #ARGV do
+    local user = ARGV[i]
+    redis.call("SREM", "lb:members:" .. guild, user)
+    redis.call("SREM", "lb:guilds:" .. user, guild)
+    redis.call("ZREM", "lb:xp:" .. guild, user)
+    redis.call("ZREM", "lb:money:" .. guild, user)
+end
+return 1
+"""
+
+# Removes everything indexed for a guild.
+# ARGV[1] is the guild ID.
+RESET_GUILD_SCRIPT = """
+local guild = ARGV[1]
+for _, user in ipairs(redis.call("SMEMBERS", "lb:members:" .. guild)) do
+    redis.call("SREM", "lb:guilds:" .. user, guild)
+end
+redis.call("DEL", "lb:members:" .. guild, "lb:xp:" .. guild, "lb:money:" .. guild)
+return 1
+"""
+
+# Decays the scores of users, mirroring a decay applied in the database.
+# Scores above the floor or below zero become ceil(score * e^rate). Users whose score has since moved out of that range
+# are left alone.
+# ARGV[1] is the field, ARGV[2] the rate, and ARGV[3] the floor, followed by user IDs.
+DECAY_SCRIPT = """
+local field = ARGV[1]
+local mult = math.exp(tonumber(ARGV[2]))
+local floor = tonumber(ARGV[3])
+local key = "lb:" .. field
+
+for i = 4, #ARGV do
+    local user = ARGV[i]
+    local score = tonumber(redis.call("ZSCORE", key, user))
+    if score and (score > floor or score < 0) then
+        score = math.ceil(score * mult)
+        redis.call("ZADD", key, score, user)
+        for _, guild in ipairs(redis.call("SMEMBERS", "lb:guilds:" .. user)) do
+            redis.call("ZADD", key .. ":" .. guild, score, user)
+        end
+    end
+end
+return 1
+"""
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Leaderboards(object):
+    """
+    Keeps the leaderboard sorted sets in sync with the database.
+
+    Scores are written through with :meth:`set_scores` whenever the database changes them, and guild membership is
+    updated from member join and leave events.
+    """
+
+    def __init__(self, redis):
+        #: The :class:`~.RedisAdapter` this uses.
+        self.redis = redis
+
+        self._ready = False
+        self._lock = asyncio.Lock()
+
+    def _key(self, field: str, guild_id: int = None) -> str:
+        if field not in FIELDS:
+            raise ValueError("Unknown leaderboard field {}".format(field))
+
+        if guild_id is None:
+            return "lb:{}".format(field)
+
+        return "lb:{}:{}".format(field, guild_id)
+
+    # region Writes
+    async def set_scores(self, field: str, scores: typing.Mapping[int, float]):
+        """
+        Sets the scores of users, in every guild they are in.
+
+        :param field: The field these are scores for.
+        :param scores: A mapping of user ID -> new score.
+        """
+        if self.redis.pool is None or not scores:
+            return
+
+        self._key(field)
+        pairs = [item for user_id, score in scores.items() for item in (user_id, score)]
+
+        async with self.redis.get_redis() as redis:
+            for chunk in _chunks(pairs, CHUNK_SIZE * 2):
+                await self.redis.eval_script(redis, SET_SCORES_SCRIPT, args=[field] + chunk)
+
+    async def decay(self, field: str, rate: float, floor: int):
+        """
+        Decays every score above the floor or below zero to ceil(score * e^rate), in every guild.
+
+        The users to decay are read in chunks, then decayed a chunk per script call, so that Redis isn't blocked for
+        the whole decay at once.
+        """
+        if self.redis.pool is None:
+            return
+
+        key = self._key(field)
+
+        async with self.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            # Scores are whole numbers, so these are the same as (floor, +inf) and (-inf, 0).
+            user_ids = []
+            for (low, high) in ((floor + 1, float("inf")), (float("-inf"), -1)):
+                offset = 0
+                while True:
+                    got = await redis.zrangebyscore(key, low, high, offset=offset, count=CHUNK_SIZE)
+                    user_ids.extend(got)
+                    if len(got) < CHUNK_SIZE:
+                        break
+
+                    offset += CHUNK_SIZE
+
+            for chunk in _chunks(user_ids):
+                await self.redis.eval_script(redis, DECAY_SCRIPT, args=[field, repr(rate), floor] + chunk)
+
+    async def add_members(self, guild_id: int, member_ids: typing.Sequence[int]):
+        """
+        Adds members to a guild's leaderboards.
+        """
+        if self.redis.pool is None:
+            return
+
+        async with self.redis.get_redis() as redis:
+            for chunk in _chunks(list(member_ids)):
+                await self.redis.eval_script(redis, ADD_MEMBERS_SCRIPT, args=[guild_id] + chunk)
+
+    async def remove_members(self, guild_id: int, member_ids: typing.Sequence[int]):
+        """
+        Removes members from a guild's leaderboards.
+        """
+        if self.redis.pool is None:
+            return
+
+        async with self.redis.get_redis() as redis:
+            for chunk in _chunks(list(member_ids)):
+                await self.redis.eval_script(redis, REMOVE_MEMBERS_SCRIPT, args=[guild_id] + chunk)
+
+    async def reset_guild(self, guild_id: int):
+        """
+        Removes a guild's leaderboards.
+        """
+        if self.redis.pool is None:
+            return
+
+        async with self.redis.get_redis() as redis:
+            await self.redis.eval_script(redis, RESET_GUILD_SCRIPT, args=[guild_id])
+
+    async def index_guild(self, guild: discord.Guild):
+        """
+        Rebuilds a guild's leaderboards from its current members.
+        """
+        await self.reset_guild(guild.id)
+        await self.add_members(guild.id, [member.id for member in guild.members if not member.bot])
+
+    # endregion
+
+    # region Rebuilding
+    async def _rebuild(self) -> int:
+        self._ready = False
+        rows = await self.redis.bot.database.get_leaderboard_scores()
+
+        async with self.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            await redis.delete("lb:ready", *(self._key(field) for field in FIELDS))
+            for field in FIELDS:
+                for chunk in _chunks(rows):
+                    pairs = [item for row in chunk for item in (row[field], row["id"])]
+                    await redis.zadd(self._key(field), *pairs)
+
+        for guild in self.redis.bot.guilds:
+            await self.index_guild(guild)
+
+        async with self.redis.get_redis() as redis:
+            await redis.set("lb:ready", b"1")
+
+        self._ready = True
+        self.redis.logger.info("Rebuilt leaderboards for {} users in {} guilds.".format(len(rows),
+                                                                                       len(self.redis.bot.guilds)))
+        return len(rows)
+
+    async def rebuild(self) -> int:
+        """
+        Rebuilds every leaderboard from the database.
+
+        :return: The number of users indexed.
+        """
+        async with self._lock:
+            return await self._rebuild()
+
+    async def sync(self):
+        """
+        Brings the leaderboards up to date on startup.
+
+        If they have never been built, they are rebuilt from the database. Otherwise, only guild membership is
+        re-indexed, as members may have joined or left whilst the bot was offline.
+        """
+        async with self._lock:
+            if self._ready:
+                return
+
+            async with self.redis.get_redis() as redis:
+                built = await redis.exists("lb:ready")
+
+            if not built:
+                await self._rebuild()
+                return
+
+            for guild in self.redis.bot.guilds:
+                await self.index_guild(guild)
+
+            self._ready = True
+
+    async def _ensure_ready(self):
+        if not self._ready:
+            await self.sync()
+
+    # endregion
+
+    # region Reads
+    async def rank(self, field: str, guild: discord.Guild, member_id: int) -> typing.Tuple[typing.Optional[int], int]:
+        """
+        Gets the rank of a member in a guild.
+
+        :return: A tuple of (0-based rank, or None if they are not ranked, number of ranked members).
+        """
+        await self._ensure_ready()
+        key = self._key(field, guild.id)
+
+        async with self.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            pipe = redis.pipeline()
+            pipe.zrevrank(key, member_id)
+            pipe.zcard(key)
+            rank, total = await pipe.execute()
+
+        return rank, total
+
+    async def top(self, field: str, guild: discord.Guild, count: int = 10, *,
+                  lowest: bool = False) -> typing.List[typing.Tuple[int, float]]:
+        """
+        Gets the highest (or lowest) ranked members of a guild.
+
+        :return: A list of (user ID, score) tuples, in rank order.
+        """
+        await self._ensure_ready()
+        key = self._key(field, guild.id)
+
+        async with self.redis.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            if lowest:
+                got = await redis.zrange(key, 0, count - 1, withscores=True)
+            else:
+                got = await redis.zrevrange(key, 0, count - 1, withscores=True)
+
+        return [(int(member), score) for (member, score) in got]
+
+    async def count(self, field: str, guild: discord.Guild) -> int:
+        """
+        Gets the number of ranked members in a guild.
+        """
+        await self._ensure_ready()
+
+        async with self.redis.get_redis() as redis:
+            return await redis.zcard(self._key(field, guild.id))
+
+    async def scores(self, field: str, guild: discord.Guild) -> typing.List[float]:
+        """
+        Gets every score in a guild, from highest to lowest.
+        """
+        await self._ensure_ready()
+
+        async with self.redis.get_redis() as redis:
+            got = await redis.zrevrange(self._key(field, guild.id), 0, -1, withscores=True)
+
+        return [score for (member, score) in got]
+
+    # endregion
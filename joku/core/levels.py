@@ -0,0 +1,99 @@
+"""
+Levelling maths.
+
+The XP needed to reach level n + 1 is U(n) = a * (n * (n + 1) / 2), a ∈ ℝ, a > 0. Solving that for n is done with an
+integer square root, instead of finding the roots of a polynomial on every message.
+"""
+import typing
+
+import numpy as np
+
+try:
+    from math import isqrt
+except ImportError:  # Python < 3.8
+    def isqrt(n: int) -> int:
+        """
+        Gets the integer square root of n, the largest integer r such that r * r <= n.
+        """
+        if n < 0:
+            raise ValueError("isqrt() argument must be nonnegative")
+
+        if n == 0:
+            return 0
+
+        # Newton's method, starting from a power of two above the root.
+        x = 1 << ((n.bit_length() + 1) // 2)
+        while True:
+            y = (x + n // x) // 2
+            if y >= x:
+                return x
+            x = y
+
+#: The levelling up constant.
+INCREASING_FACTOR = 50
+
+
+def get_exp_for_level(level: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    Gets the total XP needed to advance past a level.
+
+    :param level: The level.
+    :param a: The levelling up constant.
+    """
+    # n * (n + 1) is always even.
+    return a * (level * (level + 1) // 2)
+
+
+def get_level_from_exp(xp: int, a: int = INCREASING_FACTOR) -> int:
+    """
+    Gets the level from the experience number.
+
+    :param xp: The XP this user currently has.
+    :param a: The levelling up constant.
+    """
+    xp = int(xp)
+    if xp < a:
+        # Level 1
+        return 1
+
+    # The level is one more than the largest n with a * n * (n + 1) / 2 <= xp.
+    # That rearranges to (2n + 1)^2 <= (a + 8 * xp) / a, and as the left side is an integer, the right side can be
+    # floored.
+    root = isqrt((a + 8 * xp) // a)
+    return (root - 1) // 2 + 1
+
+
+def get_next_exp_required(xp: int, a: int = INCREASING_FACTOR) -> typing.Tuple[int, int]:
+    """
+    Gets the EXP required for the next level, based on the current EXP.
+
+    :param xp: The XP this user currently has.
+    :param a: The levelling up constant.
+    :return: The current level, and the amount of XP required for the next level.
+    """
+    if xp < a:
+        return 1, a - xp
+
+    current_level = get_level_from_exp(xp, a)
+    return current_level, get_exp_for_level(current_level, a) - xp
+
+
+def get_levels_from_exp(xp: np.ndarray, a: int = INCREASING_FACTOR) -> np.ndarray:
+    """
+    Gets the levels for an array of experience numbers at once.
+
+    This gives the same results as :func:`get_level_from_exp`, for recomputing levels in bulk.
+
+    :param xp: An array of XP values.
+    :param a: The levelling up constant.
+    :return: An array of levels.
+    """
+    xp = np.asarray(xp, dtype=np.int64)
+    n = (a + 8 * np.maximum(xp, 0)) // a
+
+    # The float square root can be one out for large values, so correct it.
+    root = np.sqrt(n).astype(np.int64)
+    root -= root * root > n
+    root += (root + 1) * (root + 1) <= n
+
+    return np.where(xp < a, 1, (root - 1) // 2 + 1)
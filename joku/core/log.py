@@ -0,0 +1,114 @@
+"""
+Logging setup.
+
+Records are filtered on the event loop, which is cheap, and then handed to a background thread through a queue. The
+thread does the formatting and the writing, so the loop never waits on the terminal.
+"""
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+import typing
+
+import logbook
+from logbook.queues import ThreadedWrapperHandler
+
+#: The channel for per-message logs, which are only emitted for guilds that have opted in.
+MESSAGE_CHANNEL = "Jokusoramame.Messages"
+
+
+def json_formatter(record: logbook.LogRecord, handler: logbook.Handler) -> str:
+    """
+    Formats a record as a single line of JSON.
+    """
+    data = {
+        "time": record.time.replace(tzinfo=datetime.timezone.utc).isoformat(),
+        "level": record.level_name,
+        "channel": record.channel,
+        "message": record.message,
+    }
+
+    if record.extra:
+        data.update(record.extra)
+
+    if record.exc_info:
+        data["exception"] = record.formatted_exception
+
+    return json.dumps(data, default=str)
+
+
+class SamplingFilter(object):
+    """
+    Samples and rate limits records by channel.
+
+    Records at WARNING or above are always let through.
+    """
+
+    def __init__(self, sample: typing.Dict[str, float] = None, rate_limit: typing.Dict[str, float] = None):
+        #: Channel -> the fraction of records to keep.
+        self.sample = sample or {}
+
+        #: Channel -> the maximum number of records per second to keep.
+        self.rate_limit = rate_limit or {}
+
+        #: Channel -> the number of records dropped.
+        self.dropped = {}
+
+        # Channel -> (tokens, last refilled at)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _drop(self, channel: str) -> bool:
+        self.dropped[channel] = self.dropped.get(channel, 0) + 1
+        return False
+
+    def _take_token(self, channel: str, rate: float) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(channel, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+
+            if tokens < 1:
+                self._buckets[channel] = (tokens, now)
+                return False
+
+            self._buckets[channel] = (tokens - 1, now)
+            return True
+
+    def __call__(self, record: logbook.LogRecord, handler: logbook.Handler) -> bool:
+        if record.level >= logbook.WARNING:
+            return True
+
+        channel = record.channel
+
+        rate = self.sample.get(channel)
+        if rate is not None and random.random() >= rate:
+            return self._drop(channel)
+
+        limit = self.rate_limit.get(channel)
+        if limit is not None and not self._take_token(channel, limit):
+            return self._drop(channel)
+
+        return True
+
+
+def setup_logging(config: dict) -> ThreadedWrapperHandler:
+    """
+    Sets up the application wide log handler.
+
+    :param config: The ``logging`` section of the config.
+    :return: The handler, so that it can be closed on shutdown.
+    """
+    # The wrapper forwards its filter to this handler, so it is still called before records are queued.
+    stream = logbook.StreamHandler(sys.stderr, level=config.get("level", "INFO"),
+                                   filter=SamplingFilter(config.get("sample"), config.get("rate_limit")))
+    if config.get("format", "text") == "json":
+        stream.formatter = json_formatter
+
+    # Records that don't fit in the queue are dropped, rather than blocking.
+    handler = ThreadedWrapperHandler(stream, maxsize=config.get("queue_size", 10000))
+    handler.push_application()
+
+    return handler
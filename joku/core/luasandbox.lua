@@ -189,10 +189,13 @@ function sandbox.enable_memory_limit()
   end
   local mt = {__gc = function (u)
     if sandbox.mem_limit_reached then
+      sandbox._memory_tracking_enabled = false
       error("script uses too much memory")
     end
     if collectgarbage("count") > sandbox.mem_limit then
       sandbox.mem_limit_reached = true
+      -- the chain stops here, so the next run has to start it again
+      sandbox._memory_tracking_enabled = false
       error("script uses too much memory")
     else
       -- create a new object for the next GC cycle
@@ -235,6 +238,31 @@ function sandbox.create_coroutine(f, ...)
 end
 
 
+-------------------------------------------------------------
+--
+-- Creates a fresh environment for a run.
+--
+-- The library tables are copied too, so nothing a script does to its
+-- environment is visible to the next one.
+--
+function sandbox.new_env(l)
+  local env = {}
+  for k, v in pairs(sandbox.env) do
+    if type(v) == "table" then
+      local copy = {}
+      for k2, v2 in pairs(v) do copy[k2] = v2 end
+      env[k] = copy
+    else
+      env[k] = v
+    end
+  end
+
+  -- copy locals into the env
+  for k, v in pairs(l) do env[k] = v end
+  return env
+end
+
+
 -------------------------------------------------------------
 --
 -- Lua 5.2 sandbox.
@@ -243,18 +271,30 @@ end
 -- call the runtime becomes restricted in CPU and memory, and
 -- "string":methods() like "foo":upper() stop working.
 --
+-- The runtime is meant to be reused, so every run gets a fresh
+-- environment and fresh limits.
+--
 function sandbox.run(untrusted_code, l)
   sandbox.fix_metatables()
+  sandbox.instruction_count = 0
+  sandbox.mem_limit_reached = false
   sandbox.enable_memory_limit()
-  sandbox.enable_per_instruction_limits()
-
-  -- copy locals into sandbox env
-  for k,v in pairs(l) do sandbox.env[k] = v end
 
   local untrusted_function, message = load(untrusted_code, nil, 't',
-                                          sandbox.env)
+                                          sandbox.new_env(l))
   if not untrusted_function then return nil, message end
-  return pcall(untrusted_function)
+
+  sandbox.enable_per_instruction_limits()
+  local result = table.pack(pcall(untrusted_function))
+  debug.sethook()
+
+  return table.unpack(result, 1, result.n)
+end
+
+
+-- The size of the Lua heap, in KB.
+function sandbox.memory()
+  return collectgarbage("count")
 end
 
 return sandbox
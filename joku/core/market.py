@@ -0,0 +1,253 @@
+"""
+The stock market tick engine.
+
+Every minute, the whole market is loaded in one query, fluctuated as NumPy arrays, and written back with one bulk
+update and one Redis pipeline.
+"""
+import asyncio
+import collections
+import datetime
+import time
+import typing
+
+import numpy as np
+
+#: The chance of a stock crashing each tick.
+CRASH_CHANCE = 1 / 2881
+
+#: The price a crashed stock is reset to.
+CRASH_PRICE = 2.0
+
+#: The lowest a price can fluctuate to.
+MIN_PRICE = 2.0
+
+#: The bounds on the number of shares in a stock.
+MIN_AMOUNT = 900
+MAX_AMOUNT = 13000
+
+
+def fluctuate(prices: np.ndarray, amounts: np.ndarray, remaining: np.ndarray,
+              rng: np.random.RandomState) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Fluctuates every stock in the market at once.
+
+    :param prices: The current price of each stock.
+    :param amounts: The total number of shares in each stock.
+    :param remaining: The number of shares in each stock that nobody owns.
+    :return: A tuple of (new prices, new amounts).
+    """
+    n = len(prices)
+
+    # Initial multiplier is a random amount between 0 and 0.5.
+    # Make it either positive or negative to make the price either decrease or increase, then add 1 to the mult to
+    # make sure it's always positive.
+    mult = 1 + rng.choice([-1, 1], size=n) * 0.5 * rng.rand(n)
+    new_prices = np.round(np.maximum(MIN_PRICE, prices * mult), 2)
+
+    # Calculate how much to go up or down.
+    dilute = np.trunc(rng.laplace(scale=3, size=n)).astype(np.int64)
+    # Prevent it from going below the remaining shares.
+    dilute = np.where(dilute < 0, np.maximum(-remaining, dilute), dilute)
+    new_amounts = np.clip(amounts + dilute, MIN_AMOUNT, MAX_AMOUNT)
+    # Sold out stocks are frozen.
+    new_amounts = np.where(remaining <= 0, amounts, new_amounts)
+
+    crashed = rng.rand(n) < CRASH_CHANCE
+    new_prices = np.where(crashed, CRASH_PRICE, new_prices)
+    new_amounts = np.where(crashed, amounts, new_amounts)
+
+    return new_prices, new_amounts
+
+
+class StockSnapshot(object):
+    """
+    The state of a single stock at some point in a tick.
+    """
+    __slots__ = ("channel_id", "price", "amount", "owned")
+
+    def __init__(self, channel_id: int, price: float, amount: int, owned: int):
+        self.channel_id = channel_id
+        self.price = price
+        self.amount = amount
+        self.owned = owned
+
+    @property
+    def remaining(self) -> int:
+        """
+        :return: The number of shares that nobody owns.
+        """
+        return self.amount - self.owned
+
+    def __repr__(self):
+        return "<StockSnapshot channel_id={} price={} amount={} owned={}>".format(self.channel_id, self.price,
+                                                                                 self.amount, self.owned)
+
+
+class MarketSnapshot(object):
+    """
+    The state of every stock in a guild.
+    """
+
+    def __init__(self, rows: typing.Iterable[typing.Mapping[str, typing.Any]]):
+        self._stocks = collections.OrderedDict(
+            (row["channel_id"], StockSnapshot(row["channel_id"], row["price"], row["amount"], row["owned"]))
+            for row in rows
+        )
+
+    def __iter__(self) -> typing.Iterator[StockSnapshot]:
+        return iter(self._stocks.values())
+
+    def __len__(self):
+        return len(self._stocks)
+
+    def get(self, channel_id: int) -> typing.Union[StockSnapshot, None]:
+        """
+        Gets the snapshot of a stock, or None if the channel isn't a stock.
+        """
+        return self._stocks.get(channel_id)
+
+    @property
+    def total_amount(self) -> int:
+        """
+        :return: The total number of shares in the market.
+        """
+        return sum(stock.amount for stock in self)
+
+    @property
+    def total_owned(self) -> int:
+        """
+        :return: The total number of shares owned by users.
+        """
+        return sum(stock.owned for stock in self)
+
+    @property
+    def value(self) -> float:
+        """
+        :return: The value of every share in the market.
+        """
+        return sum(stock.amount * stock.price for stock in self)
+
+
+class MarketEngine(object):
+    """
+    Ticks the stock market for every guild with stocks enabled.
+
+    Anything derived from market state can be memoised with :meth:`memoised`, and is kept until the next tick.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        #: The number of ticks that have happened.
+        self.tick = 0
+
+        self.rng = np.random.RandomState()
+
+        self._memo = {}
+        # Bumped on every invalidation, so that values which raced with one aren't stored.
+        self._generation = 0
+        self._task = None  # type: asyncio.Task
+
+    # region Memoisation
+    async def memoised(self, key: tuple, factory: typing.Callable[[], typing.Awaitable]):
+        """
+        Gets a value for this tick, computing it with factory if needed.
+
+        :param key: The memo key. The second item must be the guild ID, so that it can be invalidated.
+        """
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+
+        tick, generation = self.tick, self._generation
+        value = await factory()
+        # Don't store something computed from stale state.
+        if tick == self.tick and generation == self._generation:
+            self._memo[key] = value
+
+        return value
+
+    def invalidate(self, guild_id: int):
+        """
+        Drops memoised values for a guild, after something changed its market.
+        """
+        self._generation += 1
+        for key in [k for k in self._memo if k[1] == guild_id]:
+            del self._memo[key]
+
+    async def snapshot(self, guild) -> MarketSnapshot:
+        """
+        Gets the snapshot of a guild's market for this tick.
+        """
+        return await self.memoised(
+            ("snapshot", guild.id),
+            lambda: self._load_snapshot(guild)
+        )
+
+    async def _load_snapshot(self, guild) -> MarketSnapshot:
+        return MarketSnapshot(await self.bot.database.get_market_snapshot(guild))
+
+    # endregion
+
+    def _stock_exists(self, guild_id: int, channel_id: int) -> bool:
+        guild = self.bot.get_guild(guild_id)
+        return guild is not None and guild.get_channel(channel_id) is not None
+
+    async def step(self) -> int:
+        """
+        Runs one tick of the market.
+
+        :return: The number of stocks that were changed.
+        """
+        before = time.perf_counter()
+
+        rows = await self.bot.database.get_market()
+        rows = [row for row in rows if self._stock_exists(row["guild_id"], row["channel_id"])]
+
+        if rows:
+            channel_ids = [row["channel_id"] for row in rows]
+            prices = np.array([row["price"] for row in rows], dtype=np.float64)
+            amounts = np.array([row["amount"] for row in rows], dtype=np.int64)
+            owned = np.array([row["owned"] for row in rows], dtype=np.int64)
+
+            new_prices, new_amounts = fluctuate(prices, amounts, amounts - owned, self.rng)
+            new_prices, new_amounts = new_prices.tolist(), new_amounts.tolist()
+
+            await self.bot.database.bulk_update_stocks(channel_ids, new_prices, new_amounts)
+            await self.bot.redis.bulk_update_stock_prices(dict(zip(channel_ids, new_prices)))
+
+        self.tick += 1
+        self._memo.clear()
+
+        self.bot.logger.info("Market tick {} changed {} stocks in {:.2f}ms"
+                             .format(self.tick, len(rows), (time.perf_counter() - before) * 1000))
+
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            # sleep until the minute
+            t = datetime.datetime.utcnow()
+            sleeptime = 60 - (t.second + t.microsecond / 1000000.0)
+            await asyncio.sleep(sleeptime)
+
+            try:
+                await self.step()
+            except Exception:
+                self.bot.logger.exception("Failed to tick the stock market!")
+
+    def start(self):
+        """
+        Starts ticking the market every minute.
+        """
+        if self._task is None:
+            self._task = self.bot.loop.create_task(self._run())
+
+    def stop(self):
+        """
+        Stops ticking the market.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
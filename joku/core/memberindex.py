@@ -0,0 +1,122 @@
+"""
+A bot-wide index of which guilds each user is in.
+
+Only IDs are stored. Most users share a single guild with the bot, so they map straight to that guild's ID. Users in
+several guilds map to an array of guild IDs. Members are looked up through the guilds, so that the index never holds
+on to member objects.
+"""
+import typing
+from array import array
+
+import discord
+
+
+class MemberIndex(object):
+    """
+    Maps user IDs to the IDs of the guilds they are in.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        # user ID -> guild ID, or array of guild IDs
+        self._guilds = {}  # type: typing.Dict[int, typing.Union[int, array]]
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._guilds
+
+    def add(self, guild_id: int, user_id: int):
+        """
+        Records that a user is in a guild.
+        """
+        current = self._guilds.get(user_id)
+        if current is None:
+            self._guilds[user_id] = guild_id
+        elif isinstance(current, int):
+            if current != guild_id:
+                self._guilds[user_id] = array("Q", (current, guild_id))
+        elif guild_id not in current:
+            current.append(guild_id)
+
+    def remove(self, guild_id: int, user_id: int):
+        """
+        Records that a user has left a guild.
+        """
+        current = self._guilds.get(user_id)
+        if current is None:
+            return
+
+        if isinstance(current, int):
+            if current == guild_id:
+                del self._guilds[user_id]
+        elif guild_id in current:
+            current.remove(guild_id)
+            if len(current) == 1:
+                self._guilds[user_id] = current[0]
+
+    def add_guild(self, guild: discord.Guild):
+        """
+        Indexes every member of a guild.
+        """
+        for member in guild.members:
+            self.add(guild.id, member.id)
+
+    def remove_guild(self, guild: discord.Guild):
+        """
+        Removes every member of a guild from the index.
+        """
+        for member in guild.members:
+            self.remove(guild.id, member.id)
+
+    def rebuild(self) -> int:
+        """
+        Rebuilds the index from every guild.
+
+        :return: The number of unique users.
+        """
+        self._guilds = {}
+        for guild in self.bot.guilds:
+            self.add_guild(guild)
+
+        return len(self)
+
+    def guild_ids(self, user_id: int) -> typing.Tuple[int, ...]:
+        """
+        Gets the IDs of every guild a user is in.
+        """
+        current = self._guilds.get(user_id)
+        if current is None:
+            return ()
+
+        if isinstance(current, int):
+            return current,
+
+        return tuple(current)
+
+    def get_members(self, user_id: int) -> typing.List[discord.Member]:
+        """
+        Gets a user's member object in every guild they are in.
+        """
+        members = []
+        for guild_id in self.guild_ids(user_id):
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild is not None else None
+            if member is not None:
+                members.append(member)
+
+        return members
+
+    def get_member(self, user_id: int) -> typing.Union[discord.Member, None]:
+        """
+        Gets a user's member object in any guild they are in.
+        """
+        for guild_id in self.guild_ids(user_id):
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild is not None else None
+            if member is not None:
+                return member
+
+        return None
@@ -0,0 +1,23 @@
+"""
+Lazy access to matplotlib.
+
+matplotlib and seaborn take a long time to import, and are only needed when something is plotted, so cogs get them
+from here on first use rather than at import time.
+"""
+_pyplot = None
+
+
+def get_pyplot():
+    """
+    Gets ``matplotlib.pyplot``, using the non-interactive Agg backend.
+    """
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib as mpl
+        # This has to happen before pyplot is imported.
+        mpl.use('Agg')
+
+        import matplotlib.pyplot as plt
+        _pyplot = plt
+
+    return _pyplot
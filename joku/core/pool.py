@@ -0,0 +1,426 @@
+"""
+A bot-wide pool of sandbox worker processes, for running Lua and Jinja2 tags.
+
+Requests and results are plain JSON over pipes, so nothing but strings, numbers, lists and dicts ever crosses the
+process boundary. Every task has a hard timeout; a worker that is still running when its task times out is killed and
+replaced, rather than being left to spin.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import multiprocessing
+import resource
+import signal
+import statistics
+import time
+import typing
+
+import logbook
+
+logger = logbook.Logger("Jokusoramame.Pool")
+
+# Workers are forked, as spawning would re-import the launcher (and the whole bot) in every worker.
+# They never touch anything they inherit apart from their end of the pipe.
+_mp = multiprocessing.get_context("fork")
+
+
+class SandboxError(Exception):
+    """
+    Raised when code fails inside a sandbox worker.
+    """
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+
+        #: The name of the exception raised in the worker.
+        self.kind = kind
+
+
+def _handle(request: dict) -> dict:
+    """
+    Runs a request inside a worker.
+    """
+    # Imported here, so that the parent process doesn't need to load Lua or Jinja2 just to import the pool.
+    from joku.core import sandbox, templates
+
+    kind = request["kind"]
+    if kind == "lua":
+        result = sandbox.run_lua(request["code"], request.get("kwargs"))
+        if result is sandbox.NO_RESULT:
+            return {"result": None}
+
+        return {"result": str(result)}
+
+    if kind == "template":
+        result = templates.render_template(tuple(request["key"]), request.get("content"), request.get("kwargs"))
+        if result is templates.TEMPLATE_MISS:
+            return {"miss": True}
+
+        return {"result": result}
+
+    raise ValueError("Unknown request kind {}".format(kind))
+
+
+def _current_rss() -> typing.Union[int, None]:
+    """
+    Gets the current RSS of this process, in KB, or None if it can't be read.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * resource.getpagesize() // 1024
+
+
+def _worker_main(conn, inherited: list, max_memory: int):
+    """
+    The main loop of a worker process.
+
+    :param inherited: The parent's ends of the pipes, which have to be closed so that EOF is seen when they close.
+    :param max_memory: How far (in KB) the RSS can grow past what it was when the worker started, before the worker
+        exits so that it can be replaced.
+    """
+    # Ctrl+C is for the parent.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    for other in inherited:
+        other.close()
+
+    # A forked worker starts out sharing the parent's memory, and the peak RSS includes the parent's peak, so only
+    # growth past where it started counts.
+    baseline = _current_rss() if max_memory else None
+
+    while True:
+        try:
+            request = json.loads(conn.recv_bytes().decode())
+        except EOFError:
+            return
+
+        try:
+            response = _handle(request)
+            response["ok"] = True
+        except Exception as e:
+            response = {"ok": False, "error": type(e).__name__, "message": str(e)}
+
+        response["id"] = request["id"]
+        recycle = False
+        if baseline is not None:
+            rss = _current_rss()
+            recycle = rss is not None and rss - baseline > max_memory
+        response["recycle"] = recycle
+
+        conn.send_bytes(json.dumps(response).encode())
+        if recycle:
+            return
+
+
+class _Task(object):
+    __slots__ = ("id", "payload", "future", "submitted", "started", "timeout_handle")
+
+    def __init__(self, id: int, payload: bytes, future: asyncio.Future):
+        self.id = id
+        self.payload = payload
+        self.future = future
+
+        self.submitted = time.perf_counter()
+        self.started = None  # type: float
+        self.timeout_handle = None  # type: asyncio.Handle
+
+
+class _Worker(object):
+    __slots__ = ("process", "conn", "task", "tasks_run")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+        #: The task this worker is running, if any.
+        self.task = None  # type: _Task
+
+        #: The number of tasks this worker has run.
+        self.tasks_run = 0
+
+
+class SandboxPool(object):
+    """
+    A pool of sandbox worker processes.
+
+    The workers are started the first time something is submitted.
+    """
+
+    def __init__(self, bot, *, workers: int = 4, timeout: float = 5, max_tasks: int = 1000,
+                 max_memory: int = 256):
+        self.bot = bot
+
+        #: The number of worker processes.
+        self.size = workers
+
+        #: The default number of seconds a task can take, including time spent queued.
+        self.timeout = timeout
+
+        #: The number of tasks a worker runs before it is replaced.
+        self.max_tasks = max_tasks
+
+        #: How far (in MB) a worker's memory usage can grow past what it started with, before it is replaced.
+        self.max_memory = max_memory
+
+        self._workers = []  # type: typing.List[_Worker]
+        self._queue = collections.deque()  # type: typing.Deque[_Task]
+        self._ids = itertools.count()
+        self._closed = False
+
+        # Metrics.
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        # Seconds spent queued, and seconds spent running, for recent tasks.
+        self._waits = collections.deque(maxlen=1000)
+        self._runs = collections.deque(maxlen=1000)
+
+    # region Workers
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = _mp.Pipe()
+        inherited = [parent_conn] + [w.conn for w in self._workers]
+        process = _mp.Process(target=_worker_main, args=(child_conn, inherited, self.max_memory * 1024),
+                              name="joku-sandbox", daemon=True)
+        process.start()
+        # The child has its own copy.
+        child_conn.close()
+
+        worker = _Worker(process, parent_conn)
+        self.bot.loop.add_reader(parent_conn.fileno(), self._on_readable, worker)
+        self._workers.append(worker)
+
+        return worker
+
+    def _retire(self, worker: _Worker, kill: bool = False):
+        """
+        Removes a worker from the pool, killing it if needed.
+        """
+        self._workers.remove(worker)
+        self.bot.loop.remove_reader(worker.conn.fileno())
+        worker.conn.close()
+
+        if kill:
+            worker.process.terminate()
+
+        # Reap it without blocking the loop.
+        self.bot.loop.run_in_executor(None, worker.process.join)
+
+    def _replace(self, worker: _Worker, kill: bool = False):
+        self._retire(worker, kill=kill)
+        self.restarts += 1
+
+        if not self._closed:
+            self._spawn()
+            self._dispatch()
+
+    def _ensure_started(self):
+        if self._closed:
+            raise RuntimeError("The sandbox pool is closed")
+
+        while len(self._workers) < self.size:
+            self._spawn()
+
+    # endregion
+
+    def _next_task(self) -> typing.Union[_Task, None]:
+        """
+        Pops the next task that is still wanted off the queue.
+        """
+        while self._queue:
+            task = self._queue.popleft()
+            if not task.future.done():
+                return task
+
+            # Cancelled whilst it was queued.
+            task.timeout_handle.cancel()
+
+        return None
+
+    def _dispatch(self):
+        """
+        Sends queued tasks to idle workers.
+        """
+        for worker in list(self._workers):
+            if worker.task is not None:
+                continue
+
+            task = self._next_task()
+            if task is None:
+                return
+
+            task.started = time.perf_counter()
+            worker.task = task
+            try:
+                worker.conn.send_bytes(task.payload)
+            except OSError:
+                # It died whilst idle, so give the task to someone else.
+                worker.task = None
+                task.started = None
+                self._queue.appendleft(task)
+                self._replace(worker)
+                return
+
+    def _on_readable(self, worker: _Worker):
+        task = worker.task
+
+        try:
+            response = json.loads(worker.conn.recv_bytes().decode())
+        except (EOFError, OSError):
+            # The worker died.
+            logger.warning("Sandbox worker {} died".format(worker.process.pid))
+            if task is not None:
+                self._finish(task, exc=SandboxError("WorkerDied", "The sandbox worker died"))
+
+            self._replace(worker)
+            return
+
+        worker.task = None
+        worker.tasks_run += 1
+
+        if task is not None and task.id == response["id"]:
+            if response["ok"]:
+                self._finish(task, result=response)
+            else:
+                self._finish(task, exc=SandboxError(response["error"], response["message"]))
+
+        if response["recycle"] or worker.tasks_run >= self.max_tasks:
+            self._replace(worker)
+        else:
+            self._dispatch()
+
+    def _finish(self, task: _Task, result: dict = None, exc: Exception = None):
+        if task.timeout_handle is not None:
+            task.timeout_handle.cancel()
+
+        now = time.perf_counter()
+        if task.started is not None:
+            self._waits.append(task.started - task.submitted)
+            self._runs.append(now - task.started)
+
+        if exc is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+        if task.future.done():
+            return
+
+        if exc is not None:
+            task.future.set_exception(exc)
+        else:
+            task.future.set_result(result)
+
+    def _expire(self, task: _Task):
+        """
+        Times out a task, killing the worker running it.
+        """
+        if task.future.done():
+            return
+
+        self.timeouts += 1
+        task.future.set_exception(asyncio.TimeoutError())
+
+        if task.started is None:
+            self._queue.remove(task)
+            return
+
+        for worker in self._workers:
+            if worker.task is task:
+                logger.warning("Killing sandbox worker {} after a timeout".format(worker.process.pid))
+                self._replace(worker, kill=True)
+                break
+
+    async def submit(self, request: dict, timeout: float = None) -> dict:
+        """
+        Runs a request in a worker.
+
+        :param request: The request. This must be JSON serializable.
+        :param timeout: The number of seconds this can take, overriding the default.
+        :return: The response from the worker.
+        :raises asyncio.TimeoutError: If the request timed out.
+        :raises SandboxError: If the request failed inside the worker.
+        """
+        self._ensure_started()
+
+        task_id = next(self._ids)
+        # Anything that isn't a plain value is sent as a string.
+        payload = json.dumps({"id": task_id, **request}, default=str).encode()
+        task = _Task(task_id, payload, self.bot.loop.create_future())
+        task.timeout_handle = self.bot.loop.call_later(timeout or self.timeout, self._expire, task)
+
+        self._queue.append(task)
+        self._dispatch()
+
+        return await task.future
+
+    async def run_lua(self, code: str, kwargs: dict = None, timeout: float = None) -> typing.Union[str, None]:
+        """
+        Runs some Lua code in the sandbox.
+
+        :return: The result of the code as a string, or None if it didn't return anything.
+        """
+        response = await self.submit({"kind": "lua", "code": code, "kwargs": kwargs or {}}, timeout=timeout)
+        return response["result"]
+
+    async def render_template(self, key: typing.Sequence, content: str, kwargs: dict = None,
+                              timeout: float = None) -> str:
+        """
+        Renders a Jinja2 template in the sandbox.
+
+        The content is only sent if the worker doesn't have this template compiled already.
+
+        :param key: The key the template is cached under in the workers.
+        """
+        request = {"kind": "template", "key": list(key), "kwargs": kwargs or {}}
+        response = await self.submit(request, timeout=timeout)
+        if response.get("miss"):
+            request["content"] = content
+            response = await self.submit(request, timeout=timeout)
+
+        return response["result"]
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: The queue depth, counters, and recent latencies (in ms) for this pool.
+        """
+
+        def _ms(samples, pct):
+            if not samples:
+                return 0.0
+
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000
+
+        return {
+            "workers": len(self._workers),
+            "busy": sum(1 for w in self._workers if w.task is not None),
+            "queued": len(self._queue),
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "wait_mean": statistics.mean(self._waits) * 1000 if self._waits else 0.0,
+            "run_mean": statistics.mean(self._runs) * 1000 if self._runs else 0.0,
+            "run_p50": _ms(self._runs, 0.5),
+            "run_p99": _ms(self._runs, 0.99),
+        }
+
+    def close(self):
+        """
+        Kills every worker, and fails anything still queued.
+        """
+        self._closed = True
+
+        for worker in list(self._workers):
+            if worker.task is not None:
+                self._finish(worker.task, exc=SandboxError("PoolClosed", "The sandbox pool was closed"))
+            self._retire(worker, kill=True)
+
+        while self._queue:
+            self._finish(self._queue.popleft(), exc=SandboxError("PoolClosed", "The sandbox pool was closed"))
@@ -0,0 +1,94 @@
+"""
+Command prefix matching.
+
+Prefixes are grouped by their first character, so matching a message is one dict lookup and a couple of
+``startswith`` calls, rather than trying every prefix in turn. Exactly the matched prefix is handed back to the
+library, so it doesn't try any others.
+"""
+import typing
+
+import discord
+
+#: The normal prefixes.
+DEFAULT_PREFIXES = ("j!", "j?", "j::", "j->", "J!", "J?", "J::", "J->")
+
+#: The prefixes used in developer mode.
+DEVELOPER_PREFIXES = ("jd!", "jd::")
+
+#: The prefixes that mod commands are invoked with.
+MOD_PREFIXES = frozenset(("j::", "J::", "jd::"))
+
+#: The guild setting holding a custom prefix.
+PREFIX_SETTING = "prefix"
+
+
+class PrefixMatcher(object):
+    """
+    Matches the start of a message against a fixed set of prefixes.
+    """
+
+    def __init__(self, prefixes: typing.Iterable[str]):
+        self.prefixes = tuple(prefixes)
+
+        # first character -> prefixes starting with it, longest first
+        self._table = {}  # type: typing.Dict[str, typing.Tuple[str, ...]]
+        for prefix in sorted(set(self.prefixes), key=len, reverse=True):
+            self._table[prefix[0]] = self._table.get(prefix[0], ()) + (prefix,)
+
+    def match(self, content: str) -> typing.Union[str, None]:
+        """
+        :return: The prefix the content starts with, or None.
+        """
+        for prefix in self._table.get(content[:1], ()):
+            if content.startswith(prefix):
+                return prefix
+
+        return None
+
+
+class PrefixResolver(object):
+    """
+    Resolves the prefix for a message, including any custom prefix for its guild.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        self.default = PrefixMatcher(DEFAULT_PREFIXES)
+        self.developer = PrefixMatcher(DEVELOPER_PREFIXES)
+
+        # guild ID -> (custom prefix, matcher)
+        self._guilds = {}  # type: typing.Dict[int, typing.Tuple[str, PrefixMatcher]]
+
+    async def _get_matcher(self, guild: discord.Guild) -> PrefixMatcher:
+        try:
+            custom = await self.bot.database.get_setting(guild, PREFIX_SETTING)
+        except Exception:
+            # The database might not be connected yet, so the normal prefixes still work.
+            return self.default
+
+        if not custom:
+            self._guilds.pop(guild.id, None)
+            return self.default
+
+        # The settings cache is invalidated elsewhere, so rebuild whenever the prefix changes.
+        cached = self._guilds.get(guild.id)
+        if cached is None or cached[0] != custom:
+            cached = (custom, PrefixMatcher(DEFAULT_PREFIXES + (custom,)))
+            self._guilds[guild.id] = cached
+
+        return cached[1]
+
+    async def get_prefixes(self, message: discord.Message) -> typing.List[str]:
+        """
+        :return: The prefix the message starts with, or no prefixes if it doesn't start with one.
+        """
+        if self.bot.config.get("developer_mode", False):
+            matcher = self.developer
+        elif message.guild is not None:
+            matcher = await self._get_matcher(message.guild)
+        else:
+            matcher = self.default
+
+        prefix = matcher.match(message.content)
+        return [prefix] if prefix is not None else []
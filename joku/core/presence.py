@@ -0,0 +1,116 @@
+"""
+Coalesces presence tracking writes.
+"""
+import asyncio
+import collections
+import time
+import typing
+
+import aioredis
+
+
+class PresenceBuffer(object):
+    """
+    Keeps the latest presence timestamps for each member in memory, and writes them to Redis in one pipeline.
+
+    Only the newest timestamp for a member is written, no matter how many updates happened since the last flush.
+    """
+
+    def __init__(self, redis, *, interval: float = 0.5):
+        #: The :class:`~.RedisAdapter` this writes through.
+        self.redis = redis
+
+        #: The number of seconds between flushes.
+        self.interval = interval
+
+        # member ID -> {field: timestamp}
+        self._pending = {}  # type: typing.Dict[int, typing.Dict[str, float]]
+        # member ID -> messages sent since the last flush
+        self._messages = collections.Counter()
+
+        self._task = None  # type: asyncio.Task
+
+    def __len__(self):
+        return len(self._pending)
+
+    def update_last_seen(self, member_id: int, timestamp: float = None):
+        """
+        Marks a member as last seen at the specified time, or now.
+        """
+        self._pending.setdefault(member_id, {})["last_seen"] = timestamp or time.time()
+
+    def update_last_message(self, member_id: int, timestamp: float = None):
+        """
+        Marks a member as having sent a message at the specified time, or now.
+        """
+        self._pending.setdefault(member_id, {})["last_message"] = timestamp or time.time()
+        self._messages[member_id] += 1
+
+    def get_pending(self, member_id: int) -> typing.Dict[str, float]:
+        """
+        Gets the timestamps for a member that haven't been written yet.
+        """
+        return self._pending.get(member_id, {})
+
+    def start(self):
+        """
+        Starts the background flush task.
+        """
+        if self._task is None:
+            self._task = self.redis.bot.loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                self.redis.logger.exception("Failed to flush presence data!")
+
+    async def flush(self) -> int:
+        """
+        Writes all pending presence data to Redis.
+
+        :return: The number of members written.
+        """
+        if not self._pending:
+            return 0
+
+        pending, self._pending = self._pending, {}
+        messages, self._messages = self._messages, collections.Counter()
+
+        try:
+            async with self.redis.get_redis() as redis:
+                assert isinstance(redis, aioredis.Redis)
+
+                pipe = redis.pipeline()
+                for member_id, fields in pending.items():
+                    # aioredis is bad
+                    pipe.hmset_dict("presence:{}".format(member_id), fields)
+
+                for member_id, count in messages.items():
+                    pipe.incrby("presence:{}:msgs".format(member_id), count)
+
+                await pipe.execute()
+        except Exception:
+            # Put them back, without overwriting anything newer.
+            for member_id, fields in pending.items():
+                current = self._pending.setdefault(member_id, {})
+                for field, timestamp in fields.items():
+                    current[field] = max(current.get(field, 0), timestamp)
+
+            self._messages.update(messages)
+            raise
+
+        return len(pending)
+
+    async def close(self):
+        """
+        Stops the background task, and does a final flush.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await self.flush()
@@ -2,6 +2,9 @@
 A redis adapter for the bot.
 """
 import functools
+import itertools
+import typing
+import uuid
 
 import aioredis
 import asyncio
@@ -9,6 +12,40 @@ import discord
 import logbook
 import time
 
+from joku.core.leaderboard import Leaderboards
+from joku.core.presence import PresenceBuffer
+
+#: The number of messages that can be sent in the antispam window.
+ANTISPAM_LIMIT = 15
+
+#: The antispam window, in milliseconds.
+ANTISPAM_WINDOW = 60 * 1000
+
+# A sliding window rate limiter, kept in a sorted set of message timestamps.
+# KEYS[1] is the antispam key.
+# ARGV is the current time in ms, the window in ms, the message limit, and a unique member for this message.
+# Returns 1 if the message is allowed, or 0 if it is spam.
+ANTISPAM_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+
+-- Old antispam keys were lists.
+local t = redis.call("TYPE", key).ok
+if t ~= "zset" and t ~= "none" then
+    redis.call("DEL", key)
+end
+
+redis.call("ZREMRANGEBYSCORE", key, "-inf", now - window)
+if redis.call("ZCARD", key) >= tonumber(ARGV[3]) then
+    return 0
+end
+
+redis.call("ZADD", key, now, ARGV[4])
+redis.call("PEXPIRE", key, window)
+return 1
+"""
+
 
 class RedisAdapter(object):
     def __init__(self, bot):
@@ -21,6 +58,26 @@ class RedisAdapter(object):
         self.repl = None  # type: aioredis.Redis
         self._repl_conn = None
 
+        # A dedicated connection for pub/sub, as a subscribed connection can't run other commands.
+        self._subscriber = None  # type: aioredis.Redis
+        # What the subscriber was connected with, so that it can be reconnected.
+        self._subscriber_args = ((), {})
+        self._subscriber_lock = asyncio.Lock()
+        self._closing = False
+
+        # Script source -> SHA1, for scripts that have been loaded.
+        self._scripts = {}
+
+        # Used to make antispam entries unique.
+        self._token = uuid.uuid4().hex[:8]
+        self._counter = itertools.count()
+
+        #: Coalesces presence writes, so that they don't cost a round trip per message.
+        self.presence = PresenceBuffer(self, interval=bot.config.get("presence_flush_ms", 500) / 1000)
+
+        #: The per-guild XP and money leaderboards.
+        self.leaderboards = Leaderboards(self)
+
     async def connect(self, *args, **kwargs):
         """
         Connects the redis pool.
@@ -31,11 +88,37 @@ class RedisAdapter(object):
         self.pool = await aioredis.create_pool(*args, **kwargs, loop=self.bot.loop)
         self._repl_conn = self.pool.get()
         self.repl = await self._repl_conn.__aenter__()
+
+        conn_kwargs = {k: v for (k, v) in kwargs.items() if k not in ("minsize", "maxsize")}
+        self._subscriber_args = (args, conn_kwargs)
+        self._subscriber = await aioredis.create_redis(*args, **conn_kwargs, loop=self.bot.loop)
+
+        self.presence.start()
         return self.pool
 
+    async def close(self):
+        """
+        Flushes any buffered presence data, and closes the connections.
+        """
+        if self.pool is None:
+            return
+
+        self._closing = True
+        await self.presence.close()
+
+        if self._subscriber is not None:
+            self._subscriber.close()
+            await self._subscriber.wait_closed()
+
+        await self._repl_conn.__aexit__(None, None, None)
+        self._repl_conn = None
+
+        self.pool.close()
+        await self.pool.wait_closed()
+
     def __del__(self):
         loop = self.bot.loop  # type: asyncio.AbstractEventLoop
-        if loop.is_running():
+        if loop.is_running() and self._repl_conn is not None:
             loop.create_task(self._repl_conn.__aexit__())
 
     def get_redis(self) -> aioredis.Redis:
@@ -44,6 +127,80 @@ class RedisAdapter(object):
         """
         return self.pool.get()
 
+    async def publish(self, channel: str, message: str):
+        """
+        Publishes a message to a pub/sub channel.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            await redis.publish(channel, message)
+
+    async def subscribe(self, channel: str, callback: typing.Callable[[str], None]):
+        """
+        Subscribes to a pub/sub channel.
+
+        :param callback: Called with every message published on the channel, decoded as a string.
+        """
+        ch, = await self._subscriber.subscribe(channel)
+        self.bot.loop.create_task(self._read_channel(ch, callback))
+
+    async def _read_channel(self, ch: aioredis.Channel, callback: typing.Callable[[str], None]):
+        while True:
+            while await ch.wait_message():
+                message = await ch.get(encoding="utf-8")
+                try:
+                    callback(message)
+                except Exception:
+                    self.logger.exception("Failed to handle message on {}".format(ch.name))
+
+            if self._closing:
+                return
+
+            # The connection dropped, so anything published since can't be trusted to have been seen.
+            name = ch.name.decode() if isinstance(ch.name, bytes) else ch.name
+            self.logger.warning("Subscription to {} was closed, resubscribing.".format(name))
+            self._clear_caches()
+
+            ch = await self._resubscribe(name)
+            if ch is None:
+                return
+
+            # Invalidations published whilst reconnecting were missed too.
+            self._clear_caches()
+
+    def _clear_caches(self):
+        for cache in self.bot.database.caches.values():
+            cache.clear()
+
+    async def _resubscribe(self, channel: str) -> typing.Union[aioredis.Channel, None]:
+        """
+        Subscribes to a channel again, reconnecting the subscriber if needed.
+
+        This retries with exponential back-off until it succeeds, or the adapter is closed.
+
+        :return: The new channel, or None if the adapter was closed.
+        """
+        delay = 1
+        while not self._closing:
+            try:
+                # Every subscription shares the connection, so only one of them reconnects it.
+                async with self._subscriber_lock:
+                    if self._subscriber is None or self._subscriber.closed:
+                        args, kwargs = self._subscriber_args
+                        self._subscriber = await aioredis.create_redis(*args, **kwargs, loop=self.bot.loop)
+
+                    ch, = await self._subscriber.subscribe(channel)
+            except Exception:
+                self.logger.exception("Failed to resubscribe to {}, retrying in {}s".format(channel, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+            else:
+                self.logger.info("Resubscribed to {}.".format(channel))
+                return ch
+
+        return None
+
     async def level_notifs_disabled(self, channel: discord.TextChannel):
         """
         Checks if level up notifs are disabled here.
@@ -75,55 +232,44 @@ class RedisAdapter(object):
 
         return state
 
-    async def clean_stuck_antispam(self):
+    async def eval_script(self, redis: aioredis.Redis, script: str, keys: list = None, args: list = None):
         """
-        Cleans stuck antispam keys.
-        """
-        async with self.get_redis() as redis:
-            assert isinstance(redis, aioredis.Redis)
-            to_delete = []
+        Runs a Lua script with EVALSHA.
 
-            async for key in redis.iscan(match="antispam:*"):
-                ttl = await redis.ttl(key)
-                if ttl == -1:
-                    to_delete.append(key)
+        The script is loaded with SCRIPT LOAD the first time it is used, and again if Redis has lost it.
+        """
+        sha = self._scripts.get(script)
+        if sha is None:
+            sha = self._scripts[script] = await redis.script_load(script)
 
-            removed = await redis.delete("placeholderkey", *to_delete)
+        try:
+            return await redis.evalsha(sha, keys=keys or [], args=args or [])
+        except aioredis.ReplyError as e:
+            # Redis was restarted, or the script cache was flushed.
+            if not str(e).startswith("NOSCRIPT"):
+                raise
 
-        return removed
+            sha = self._scripts[script] = await redis.script_load(script)
+            return await redis.evalsha(sha, keys=keys or [], args=args or [])
 
     async def prevent_spam(self, user: discord.User):
         """
-        Prevents spam by only counting 15 messages per second.
+        Prevents spam by only counting 15 messages per 60 seconds.
+
+        This is a sliding window, checked and updated atomically in one round trip.
         """
         b = "antispam:{}".format(user.id)
+        now = int(time.time() * 1000)
+        # Each message needs a unique member in the window.
+        member = "{}:{}:{}".format(now, self._token, next(self._counter))
 
         async with self.get_redis() as redis:
             assert isinstance(redis, aioredis.Redis)
 
-            # Check if it exists.
-            if not (await redis.exists(b)):
-                # Just LPUSH and EXPIRE the key.
-                await redis.lpush(b, b"A")
-                await redis.expire(b, 60)
-                return True
-
-            if await redis.ttl(b) == -1:
-                await redis.expire(b, 60)
+            allowed = await self.eval_script(redis, ANTISPAM_SCRIPT, keys=[b],
+                                             args=[now, ANTISPAM_WINDOW, ANTISPAM_LIMIT, member])
 
-            # Since it does exist, check the length.
-            l_len = await redis.llen(b)
-
-            if l_len >= 15:
-                # Too much spam, return False.
-                return False
-
-            # Add 1 to it and return True.
-            # Each b"A" represents a message sent.
-            # If it's 15 b"A"s in the list, !
-            # They've spammed too much and don't get to get XP anymore.
-            await redis.lpush(b, b"A")
-            return True
+        return bool(allowed)
 
     async def ttl(self, key: bytes) -> int:
         """
@@ -139,45 +285,43 @@ class RedisAdapter(object):
         """
         Updates the current last seen for this member.
 
-        This will set the last seen to now.
+        This will set the last seen to now. The write is buffered, and flushed with everything else in the next batch.
         """
-        async with self.get_redis() as redis:
-            assert isinstance(redis, aioredis.Redis)
-
-            # aioredis is bad
-            await redis.hmset_dict("presence:{}".format(member.id),
-                                   last_seen=time.time())
+        self.presence.update_last_seen(member.id)
 
     async def update_last_message(self, member: discord.Member):
         """
         Updates the last message time for this member.
 
-        This will set the last message to now.
+        This will set the last message to now. The write is buffered, and flushed with everything else in the next
+        batch.
         """
-        async with self.get_redis() as redis:
-            assert isinstance(redis, aioredis.Redis)
-
-            # aioredis is bad
-            await redis.hmset_dict("presence:{}".format(member.id),
-                                   last_message=time.time())
-
-            await redis.incr("presence:{}:msgs".format(member.id))
+        self.presence.update_last_message(member.id)
 
     async def get_presence_data(self, member: discord.Member):
         """
         Gets presence data for the specified member.
+
+        This includes any presence data that hasn't been flushed yet.
         """
+        pending = self.presence.get_pending(member.id)
+
         async with self.get_redis() as redis:
             assert isinstance(redis, aioredis.Redis)
 
             tracking = await redis.hgetall("presence:{}".format(member.id))
-            if not tracking:
-                return None
 
-            return {
-                "last_seen": float(tracking.get(b"last_seen", b"0").decode()),
-                "last_message": float(tracking.get(b"last_message", b"0").decode())
-            }
+        if not tracking and not pending:
+            return None
+
+        data = {
+            "last_seen": float(tracking.get(b"last_seen", b"0").decode()),
+            "last_message": float(tracking.get(b"last_message", b"0").decode())
+        }
+        for field, timestamp in pending.items():
+            data[field] = max(data[field], timestamp)
+
+        return data
 
     async def update_stock_prices(self, channel: discord.TextChannel, new_price: float):
         """
@@ -194,6 +338,24 @@ class RedisAdapter(object):
             # push to the right of the key
             await redis.rpush(key, str(new_price).encode())
 
+    async def bulk_update_stock_prices(self, prices: typing.Mapping[int, float]):
+        """
+        Updates the cached prices of many stocks in one pipeline.
+
+        :param prices: A mapping of channel ID -> new price.
+        """
+        async with self.get_redis() as redis:
+            assert isinstance(redis, aioredis.Redis)
+
+            pipe = redis.pipeline()
+            for channel_id, price in prices.items():
+                key = "stocks:{}".format(channel_id)
+                pipe.rpush(key, str(price).encode())
+                # only keep the last hour
+                pipe.ltrim(key, -60, -1)
+
+            await pipe.execute()
+
     async def get_historical_prices(self, channel: discord.TextChannel):
         """
         Gets the historical stock prices for a channel.
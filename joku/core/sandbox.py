@@ -0,0 +1,146 @@
+"""
+A reusable Lua sandbox.
+
+Creating a LuaRuntime and running the sandbox preamble costs far more than running a typical tag, so each process
+keeps one sandbox around and every run gets a fresh environment table instead of a fresh runtime.
+"""
+import os
+
+import lupa
+from lupa import LuaRuntime
+
+#: Returned when a script ran, but didn't return anything.
+NO_RESULT = type("NO_RESULT", (object,), {})
+
+#: The number of runs before a sandbox is thrown away and rebuilt.
+MAX_RUNS = 1000
+
+#: The size of the Lua heap (in KB) that causes a sandbox to be rebuilt after a run.
+MAX_MEMORY = 20000
+
+with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "luasandbox.lua")) as f:
+    sandbox_preamble = f.read()
+
+
+def getter(obj, attr_name):
+    raise AttributeError("Python object attribute retrieval is forbidden")
+
+
+def setter(obj, attr_name, value):
+    raise AttributeError("Python object attribute setting is forbidden")
+
+
+def dictify_table_recursively(t):
+    """
+    Turns a table into a dict.
+    """
+    d = {}
+
+    for (k, v) in t.items():
+        if lupa.lua_type(v) == "table":
+            d[k] = dictify_table_recursively(v)
+        else:
+            d[k] = str(v)
+
+    return d
+
+
+class LuaSandbox(object):
+    """
+    A Lua runtime with the sandbox preamble loaded.
+    """
+
+    def __init__(self):
+        # the attribute_handlers are probably enough to prevent access eval otherwise
+        self.runtime = LuaRuntime(register_eval=False,
+                                  unpack_returned_tuples=True,
+                                  attribute_handlers=(getter, setter))
+
+        # execute the sandbox preamble
+        self.sandbox = self.runtime.execute(sandbox_preamble)
+
+        #: The number of scripts this sandbox has run.
+        self.runs = 0
+
+    @property
+    def expired(self) -> bool:
+        """
+        :return: If this sandbox has been used enough that it should be rebuilt.
+        """
+        return self.runs >= MAX_RUNS or self.sandbox.memory() > MAX_MEMORY
+
+    def to_lua(self, value):
+        """
+        Converts a value into something safe to pass into Lua.
+
+        Dicts and lists become tables, and anything that isn't a primitive becomes a string, so that scripts never
+        get a handle to a Python object.
+        """
+        if isinstance(value, dict):
+            return self.runtime.table_from({k: self.to_lua(v) for (k, v) in value.items()})
+
+        if isinstance(value, (list, tuple)):
+            return self.runtime.table_from([self.to_lua(v) for v in value])
+
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+
+        return str(value)
+
+    def run(self, code: str, kwargs: dict = None):
+        """
+        Runs some code in the sandbox.
+
+        :param code: The Lua code to run.
+        :param kwargs: The variables to make available to the code.
+        :return: The result of the code, :data:`NO_RESULT` if it didn't return anything.
+        """
+        self.runs += 1
+
+        # call sandbox.run with `code, locals`
+        # and unpack the variables
+        _ = self.sandbox.run(code, self.to_lua(kwargs or {}))
+        if isinstance(_, bool):
+            # idk
+            return NO_RESULT
+
+        called, result = _
+
+        if lupa.lua_type(result) == 'table':
+            # dictify
+            result = dictify_table_recursively(result)
+
+        return result
+
+
+# The sandbox for this process.
+_sandbox = None  # type: LuaSandbox
+
+
+def get_sandbox() -> LuaSandbox:
+    """
+    Gets the sandbox for this process, building a new one if it doesn't exist or has expired.
+    """
+    global _sandbox
+
+    if _sandbox is None or _sandbox.expired:
+        _sandbox = LuaSandbox()
+
+    return _sandbox
+
+
+def run_lua(code: str, kwargs: dict = None):
+    """
+    Runs some code in this process's sandbox.
+
+    This is meant to be called inside a process pool.
+    """
+    global _sandbox
+
+    sandbox = get_sandbox()
+    try:
+        return sandbox.run(code, kwargs)
+    except Exception:
+        # Don't trust a runtime that errored outside of the script.
+        _sandbox = None
+        raise
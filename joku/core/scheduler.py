@@ -0,0 +1,143 @@
+"""
+The reminder scheduler.
+
+Every enabled reminder is loaded once on startup and kept in a heap ordered by when it is due. New reminders are
+pushed onto the heap as they are created. A single task sleeps until the earliest reminder is due, fires everything
+that is due, and then disables all of them in one write.
+"""
+import asyncio
+import datetime
+import heapq
+import typing
+
+import logbook
+
+from joku.db.tables import Reminder
+
+logger = logbook.Logger("Jokusoramame.Scheduler")
+
+
+class ReminderScheduler(object):
+    """
+    Fires reminders when they are due.
+    """
+
+    def __init__(self, bot, fire: typing.Callable[[Reminder], typing.Awaitable]):
+        self.bot = bot
+
+        #: Called with each reminder when it is due.
+        #: The reminder is disabled afterwards, whether this succeeds or not.
+        self.fire = fire
+
+        # (due at, reminder ID)
+        self._heap = []  # type: typing.List[typing.Tuple[datetime.datetime, int]]
+        # reminder ID -> reminder, for everything in the heap
+        self._reminders = {}  # type: typing.Dict[int, Reminder]
+        # Reminder IDs that have fired, and need to be disabled.
+        self._done = set()
+
+        # Set when something is scheduled sooner than what is being waited on.
+        self._wakeup = asyncio.Event()
+        self._task = None  # type: asyncio.Task
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def schedule(self, reminder: Reminder):
+        """
+        Schedules a reminder to be fired.
+
+        A reminder that is already scheduled is not scheduled again.
+        """
+        if not reminder.enabled or reminder.id in self._reminders:
+            return
+
+        self._reminders[reminder.id] = reminder
+        heapq.heappush(self._heap, (reminder.reminding_at, reminder.id))
+
+        # Only wake up if this is the new earliest reminder.
+        if self._heap[0][1] == reminder.id:
+            self._wakeup.set()
+
+    def _pop_due(self, now: datetime.datetime) -> typing.List[Reminder]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, id = heapq.heappop(self._heap)
+            due.append(self._reminders.pop(id))
+
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+
+            if self._heap:
+                # Reminder times are naive UTC.
+                delay = (self._heap[0][0] - datetime.datetime.utcnow()).total_seconds()
+            else:
+                delay = None
+
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            for reminder in self._pop_due(datetime.datetime.utcnow()):
+                try:
+                    await self.fire(reminder)
+                except Exception:
+                    logger.exception("Failed to fire reminder {}!".format(reminder.id))
+                finally:
+                    self._done.add(reminder.id)
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to disable fired reminders!")
+
+    async def flush(self) -> int:
+        """
+        Disables every reminder that has fired.
+
+        :return: The number of reminders disabled.
+        """
+        if not self._done:
+            return 0
+
+        done, self._done = self._done, set()
+        try:
+            await self.bot.database.cancel_reminders(done)
+        except Exception:
+            self._done |= done
+            raise
+
+        return len(done)
+
+    async def start(self):
+        """
+        Loads every enabled reminder, and starts firing them.
+
+        Reminders that came due whilst the bot was offline are fired straight away.
+        """
+        if self._task is not None:
+            return
+
+        for reminder in await self.bot.database.get_pending_reminders():
+            self.schedule(reminder)
+
+        logger.info("Loaded {} reminders.".format(len(self)))
+        self._task = self.bot.loop.create_task(self._run())
+
+    def stop(self):
+        """
+        Stops firing reminders.
+
+        Any reminders that fired but haven't been disabled yet are disabled in the background.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._done:
+            self.bot.loop.create_task(self.flush())
@@ -0,0 +1,64 @@
+"""
+Startup timing.
+"""
+import collections
+import contextlib
+import time
+import typing
+
+
+class StartupProfile(object):
+    """
+    Records how long each phase of startup took.
+    """
+
+    def __init__(self, started: float = None):
+        #: When startup began, from :func:`time.time`.
+        self.started = started if started is not None else time.time()
+
+        #: Phase name -> seconds taken, in the order they finished.
+        #: Some phases run at the same time, so these can add up to more than the total.
+        self.phases = collections.OrderedDict()  # type: typing.Dict[str, float]
+
+        #: The seconds from startup beginning to the bot being ready, once it is.
+        self.ready_after = None  # type: float
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Times a phase of startup. Phases that fail are still recorded.
+        """
+        before = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - before)
+
+    def record(self, name: str, seconds: float):
+        """
+        Records a phase that was timed elsewhere.
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @property
+    def total(self) -> float:
+        """
+        :return: The seconds since startup began.
+        """
+        return time.time() - self.started
+
+    def finish(self) -> float:
+        """
+        Marks startup as finished.
+
+        :return: The seconds since startup began.
+        """
+        self.ready_after = self.total
+        return self.ready_after
+
+    def report(self) -> typing.List[str]:
+        """
+        Formats each phase, in the order they finished.
+        """
+        width = max((len(name) for name in self.phases), default=0)
+        return ["{}: {:.3f}s".format(name.ljust(width), seconds) for (name, seconds) in self.phases.items()]
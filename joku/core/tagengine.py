@@ -1,128 +1,55 @@
 """
 A Jinja2-based tag engine for tags.
 """
-import asyncio
-import inspect
-import random
-import string
-from concurrent.futures import ThreadPoolExecutor
+import collections
+import hashlib
 
 import discord
-import functools
 
-import lupa
-from discord.abc import GuildChannel
-from jinja2 import Template
-from jinja2.sandbox import SandboxedEnvironment
-from lupa._lupa import LuaRuntime
-
-from joku.cogs.lua import sandbox_preamble, dictify_table_recursively, NO_RESULT
 from joku.core.bot import Context, Jokusoramame
-from joku.core.mp2 import ProcessPoolExecutor
 from joku.db.tables import Tag
 
+#: The number of tag content hashes to remember.
+MAX_HASHES = 1024
+
 
 class TagEngine(object):
     def __init__(self, bot: Jokusoramame):
-        # Template environment.
-        # This is a SandboxedEnvironment for security purposes.
-        self.tmpl_env = SandboxedEnvironment()
-
-        # The process pool used.
-        self.executor = ProcessPoolExecutor()
-
         # The bot instance.
-        # We use this for getting the tag instance.
+        # We use this for getting the tag instance, and templates are rendered in its sandbox pool.
         self.bot = bot
 
-        # Update the globals of the template environment.
-        self.tmpl_env.globals.update(
-            {
-                "random": random,
-                "string": string,
-                "list": list,
-                "str": str,
-                "tuple": tuple,
-            }
-        )
-
-    @staticmethod
-    def _lua_render_template(luastr: str, kwargs=None):
-        """
-        Renders a Lua template.
-        """
-
-        def getter(obj, attr_name):
-            if attr_name.startswith("_"):
-                raise AttributeError("Not allowed to access attribute `{}` of `{}`"
-                                     .format(attr_name, type(obj).__name__))
-
-            return attr_name
-
-        def setter(obj, attr_name, value):
-            raise AttributeError("Python object attribute setting is forbidden")
-
-        # the attribute_handlers are probably enough to prevent access eval otherwise
-        lua = LuaRuntime(register_eval=False,
-                         unpack_returned_tuples=True,
-                         attribute_handlers=(getter, setter))
-
-        # execute the sandbox preamble
-        sandbox = lua.execute(sandbox_preamble)
-
-        # call sandbox.run with `glob.sandbox, code`
-        # and unpack the variables
-        new = {}
-        # HECK
-        for key, val in kwargs.items():
-            new[key] = lua.table_from(val)
+        # (tag id, last modified) -> content hash
+        self._hashes = collections.OrderedDict()
 
-        _ = sandbox.run(luastr, lua.table_from(new))
-        if isinstance(_, bool):
-            # idk
-            return NO_RESULT
-
-        called, result = _
-
-        if lupa.lua_type(result) == 'table':
-            # dictify
-            result = dictify_table_recursively(result)
-
-        return str(result)
-
-    @staticmethod
-    def _pp_render_template(tmpl_env: SandboxedEnvironment, tag: Tag, kwargs=None):
+    def _template_key(self, tag: Tag) -> tuple:
         """
-        Called inside the process pool to render the template.
+        Gets the key that workers cache the compiled template for a tag under.
         """
-        template = tmpl_env.from_string(tag.content or "Broken tag!")  # type: Template
-
-        # variables = tag.get("variables", {})
-
-        # def _set_variable(name, value):
-        #     variables[name] = value
-
-        # local = {
-        #     "set_variable": _set_variable,
-        #     **variables,
-        # }
-        # if kwargs:
-        #     local.update(kwargs)
-
-        rendered = template.render(**kwargs)
+        memo_key = (tag.id, tag.last_modified)
+        digest = self._hashes.get(memo_key)
+        if digest is None:
+            digest = hashlib.sha1((tag.content or "").encode()).hexdigest()
+            self._hashes[memo_key] = digest
+            while len(self._hashes) > MAX_HASHES:
+                self._hashes.popitem(last=False)
+        else:
+            self._hashes.move_to_end(memo_key)
 
-        return rendered
+        return tag.id, digest
 
     async def _render_template(self, tag: Tag, **kwargs):
         """
-        Renders the template in a process pool.
+        Renders the template in the sandbox pool.
+
+        Jinja2 templates are only sent by key at first; the content is only sent if the worker doesn't have it
+        compiled.
         """
         if tag.lua:
-            partial = functools.partial(self._lua_render_template, tag.content, kwargs)
+            rendered = await self.bot.sandbox_pool.run_lua(tag.content, kwargs)
         else:
-            partial = functools.partial(self._pp_render_template, self.tmpl_env, tag, kwargs)
-
-        rendered = await asyncio.wait_for(self.bot.loop.run_in_executor(self.executor, partial), 5, loop=self.bot.loop)
+            rendered = await self.bot.sandbox_pool.render_template(self._template_key(tag),
+                                                                   tag.content or "Broken tag!", kwargs)
 
         return rendered
 
@@ -0,0 +1,70 @@
+"""
+Jinja2 tag rendering, run inside worker processes.
+
+Each worker keeps its own sandboxed environment and an LRU of compiled templates, so the parent only needs to send
+a template key and the render variables. The content is only sent when a worker hasn't seen the template before.
+"""
+import collections
+import random
+import string
+
+from jinja2 import Template
+from jinja2.sandbox import SandboxedEnvironment
+
+#: Returned by a worker that doesn't have the template compiled yet.
+TEMPLATE_MISS = type("TEMPLATE_MISS", (object,), {})
+
+#: The number of compiled templates each worker keeps.
+MAX_TEMPLATES = 256
+
+# The environment for this process.
+_env = None  # type: SandboxedEnvironment
+
+# (tag id, content hash) -> compiled template
+_templates = collections.OrderedDict()
+
+
+def get_environment() -> SandboxedEnvironment:
+    """
+    Gets the template environment for this process.
+
+    This is a SandboxedEnvironment for security purposes.
+    """
+    global _env
+
+    if _env is None:
+        _env = SandboxedEnvironment()
+        _env.globals.update(
+            {
+                "random": random,
+                "string": string,
+                "list": list,
+                "str": str,
+                "tuple": tuple,
+            }
+        )
+
+    return _env
+
+
+def render_template(key: tuple, content: str = None, kwargs: dict = None):
+    """
+    Renders a template.
+
+    :param key: The key of the template, made from the tag ID and a hash of its content.
+    :param content: The content of the template. This is only needed if this process hasn't compiled it yet.
+    :param kwargs: The variables to render the template with.
+    :return: The rendered template, or :data:`TEMPLATE_MISS` if the content is needed.
+    """
+    template = _templates.get(key)  # type: Template
+    if template is None:
+        if content is None:
+            return TEMPLATE_MISS
+
+        template = _templates[key] = get_environment().from_string(content)
+        while len(_templates) > MAX_TEMPLATES:
+            _templates.popitem(last=False)
+    else:
+        _templates.move_to_end(key)
+
+    return template.render(**(kwargs or {}))
@@ -123,52 +123,97 @@ def paginate_large_message(message: str, use_codeblocks: bool = True) -> typing.
     return pages
 
 
-def paginate_table(rows: list, headers: typing.Iterable, table_format="orgtbl",
-                   limit=2000) -> typing.List[str]:
+def _table_frame(headers: typing.Sequence, table_format) -> typing.Tuple[int, int]:
+    """
+    Works out how many lines a table format puts above and below the rows, from its :class:`tabulate.TableFormat`.
+
+    :return: The number of header lines, and the number of footer lines.
+    :raises ValueError: If the format can't be split into pages by line.
+    """
+    fmt = table_format
+    if not isinstance(fmt, tabulate.TableFormat):
+        # tabulate falls back to this for formats it doesn't know.
+        fmt = tabulate._table_formats.get(table_format, tabulate._table_formats["simple"])
+
+    if fmt.linebetweenrows is not None:
+        raise ValueError("Table format {} puts lines between rows, so it can't be paginated".format(table_format))
+
+    if any(callable(line) for line in (fmt.lineabove, fmt.linebelowheader, fmt.linebelow)):
+        # These are markup formats (e.g. latex, html), whose lines aren't one per row.
+        raise ValueError("Table format {} builds its lines with functions, so it can't be paginated"
+                         .format(table_format))
+
+    hidden = fmt.with_header_hide if (headers and fmt.with_header_hide) else []
+
+    def shown(name: str) -> bool:
+        return getattr(fmt, name) is not None and name not in hidden
+
+    header_count = int(shown("lineabove"))
+    if headers:
+        header_count += 1 + int(shown("linebelowheader"))
+
+    return header_count, int(shown("linebelow"))
+
+
+def iter_table_pages(rows: typing.Sequence, headers: typing.Iterable, table_format="orgtbl",
+                     limit=2000) -> typing.Iterator[str]:
     """
     Paginates a table into multiple messages, each fitting into the 2000 char limit Discord provides.
 
-    :param rows: An iterable of rows to paginate.
+    The whole table is rendered once, so every page has the same column widths, and then split up by lines.
+
+    :param rows: The rows to paginate.
     :param headers: The headers to use for the table.
     :param table_format: The format of the table to produce.
     :param limit: The cutoff for tables.
-    :return: A list of formatted tables.
+    :return: An iterator of formatted tables.
+    :raises ValueError: If the table format puts lines between rows (such as ``grid``), or is a markup format.
     """
+    headers = list(headers)
+    rows = list(rows)
 
-    pages = []
+    # Checked before rendering, so that an unsupported format fails even with no rows.
+    header_count, footer_count = _table_frame(headers, table_format)
 
-    current_rows = []
+    lines = tabulate.tabulate(rows, headers=headers, tablefmt=table_format).split("\n")
+    if not rows:
+        yield "```{}```".format("\n".join(lines))
+        return
 
-    while True:
-        # No more rows to fetch.
-        if not rows:
-            break
-        # Fetch the next row off of the list.
-        current_row = rows[0]
-        # Add it to the current rows.
-        current_rows.append(current_row)
-        # Attempt to render the table, so we can check if it's above the length limit.
-        # If it is, remove this row from the list, add the current rendered table to pages.
-        # Then insert this to the front of the rows, which will make it re-try wth the next page.
-        _tbl = tabulate.tabulate(current_rows, headers=headers, tablefmt=table_format)
-        fmtted = "```{}```".format(_tbl)
-        if len(fmtted) >= limit:
-            # We've reached too many rows, remove one, render the table, and store it.
-            current_rows = current_rows[:-1]
-            # Restore the current row to the rows list, which will be used again in the next loop iteration.
-            _tbl = tabulate.tabulate(current_rows, headers=headers, tablefmt=table_format)
-            fmtted = "```{}```".format(_tbl)
-            pages.append(fmtted)
-            # Reset current_rows.
-            current_rows = []
-            continue
-        # Otherwise, the table isn't too big.
-        # We can continue adding rows to this.
-        rows.pop(0)
-
-    # Add the current table to the pages, too.
-    _tbl = tabulate.tabulate(current_rows, headers=headers, tablefmt=table_format)
-    fmtted = "```{}```".format(_tbl)
-    pages.append(fmtted)
+    header = lines[:header_count]
+    footer = lines[len(lines) - footer_count:]
+    body = lines[header_count:len(lines) - footer_count]
 
-    return pages
+    # The characters left for rows on each page, after the codeblock and the header and footer lines.
+    budget = limit - len("``````") - sum(len(line) + 1 for line in header + footer) - 1
+
+    current = []
+    size = 0
+    for line in body:
+        # Lines that can never fit are cut down.
+        line = line[:max(budget - 1, 0)]
+
+        if current and size + len(line) + 1 > budget:
+            yield "```{}```".format("\n".join(header + current + footer))
+            current = []
+            size = 0
+
+        current.append(line)
+        size += len(line) + 1
+
+    if current:
+        yield "```{}```".format("\n".join(header + current + footer))
+
+
+def paginate_table(rows: typing.Sequence, headers: typing.Iterable, table_format="orgtbl",
+                   limit=2000) -> typing.List[str]:
+    """
+    Paginates a table into multiple messages, each fitting into the 2000 char limit Discord provides.
+
+    :param rows: The rows to paginate.
+    :param headers: The headers to use for the table.
+    :param table_format: The format of the table to produce.
+    :param limit: The cutoff for tables.
+    :return: A list of formatted tables.
+    """
+    return list(iter_table_pages(rows, headers, table_format=table_format, limit=limit))
@@ -0,0 +1,279 @@
+"""
+Write-behind buffers for high volume database writes.
+"""
+import asyncio
+import collections
+import logging
+import random
+import typing
+
+import discord
+
+logger = logging.getLogger("Jokusoramame.DB.Buffers")
+
+
+class WriteBuffer(object):
+    """
+    Collects writes in memory, and flushes them to the database on an interval or once a size threshold is reached.
+
+    Subclasses implement :meth:`_take`, :meth:`_write` and :meth:`_restore`.
+    """
+
+    def __init__(self, db, *, interval: float = 30, threshold: int = 500):
+        #: The database interface this writes to.
+        self.db = db
+
+        #: The number of seconds between flushes.
+        self.interval = interval
+
+        #: The number of pending writes that causes an early flush.
+        self.threshold = threshold
+
+        self._lock = asyncio.Lock()
+        self._task = None  # type: asyncio.Task
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def _take(self):
+        """
+        Removes and returns all of the pending writes.
+        """
+        raise NotImplementedError
+
+    async def _write(self, pending):
+        """
+        Writes the pending writes to the database.
+        """
+        raise NotImplementedError
+
+    def _restore(self, pending):
+        """
+        Puts pending writes back after a failed write, so they are retried on the next flush.
+        """
+        raise NotImplementedError
+
+    def _written(self, pending):
+        """
+        Called after pending writes have been written successfully.
+        """
+
+    def start(self):
+        """
+        Starts the background flush task.
+        """
+        if self._task is None:
+            self._task = self.db.bot.loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush {}!".format(type(self).__name__))
+
+    def _check_threshold(self):
+        """
+        Schedules an early flush if there are too many pending writes.
+        """
+        if len(self) >= self.threshold and not self._lock.locked():
+            self.db.bot.loop.create_task(self.flush())
+
+    async def flush(self) -> int:
+        """
+        Flushes all pending writes to the database.
+
+        :return: The number of writes flushed.
+        """
+        async with self._lock:
+            pending = self._take()
+            if not pending:
+                return 0
+
+            try:
+                await self._write(pending)
+            except Exception:
+                self._restore(pending)
+                raise
+            else:
+                self._written(pending)
+
+        return len(pending)
+
+    async def close(self):
+        """
+        Stops the background task, and does a final flush.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await self.flush()
+
+
+class CachedXP(object):
+    """
+    The in-memory XP state of a user.
+    """
+    __slots__ = ("id", "xp", "level")
+
+    def __init__(self, id: int, xp: int, level: int):
+        self.id = id
+        self.xp = xp
+        self.level = level
+
+    def __repr__(self):
+        return "<CachedXP id={} xp={} level={}>".format(self.id, self.xp, self.level)
+
+
+class XPBuffer(WriteBuffer):
+    """
+    Buffers XP gains, so that a message doesn't cost a database round trip.
+
+    The running total for each user is cached, so level ups are still detected immediately.
+    """
+
+    def __init__(self, db, *, max_cached: int = 10000, **kwargs):
+        super().__init__(db, **kwargs)
+
+        #: The maximum number of users to keep the totals of.
+        self.max_cached = max_cached
+
+        self._pending = collections.Counter()
+        # XP that is currently being written by a flush.
+        self._inflight = collections.Counter()
+        self._cached = collections.OrderedDict()  # type: typing.Dict[int, CachedXP]
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _take(self):
+        pending, self._pending = self._pending, collections.Counter()
+        self._inflight = pending
+        return pending
+
+    async def _write(self, pending):
+        await self.db.bulk_add_user_xp(pending)
+
+    def _restore(self, pending):
+        self._pending.update(pending)
+        self._inflight = collections.Counter()
+
+    def _written(self, pending):
+        self._inflight = collections.Counter()
+
+    def pending(self, member_id: int) -> int:
+        """
+        Gets the XP for a user that hasn't been written to the database yet.
+        """
+        return self._pending.get(member_id, 0) + self._inflight.get(member_id, 0)
+
+    def has(self, member_id: int) -> bool:
+        """
+        Checks if a user has XP that hasn't been written to the database yet.
+        """
+        return member_id in self._pending or member_id in self._inflight
+
+    def refresh(self, member_id: int, *, xp: int = None, level: int = None):
+        """
+        Updates the cached state for a user, after their XP or level was written to the database directly.
+
+        :param xp: Their XP in the database.
+        :param level: Their level in the database.
+        """
+        entry = self._cached.get(member_id)
+        if entry is None:
+            return
+
+        if xp is not None:
+            entry.xp = xp + self.pending(member_id)
+
+        if level is not None:
+            entry.level = level
+
+    async def add(self, member: discord.Member, xp_to_add: int = None) -> CachedXP:
+        """
+        Adds XP to a member.
+
+        :return: The cached XP state for this member, including the new XP.
+        """
+        if xp_to_add is None:
+            xp_to_add = random.randint(0, 4)
+
+        entry = self._cached.get(member.id)
+        if entry is None:
+            user = await self.db.get_or_create_user(member)
+            # The database doesn't include anything still waiting to be flushed.
+            entry = CachedXP(member.id, (user.xp or 0) + self.pending(member.id), user.level or 1)
+            # Another message might have loaded them whilst we were waiting.
+            entry = self._cached.setdefault(member.id, entry)
+
+            while len(self._cached) > self.max_cached:
+                self._cached.popitem(last=False)
+        else:
+            self._cached.move_to_end(member.id)
+
+        entry.xp += xp_to_add
+        self._pending[member.id] += xp_to_add
+        self._check_threshold()
+
+        return entry
+
+
+class RoleStateBuffer(WriteBuffer):
+    """
+    Buffers rolestate saves for departing members, so that a prune costs a few bulk upserts rather than several
+    queries per member.
+
+    Only the latest rolestate for each member is kept.
+    """
+
+    def __init__(self, db, *, interval: float = 5, threshold: int = 500):
+        super().__init__(db, interval=interval, threshold=threshold)
+
+        # (guild ID, user ID) -> (role IDs, nick)
+        self._pending = collections.OrderedDict()
+        # Rolestates that are currently being written by a flush.
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _take(self):
+        pending, self._pending = self._pending, collections.OrderedDict()
+        self._inflight = pending
+        return pending
+
+    async def _write(self, pending):
+        await self.db.bulk_save_rolestates([(guild_id, user_id, roles, nick)
+                                            for (guild_id, user_id), (roles, nick) in pending.items()])
+
+    def _restore(self, pending):
+        # Anything saved since is newer.
+        for key, value in pending.items():
+            self._pending.setdefault(key, value)
+
+        self._inflight = {}
+
+    def _written(self, pending):
+        self._inflight = {}
+
+    def has(self, guild_id: int, user_id: int) -> bool:
+        """
+        Checks if a member has a rolestate that hasn't been written to the database yet.
+        """
+        key = (guild_id, user_id)
+        return key in self._pending or key in self._inflight
+
+    def add(self, member: discord.Member):
+        """
+        Saves the current roles and nickname of a member.
+        """
+        roles = [r.id for r in member.roles if not r == member.guild.default_role]
+
+        key = (member.guild.id, member.id)
+        self._pending.pop(key, None)
+        self._pending[key] = (roles, member.nick)
+        self._check_threshold()
@@ -0,0 +1,207 @@
+"""
+In-memory caches for frequently read database rows.
+
+Caches are kept coherent between processes by publishing invalidations over Redis.
+"""
+import logging
+import typing
+import uuid
+
+import discord
+
+logger = logging.getLogger("Jokusoramame.DB.Cache")
+
+#: The Redis channel that invalidations are published on.
+INVALIDATION_CHANNEL = "joku:cache:invalidate"
+
+#: Identifies invalidations sent by this process, so they can be ignored when they come back.
+ORIGIN = uuid.uuid4().hex
+
+
+class GuildCache(object):
+    """
+    A cache with one entry per guild.
+
+    Entries are loaded on first use, and stay cached until they are invalidated.
+    """
+    #: The name of this cache, used in invalidation messages.
+    name = None  # type: str
+
+    def __init__(self, db):
+        #: The database interface this cache loads from.
+        self.db = db
+
+        #: The number of lookups answered from the cache.
+        self.hits = 0
+
+        #: The number of lookups that had to load from the database.
+        self.misses = 0
+
+        self._entries = {}  # type: typing.Dict[int, typing.Any]
+        # Bumped on every invalidation, so that loads which raced with one aren't stored.
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def _load(self, guild: discord.Guild):
+        """
+        Loads the entry for a guild from the database.
+        """
+        raise NotImplementedError
+
+    async def get(self, guild: discord.Guild):
+        """
+        Gets the entry for a guild, loading it if needed.
+        """
+        try:
+            entry = self._entries[guild.id]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            return entry
+
+        generation = self._generation
+        entry = await self._load(guild)
+        if generation == self._generation:
+            # Something else might have loaded it first.
+            entry = self._entries.setdefault(guild.id, entry)
+
+        return entry
+
+    def peek(self, guild_id: int):
+        """
+        Gets the entry for a guild if it is cached, without loading it.
+        """
+        return self._entries.get(guild_id)
+
+    def invalidate(self, guild_id: int):
+        """
+        Drops the entry for a guild, so that it is reloaded on next use.
+        """
+        self._generation += 1
+        self._entries.pop(guild_id, None)
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        self._generation += 1
+        self._entries.clear()
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: The hit/miss counters for this cache.
+        """
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0
+        }
+
+
+class SettingsCache(GuildCache):
+    """
+    Caches the settings HSTORE for each guild.
+    """
+    name = "settings"
+
+    async def _load(self, guild: discord.Guild) -> typing.Dict[str, str]:
+        return await self.db.get_all_settings(guild)
+
+    def update(self, guild_id: int, setting_name: str, value: str):
+        """
+        Updates a setting in place, if the guild is cached.
+        """
+        settings = self._entries.get(guild_id)
+        if settings is not None:
+            settings[setting_name] = value
+
+
+class TagIndex(object):
+    """
+    Every tag and alias in a guild, indexed by name.
+    """
+    __slots__ = ("tags", "aliases")
+
+    def __init__(self, tags: typing.Iterable, aliases: typing.Iterable):
+        #: Tag name -> tag.
+        self.tags = {}
+        for tag in tags:
+            self.tags.setdefault(tag.name, tag)
+
+        by_id = {tag.id: tag for tag in self.tags.values()}
+
+        #: Alias name -> (tag, alias).
+        self.aliases = {}
+        for alias in aliases:
+            tag = by_id.get(alias.tag_id)
+            if tag is not None:
+                self.aliases.setdefault(alias.alias_name, (tag, alias))
+
+    def __len__(self):
+        return len(self.tags) + len(self.aliases)
+
+    def lookup(self, name: str) -> tuple:
+        """
+        Looks up a tag by name, falling back to an alias.
+
+        :return: A tuple of (tag, alias). Both are None if nothing matched.
+        """
+        tag = self.tags.get(name)
+        if tag is not None:
+            return tag, None
+
+        return self.aliases.get(name, (None, None))
+
+
+class TagCache(GuildCache):
+    """
+    Caches an index of the tags and aliases for each guild.
+
+    As the whole guild is indexed, lookups of names that aren't tags never touch the database.
+    """
+    name = "tags"
+
+    async def _load(self, guild: discord.Guild) -> TagIndex:
+        tags, aliases = await self.db.get_tags_and_aliases(guild)
+        return TagIndex(tags, aliases)
+
+
+class EventSettingsCache(GuildCache):
+    """
+    Caches the event settings for each guild, as a mapping of event name -> setting.
+
+    Every guild is preloaded on startup with :meth:`preload`, so member joins and leaves don't touch the database.
+    """
+    name = "events"
+
+    async def _load(self, guild: discord.Guild) -> typing.Dict[str, typing.Any]:
+        settings = await self.db.get_event_settings(guild)
+        return {setting.event: setting for setting in settings}
+
+    async def preload(self, guild_ids: typing.Iterable[int]) -> int:
+        """
+        Loads the event settings for many guilds in one query.
+
+        :return: The number of guilds loaded.
+        """
+        guild_ids = list(guild_ids)
+        generation = self._generation
+
+        entries = {guild_id: {} for guild_id in guild_ids}
+        for setting in await self.db.get_all_event_settings(guild_ids):
+            entries[setting.guild_id].setdefault(setting.event, setting)
+
+        if generation != self._generation:
+            # Something was invalidated whilst loading, so leave the rest to be loaded on use.
+            return 0
+
+        for guild_id, entry in entries.items():
+            self._entries.setdefault(guild_id, entry)
+
+        return len(entries)
@@ -11,6 +11,8 @@ from sqlalchemy import Column, func
 from sqlalchemy.engine import Engine, create_engine
 from sqlalchemy.orm import sessionmaker, Session
 
+from joku.db.buffers import RoleStateBuffer, XPBuffer
+from joku.db.cache import EventSettingsCache, SettingsCache, TagCache, INVALIDATION_CHANNEL, ORIGIN
 from joku.db.tables import User, RoleState, Guild, UserColour, EventSetting, Tag, Reminder, UserStock, Stock, \
     TagAlias
 
@@ -31,6 +33,16 @@ class DatabaseInterface(object):
         self.engine = None  # type: Engine
         self._sessionmaker = None  # type: sessionmaker
 
+        # Write-behind buffers.
+        self.xp_buffer = XPBuffer(self, **bot.config.get("xp_buffer", {}))
+        self.rolestate_buffer = RoleStateBuffer(self, **bot.config.get("rolestate_buffer", {}))
+
+        # Read caches.
+        self.settings_cache = SettingsCache(self)
+        self.tag_cache = TagCache(self)
+        self.event_cache = EventSettingsCache(self)
+        self.caches = {cache.name: cache for cache in (self.settings_cache, self.tag_cache, self.event_cache)}
+
     async def connect(self, dsn: str):
         """
         Connects the bot to the database.
@@ -43,6 +55,70 @@ class DatabaseInterface(object):
             self.engine = create_engine(dsn)
             self._sessionmaker = sessionmaker(bind=self.engine, expire_on_commit=False)
 
+        self.xp_buffer.start()
+        self.rolestate_buffer.start()
+
+    async def close(self):
+        """
+        Flushes any buffered writes, and disposes of the engine's connection pool.
+        """
+        await self.xp_buffer.close()
+        await self.rolestate_buffer.close()
+
+        if self.engine is not None:
+            async with threadpool():
+                self.engine.dispose()
+
+    async def publish_invalidation(self, cache_name: str, guild_id: int):
+        """
+        Tells any other processes to drop their cached entry for a guild.
+        """
+        if self.bot.redis.pool is None:
+            return
+
+        await self.bot.redis.publish(INVALIDATION_CHANNEL, "{}:{}:{}".format(ORIGIN, cache_name, guild_id))
+
+    async def invalidate(self, cache, guild_id: int):
+        """
+        Drops the cached entry for a guild, in this process and any others.
+        """
+        cache.invalidate(guild_id)
+        await self.publish_invalidation(cache.name, guild_id)
+
+    def handle_invalidation(self, message: str):
+        """
+        Handles an invalidation published by another process.
+        """
+        origin, cache_name, guild_id = message.split(":")
+        if origin == ORIGIN:
+            return
+
+        cache = self.caches.get(cache_name)
+        if cache is None:
+            logger.warning("Got an invalidation for unknown cache {}".format(cache_name))
+            return
+
+        cache.invalidate(int(guild_id))
+
+    async def update_leaderboard(self, field: str, scores: typing.Mapping[int, float]):
+        """
+        Writes new scores through to the Redis leaderboards.
+        """
+        # The write has already been committed, so a failure here shouldn't fail it.
+        try:
+            await self.bot.redis.leaderboards.set_scores(field, scores)
+        except Exception:
+            logger.exception("Failed to update the {} leaderboard!".format(field))
+
+    async def decay_leaderboard(self, field: str, rate: float, floor: int):
+        """
+        Applies a decay to the Redis leaderboards, mirroring one applied in the database.
+        """
+        try:
+            await self.bot.redis.leaderboards.decay(field, rate, floor)
+        except Exception:
+            logger.exception("Failed to decay the {} leaderboard!".format(field))
+
     @contextmanager
     def get_session(self) -> Session:
         session = self._sessionmaker()  # type: Session
@@ -142,11 +218,30 @@ class DatabaseInterface(object):
 
             return obbs
 
+    async def get_leaderboard_scores(self) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets the XP and money of every user, for rebuilding the leaderboards.
+
+        :return: A list of rows with id, xp and money.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                rows = sess.execute('SELECT id, coalesce(xp, 0) AS xp, coalesce(money, 0) AS money '
+                                    'FROM "user"').fetchall()
+
+        return [dict(row) for row in rows]
+
     async def update_user_xp(self, member: discord.Member, xp_to_add: int = None) -> User:
         """
         Updates the XP of a user.
         """
+        # Buffered XP has to be written first, so that this applies on top of it.
+        if self.xp_buffer.has(member.id):
+            await self.xp_buffer.flush()
+
         user = await self.get_or_create_user(member)
+        # Users that aren't in the database yet get their starting money when they are added.
+        created = user.money is None
         async with threadpool():
             with self.get_session() as session:
                 if xp_to_add is None:
@@ -160,13 +255,52 @@ class DatabaseInterface(object):
 
                 session.add(user)
 
+        self.xp_buffer.refresh(user.id, xp=user.xp)
+        await self.update_leaderboard("xp", {user.id: user.xp})
+        if created:
+            await self.update_leaderboard("money", {user.id: user.money})
+
         return user
 
+    async def bulk_add_user_xp(self, deltas: typing.Mapping[int, int]):
+        """
+        Adds XP to multiple users at once.
+
+        Users that don't exist yet are created first.
+
+        :param deltas: A mapping of user ID -> XP to add.
+        """
+        params = {}
+        values = []
+        for n, (id, xp) in enumerate(deltas.items()):
+            values.append("(:id_{0}, :xp_{0})".format(n))
+            params["id_{}".format(n)] = id
+            params["xp_{}".format(n)] = xp
+
+        values = ", ".join(values)
+
+        async with threadpool():
+            with self.get_session() as sess:
+                created = sess.execute('INSERT INTO "user" (id, xp, level, money) '
+                                       'SELECT v.id, 0, 1, 200 FROM (VALUES {}) AS v(id, xp) '
+                                       'ON CONFLICT (id) DO NOTHING '
+                                       'RETURNING id, money'.format(values), params).fetchall()
+                rows = sess.execute('UPDATE "user" SET xp = "user".xp + v.xp, last_modified = now() '
+                                    'FROM (VALUES {}) AS v(id, xp) '
+                                    'WHERE "user".id = v.id '
+                                    'RETURNING "user".id, "user".xp'.format(values), params).fetchall()
+
+        await self.update_leaderboard("xp", {row.id: row.xp for row in rows})
+        # New users start with some money, so they need to be on that leaderboard too.
+        if created:
+            await self.update_leaderboard("money", {row.id: row.money for row in created})
+
     async def set_user_level(self, member: discord.Member, level: int) -> User:
         """
         Sets a user's level.
         """
         user = await self.get_or_create_user(member)
+        created = user.money is None
         async with threadpool():
             with self.get_session() as session:
                 user.level = level
@@ -174,31 +308,42 @@ class DatabaseInterface(object):
 
                 session.add(user)
 
+        self.xp_buffer.refresh(user.id, level=level)
+        if created:
+            await self.update_leaderboard("money", {user.id: user.money})
+
         return user
 
     # endregion
 
     # region Settings
 
-    async def get_setting(self, guild: discord.Guild, setting_name: str,
-                          default: typing.Any = None) -> typing.Any:
+    async def get_all_settings(self, guild: discord.Guild) -> typing.Dict[str, str]:
         """
-        Gets a setting.
+        Gets all the settings for a guild from the database.
+
+        This bypasses the settings cache.
         """
         async with threadpool():
             with self.get_session() as session:
-                setting = session.query(Guild) \
-                    .filter((Guild.id == guild.id) & (Guild.settings.has_key(setting_name))) \
-                    .first()
+                row = session.query(Guild.settings).filter(Guild.id == guild.id).first()
 
-                if setting:
-                    return setting.settings[setting_name]
-                else:
-                    return default
+        if row is None or row.settings is None:
+            return {}
 
-    async def set_setting(self, guild: discord.Guild, setting_name: str, value: str) -> Guild:
+        return dict(row.settings)
+
+    async def get_setting(self, guild: discord.Guild, setting_name: str,
+                          default: typing.Any = None) -> typing.Any:
         """
-        Sets a setting Value.
+        Gets a setting.
+        """
+        settings = await self.settings_cache.get(guild)
+        return settings.get(setting_name, default)
+
+    async def _store_setting(self, guild: discord.Guild, setting_name: str, value: str) -> Guild:
+        """
+        Writes a setting to the database.
         """
         async with threadpool():
             with self.get_session() as session:
@@ -212,6 +357,17 @@ class DatabaseInterface(object):
 
         return setting
 
+    async def set_setting(self, guild: discord.Guild, setting_name: str, value: str) -> Guild:
+        """
+        Sets a setting Value.
+        """
+        setting = await self._store_setting(guild, setting_name, value)
+
+        self.settings_cache.update(guild.id, setting_name, value)
+        await self.publish_invalidation(self.settings_cache.name, guild.id)
+
+        return setting
+
     # endregion
 
     # region Currency
@@ -231,8 +387,35 @@ class DatabaseInterface(object):
 
                 session.add(user)
 
+        await self.update_leaderboard("money", {user.id: user.money})
         return user
 
+    async def apply_monetary_decay(self, factor: float, hours: int = 1,
+                                   floor: int = 1343) -> typing.Tuple[int, int]:
+        """
+        Decays the money of every user with negative money, or more than the floor, in one UPDATE.
+
+        The new money is ceil(money * e^(factor * hours)), the same as ``calculate_monetary_decay``.
+
+        :return: A tuple of (users decayed, total money decayed).
+        """
+        rate = factor * hours
+
+        async with threadpool():
+            with self.get_session() as sess:
+                # The self-join gives RETURNING the money from before the update.
+                sql = ('WITH decayed AS ('
+                       '    UPDATE "user" SET money = ceil("user".money * exp(:rate)) '
+                       '    FROM "user" AS old '
+                       '    WHERE old.id = "user".id AND (old.money < 0 OR old.money > :floor) '
+                       '    RETURNING old.money - "user".money AS decay'
+                       ') '
+                       'SELECT count(*) AS users, coalesce(sum(decay), 0) AS total FROM decayed')
+                row = sess.execute(sql, {"rate": rate, "floor": floor}).first()
+
+        await self.decay_leaderboard("money", rate, floor)
+        return row.users, int(row.total)
+
     async def get_user_currency(self, member: discord.Member):
         """
         Gets the currency for a specified member.
@@ -245,37 +428,58 @@ class DatabaseInterface(object):
 
     # region Rolestate
 
-    async def save_rolestate(self, member: discord.Member) -> RoleState:
+    async def save_rolestate(self, member: discord.Member):
         """
         Saves the rolestate for a member.
+
+        This is buffered, and written to the database in batches.
         """
-        guild = await self.get_or_create_guild(member.guild)
-        user = await self.get_or_create_user(member)
+        self.rolestate_buffer.add(member)
 
-        async with threadpool():
-            with self.get_session() as session:
-                assert isinstance(session, Session)
+    async def bulk_save_rolestates(self, rolestates: typing.Sequence[typing.Tuple[int, int, typing.List[int], str]]):
+        """
+        Upserts many rolestates at once.
 
-                current_rolestate = session.query(RoleState) \
-                    .filter((RoleState.user_id == member.id) & (RoleState.guild_id == member.guild.id)) \
-                    .first()
+        Guilds and users that don't exist yet are created first.
 
-                if current_rolestate is None:
-                    current_rolestate = RoleState(user_id=member.id)
-                    current_rolestate.guild = guild
+        :param rolestates: A sequence of (guild ID, user ID, role IDs, nick) tuples.
+        """
+        guilds = [{"id": guild_id} for guild_id in {rs[0] for rs in rolestates}]
+        params = [{"guild_id": guild_id, "user_id": user_id, "roles": roles, "nick": nick}
+                  for (guild_id, user_id, roles, nick) in rolestates]
 
-                # Add role IDs directly as an array.
-                current_rolestate.nick = member.nick
-                current_rolestate.roles = [r.id for r in member.roles if not r == member.guild.default_role]
-                session.merge(user)
-                session.add(current_rolestate)
+        # One statement for the users, so that the ones it created can be returned.
+        user_params = {}
+        values = []
+        for n, user_id in enumerate({rs[1] for rs in rolestates}):
+            values.append("(:id_{})".format(n))
+            user_params["id_{}".format(n)] = user_id
 
-        return current_rolestate
+        async with threadpool():
+            with self.get_session() as sess:
+                sess.execute("INSERT INTO guild (id, settings, roleme_roles, colourme_roles, stocks_enabled) "
+                             "VALUES (:id, '', '{}', '{}', false) ON CONFLICT (id) DO NOTHING", guilds)
+                created = sess.execute('INSERT INTO "user" (id, xp, level, money) '
+                                       'SELECT v.id, 0, 1, 200 FROM (VALUES {}) AS v(id) '
+                                       'ON CONFLICT (id) DO NOTHING '
+                                       'RETURNING id, money'.format(", ".join(values)), user_params).fetchall()
+                sess.execute("INSERT INTO rolestate (guild_id, user_id, roles, nick) "
+                             "VALUES (:guild_id, :user_id, :roles, :nick) "
+                             "ON CONFLICT (user_id, guild_id) DO UPDATE "
+                             "SET roles = EXCLUDED.roles, nick = EXCLUDED.nick", params)
+
+        # New users start with some money, so they need to be on that leaderboard too.
+        if created:
+            await self.update_leaderboard("money", {row.id: row.money for row in created})
 
     async def get_rolestate_for_id(self, guild_id: int, member_id: int) -> typing.Union[RoleState, None]:
         """
         Gets the rolestate for a user by ID.
         """
+        # Make sure the latest rolestate has been written.
+        if self.rolestate_buffer.has(guild_id, member_id):
+            await self.rolestate_buffer.flush()
+
         async with threadpool():
             with self.get_session() as session:
                 assert isinstance(session, Session)
@@ -449,35 +653,49 @@ class DatabaseInterface(object):
     # endregion
 
     # region Events
-    async def get_enabled_events(self, guild: discord.Guild) -> typing.Sequence[str]:
+    async def get_event_settings(self, guild: discord.Guild) -> typing.List[EventSetting]:
         """
-        Gets the enabled events for this guild.
-        """
-        guild = await self.get_or_create_guild(guild)
+        Gets every event setting for a guild.
 
+        This bypasses the event settings cache.
+        """
         async with threadpool():
             with self.get_session() as sess:
-                # bind the guild to our session so we can access the event settings property
-                sess.add(guild)
+                settings = sess.query(EventSetting) \
+                    .filter(EventSetting.guild_id == guild.id) \
+                    .order_by(EventSetting.id) \
+                    .all()
 
-                event_names = [e.event for e in guild.event_settings if e.enabled is True]
+                return list(settings)
 
-                # now remove it from the session, no need to commit
-                sess.expunge(guild)
+    async def get_all_event_settings(self, guild_ids: typing.Sequence[int]) -> typing.List[EventSetting]:
+        """
+        Gets every event setting for many guilds at once.
 
-        return event_names
+        This bypasses the event settings cache.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                settings = sess.query(EventSetting) \
+                    .filter(EventSetting.guild_id.in_(guild_ids)) \
+                    .order_by(EventSetting.id) \
+                    .all()
+
+                return list(settings)
+
+    async def get_enabled_events(self, guild: discord.Guild) -> typing.Sequence[str]:
+        """
+        Gets the enabled events for this guild.
+        """
+        settings = await self.event_cache.get(guild)
+        return [name for (name, setting) in settings.items() if setting.enabled is True]
 
     async def get_event_setting(self, guild: discord.Guild, event: str) -> typing.Union[EventSetting, None]:
         """
         Gets the EventSetting for the specified guild.
         """
-        async with threadpool():
-            with self.get_session() as sess:
-                uc = sess.query(EventSetting) \
-                    .filter((EventSetting.guild_id == guild.id) & (EventSetting.event == event)) \
-                    .first()
-
-                return uc
+        settings = await self.event_cache.get(guild)
+        return settings.get(event)
 
     async def update_event_setting(self, guild: discord.Guild, event: str, *,
                                    enabled: bool = None, message: str = None,
@@ -485,19 +703,19 @@ class DatabaseInterface(object):
         """
         Updates an event setting.
         """
-        original = await self.get_event_setting(guild, event)
-        guild = await self.get_or_create_guild(guild)
+        await self.get_or_create_guild(guild)
 
         async with threadpool():
             with self.get_session() as sess:
-                if original is None:
-                    original = EventSetting(event=event)
-
-                # add now, to prevent sqlalchemy being mean
-                sess.add(original)
+                # Not the cached setting, as that could be being read whilst this is changing it.
+                original = sess.query(EventSetting) \
+                    .filter((EventSetting.guild_id == guild.id) & (EventSetting.event == event)) \
+                    .order_by(EventSetting.id) \
+                    .first()
 
-                # update backrefs
-                original.guild = guild
+                if original is None:
+                    original = EventSetting(event=event, guild_id=guild.id)
+                    sess.add(original)
 
                 if enabled is not None:
                     original.enabled = enabled
@@ -508,30 +726,36 @@ class DatabaseInterface(object):
                 if channel is not None:
                     original.channel_id = channel.id
 
+        await self.invalidate(self.event_cache, guild.id)
         return original
 
     # endregion
 
     # region Tags
-    async def get_tag(self, guild: discord.Guild, name: str,
-                      return_alias: bool = False) -> typing.Union[Tag, typing.Tuple[Tag, TagAlias]]:
+    async def get_tags_and_aliases(self, guild: discord.Guild) \
+            -> typing.Tuple[typing.List[Tag], typing.List[TagAlias]]:
         """
-        Gets a tag from the database.
+        Gets every tag and alias for a guild from the database.
+
+        This bypasses the tag cache.
         """
         async with threadpool():
             with self.get_session() as sess:
-                tag = sess.query(Tag) \
-                    .filter((Tag.name == name) & (Tag.guild_id == guild.id)) \
-                    .first()
+                tags = sess.query(Tag).filter(Tag.guild_id == guild.id).order_by(Tag.id).all()
+                aliases = sess.query(TagAlias).filter(TagAlias.guild_id == guild.id).order_by(TagAlias.id).all()
 
-                alias = None
+        return list(tags), list(aliases)
+
+    async def get_tag(self, guild: discord.Guild, name: str,
+                      return_alias: bool = False) -> typing.Union[Tag, typing.Tuple[Tag, TagAlias]]:
+        """
+        Gets a tag from the database.
+
+        This is served from the tag cache, so looking up a tag that doesn't exist is free.
+        """
+        index = await self.tag_cache.get(guild)
+        tag, alias = index.lookup(name)
 
-                if tag is None:
-                    alias = sess.query(TagAlias) \
-                        .filter((TagAlias.alias_name == name) & (TagAlias.guild_id == guild.id)) \
-                        .first()
-                    if alias is not None:
-                        tag = alias.tag
         if return_alias:
             return tag, alias
         else:
@@ -565,6 +789,7 @@ class DatabaseInterface(object):
 
                 sess.add(alias)
 
+        await self.invalidate(self.tag_cache, guild.id)
         return alias
 
     async def remove_tag_alias(self, guild: discord.Guild, alias: TagAlias):
@@ -576,6 +801,7 @@ class DatabaseInterface(object):
             with self.get_session() as sess:
                 sess.delete(alias)
 
+        await self.invalidate(self.tag_cache, guild.id)
         return alias
 
     async def save_tag(self, guild: discord.Guild, name: str, content: str, *,
@@ -584,14 +810,16 @@ class DatabaseInterface(object):
         Saves a tag to the database.
         """
         guild = await self.get_or_create_guild(guild)
-        tag = await self.get_tag(guild, name)
 
         async with threadpool():
             with self.get_session() as sess:
+                # Not from the cache, as the cached tags are shared.
+                tag = sess.query(Tag).filter((Tag.name == name) & (Tag.guild_id == guild.id)).first()
+
                 # add it first otherwise sqlalchemy cries
                 if tag is None:
                     tag = Tag()
-                sess.add(tag)
+                    sess.add(tag)
 
                 # update tag
                 tag.name = name
@@ -603,6 +831,7 @@ class DatabaseInterface(object):
                 tag.guild_id = guild.id
                 tag.lua = lua
 
+        await self.invalidate(self.tag_cache, guild.id)
         return tag
 
     async def delete_tag(self, guild: discord.Guild, name: str) -> typing.Union[Tag, None]:
@@ -623,6 +852,7 @@ class DatabaseInterface(object):
                 for alias in aliases:
                     sess.delete(alias)
 
+        await self.invalidate(self.tag_cache, guild.id)
         return tag
 
     # endregion
@@ -645,6 +875,19 @@ class DatabaseInterface(object):
 
                 return list(reminders)
 
+    async def get_pending_reminders(self) -> typing.List[Reminder]:
+        """
+        Gets every enabled reminder, in the order they are due.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                reminders = sess.query(Reminder) \
+                    .filter(Reminder.enabled == True) \
+                    .order_by(Reminder.reminding_at) \
+                    .all()
+
+                return list(reminders)
+
     async def create_reminder(self, channel: discord.TextChannel, member: discord.Member,
                               content: str, remind_at: datetime.datetime):
         """
@@ -699,6 +942,16 @@ class DatabaseInterface(object):
 
         return reminder
 
+    async def cancel_reminders(self, ids: typing.Iterable[int]):
+        """
+        Cancels multiple reminders at once.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                sess.query(Reminder) \
+                    .filter(Reminder.id.in_(list(ids))) \
+                    .update({Reminder.enabled: False}, synchronize_session=False)
+
     # endregion
 
     # region Stocks
@@ -818,6 +1071,81 @@ class DatabaseInterface(object):
             stock_id: sum for (stock_id, sum) in rows
         }
 
+    async def get_market(self) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets every stock in every guild with stocks enabled, along with how many of its shares are owned.
+
+        :return: A list of rows with channel_id, guild_id, price, amount and owned.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                sql = ("SELECT stock.channel_id, stock.guild_id, stock.price, stock.amount, "
+                       "coalesce(owned.total, 0) AS owned "
+                       "FROM stock "
+                       "JOIN guild ON guild.id = stock.guild_id "
+                       "LEFT JOIN (SELECT stock_id, sum(amount) AS total FROM user__stock GROUP BY stock_id) owned "
+                       "ON owned.stock_id = stock.channel_id "
+                       "WHERE guild.stocks_enabled")
+                rows = sess.execute(sql).fetchall()
+
+        return [dict(row) for row in rows]
+
+    async def bulk_update_stocks(self, channel_ids: typing.Sequence[int], prices: typing.Sequence[float],
+                                 amounts: typing.Sequence[int]):
+        """
+        Updates the price and amount of many stocks at once.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                sql = ("UPDATE stock SET price = v.price, amount = v.amount "
+                       "FROM unnest(CAST(:ids AS bigint[]), CAST(:prices AS double precision[]), "
+                       "CAST(:amounts AS integer[])) AS v(channel_id, price, amount) "
+                       "WHERE stock.channel_id = v.channel_id")
+                sess.execute(sql, {"ids": list(channel_ids), "prices": list(prices), "amounts": list(amounts)})
+
+    async def get_market_snapshot(self, guild: discord.Guild) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets every stock in a guild, along with how many of its shares are owned.
+
+        :return: A list of rows with channel_id, price, amount and owned.
+        """
+        async with threadpool():
+            with self.get_session() as sess:
+                sql = ("SELECT stock.channel_id, stock.price, stock.amount, "
+                       "coalesce(sum(user__stock.amount), 0) AS owned "
+                       "FROM stock "
+                       "LEFT JOIN user__stock ON user__stock.stock_id = stock.channel_id "
+                       "WHERE stock.guild_id = :guild_id "
+                       "GROUP BY stock.channel_id "
+                       "ORDER BY stock.channel_id")
+                rows = sess.execute(sql, {"guild_id": guild.id}).fetchall()
+
+        return [dict(row) for row in rows]
+
+    async def get_stock_leaderboard(self, guild: discord.Guild, *, by: str = "value",
+                                    limit: int = 10) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets the top stock holders in a guild.
+
+        :param by: Either "value" to rank by the value of the shares held, or "amount" to rank by the number held.
+        :return: A list of rows with user_id, owned and value.
+        """
+        order = "owned" if by == "amount" else "value"
+
+        async with threadpool():
+            with self.get_session() as sess:
+                sql = ("SELECT user__stock.user_id, sum(user__stock.amount) AS owned, "
+                       "sum(user__stock.amount * stock.price) AS value "
+                       "FROM user__stock "
+                       "JOIN stock ON stock.channel_id = user__stock.stock_id "
+                       "WHERE stock.guild_id = :guild_id "
+                       "GROUP BY user__stock.user_id "
+                       "ORDER BY {} DESC "
+                       "LIMIT :limit".format(order))
+                rows = sess.execute(sql, {"guild_id": guild.id, "limit": limit}).fetchall()
+
+        return [dict(row) for row in rows]
+
     async def change_stock(self, channel: discord.TextChannel, *,
                            amount: int = None, price: int = None) -> Stock:
         """
@@ -883,4 +1211,7 @@ class DatabaseInterface(object):
                     sess.merge(ustock)
                     sess.merge(user)
 
+        if update_price:
+            await self.update_leaderboard("money", {user.id: user.money})
+
         return ustock
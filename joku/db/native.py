@@ -0,0 +1,400 @@
+"""
+A native asyncio PostgreSQL backend for the database interface.
+
+This uses asyncpg and a bounded connection pool for the hot paths (users, XP, settings, tags, events), instead of
+a thread hop and a fresh SQLAlchemy session per call.
+Anything not overridden here falls through to the SQLAlchemy implementation.
+"""
+import datetime
+import logging
+import random
+import re
+import typing
+
+import asyncpg
+import discord
+from sqlalchemy import Column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.exc import NoResultFound
+
+from joku.db.interface import DatabaseInterface
+from joku.db.tables import User, Guild, Tag, TagAlias, EventSetting
+
+logger = logging.getLogger("Jokusoramame.DB.Native")
+
+_driver_matcher = re.compile(r"^postgresql\+\w+://")
+
+
+def _to_orm(cls, record: asyncpg.Record):
+    """
+    Creates a detached ORM object from an asyncpg record.
+
+    The object behaves as if it was loaded by a session that has since been closed, so it can be passed back into the
+    SQLAlchemy methods.
+    """
+    keys = set(record.keys())
+    obb = cls(**{name: record[name] for name in cls.__table__.columns.keys() if name in keys})
+    make_transient_to_detached(obb)
+
+    return obb
+
+
+class AsyncpgDatabaseInterface(DatabaseInterface):
+    """
+    A wrapper for the PostgreSQL database that uses asyncpg for the hot paths.
+    """
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        self.pool = None  # type: asyncpg.pool.Pool
+
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection):
+        # Settings are stored in a HSTORE.
+        await conn.set_builtin_type_codec("hstore", codec_name="pg_contrib.hstore")
+
+    async def connect(self, dsn: str):
+        """
+        Connects the bot to the database.
+
+        This creates both the SQLAlchemy engine and the asyncpg pool.
+        """
+        await super().connect(dsn)
+
+        pool_cfg = self.bot.config.get("db_pool", {})
+        self.pool = await asyncpg.create_pool(_driver_matcher.sub("postgresql://", dsn),
+                                              min_size=pool_cfg.get("min_size", 2),
+                                              max_size=pool_cfg.get("max_size", 10),
+                                              init=self._init_connection,
+                                              loop=self.bot.loop)
+
+    async def close(self):
+        """
+        Flushes any buffered writes, and closes the engine and the asyncpg pool.
+        """
+        await super().close()
+
+        if self.pool is not None:
+            await self.pool.close()
+
+    # region Guild
+    async def get_or_create_guild(self, guild: discord.Guild) -> Guild:
+        """
+        Creates or gets a guild object from the database.
+        """
+        # The CTE can't see the row it inserted, so the UNION picks up whichever exists.
+        sql = ("WITH ins AS ("
+               "    INSERT INTO guild (id, settings, roleme_roles, colourme_roles, stocks_enabled) "
+               "    VALUES ($1, '', '{}', '{}', false) "
+               "    ON CONFLICT (id) DO NOTHING "
+               "    RETURNING *"
+               ") "
+               "SELECT * FROM ins UNION ALL SELECT * FROM guild WHERE id = $1 LIMIT 1")
+        record = await self.pool.fetchrow(sql, guild.id)
+
+        return _to_orm(Guild, record)
+
+    async def get_multiple_guilds(self, *guilds: typing.List[discord.Guild]) -> typing.Sequence[Guild]:
+        """
+        Gets multiple guilds.
+        """
+        records = await self.pool.fetch("SELECT * FROM guild WHERE id = ANY($1::bigint[])", [g.id for g in guilds])
+
+        return [_to_orm(Guild, record) for record in records]
+
+    # endregion
+
+    # region User
+    async def get_or_create_user(self, member: discord.Member = None, id: int = None) -> User:
+        """
+        Gets or creates a user object.
+        """
+        if member is not None:
+            id = member.id
+
+        record = await self.pool.fetchrow('SELECT * FROM "user" WHERE id = $1', id)
+        if record is None:
+            # Not added to the database until something saves it, the same as the SQLAlchemy path.
+            return User(id=id)
+
+        return _to_orm(User, record)
+
+    async def get_multiple_users(self, *members: discord.Member, order_by: Column = None,
+                                 detatch: bool = False):
+        """
+        Gets multiple user objects.
+
+        This will **not** create them if they don't exist.
+        """
+        sql = 'SELECT * FROM "user" WHERE id = ANY($1::bigint[])'
+        if order_by is not None:
+            sql += " ORDER BY {}".format(order_by.compile(dialect=postgresql.dialect()))
+
+        records = await self.pool.fetch(sql, [u.id for u in members])
+
+        # Always detached.
+        return [_to_orm(User, record) for record in records]
+
+    async def get_leaderboard_scores(self) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets the XP and money of every user, for rebuilding the leaderboards.
+        """
+        return await self.pool.fetch('SELECT id, coalesce(xp, 0) AS xp, coalesce(money, 0) AS money FROM "user"')
+
+    async def update_user_xp(self, member: discord.Member, xp_to_add: int = None) -> User:
+        """
+        Updates the XP of a user.
+        """
+        if xp_to_add is None:
+            xp_to_add = random.randint(0, 4)
+
+        # Buffered XP has to be written first, so that this applies on top of it.
+        if self.xp_buffer.has(member.id):
+            await self.xp_buffer.flush()
+
+        sql = ('INSERT INTO "user" (id, xp, level, money, last_modified) VALUES ($1, $2, 1, 200, $3) '
+               'ON CONFLICT (id) DO UPDATE SET xp = "user".xp + EXCLUDED.xp, last_modified = EXCLUDED.last_modified '
+               'RETURNING *, (xmax = 0) AS inserted')
+        record = await self.pool.fetchrow(sql, member.id, xp_to_add, datetime.datetime.now())
+        self.xp_buffer.refresh(record["id"], xp=record["xp"])
+        await self.update_leaderboard("xp", {record["id"]: record["xp"]})
+        if record["inserted"]:
+            await self.update_leaderboard("money", {record["id"]: record["money"]})
+
+        return _to_orm(User, record)
+
+    async def bulk_add_user_xp(self, deltas: typing.Mapping[int, int]):
+        """
+        Adds XP to multiple users at once.
+
+        Users that don't exist yet are created first.
+        """
+        ids, xps = list(deltas.keys()), list(deltas.values())
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                created = await conn.fetch('INSERT INTO "user" (id, xp, level, money) '
+                                           'SELECT v.id, 0, 1, 200 FROM unnest($1::bigint[]) AS v(id) '
+                                           'ON CONFLICT (id) DO NOTHING '
+                                           'RETURNING id, money', ids)
+                rows = await conn.fetch('UPDATE "user" SET xp = "user".xp + v.xp, last_modified = now() '
+                                        'FROM unnest($1::bigint[], $2::integer[]) AS v(id, xp) '
+                                        'WHERE "user".id = v.id '
+                                        'RETURNING "user".id, "user".xp', ids, xps)
+
+        await self.update_leaderboard("xp", {row["id"]: row["xp"] for row in rows})
+        # New users start with some money, so they need to be on that leaderboard too.
+        if created:
+            await self.update_leaderboard("money", {row["id"]: row["money"] for row in created})
+
+    async def set_user_level(self, member: discord.Member, level: int) -> User:
+        """
+        Sets a user's level.
+        """
+        sql = ('INSERT INTO "user" (id, xp, level, money, last_modified) VALUES ($1, 0, $2, 200, $3) '
+               'ON CONFLICT (id) DO UPDATE SET level = EXCLUDED.level, last_modified = EXCLUDED.last_modified '
+               'RETURNING *, (xmax = 0) AS inserted')
+        record = await self.pool.fetchrow(sql, member.id, level, datetime.datetime.now())
+        self.xp_buffer.refresh(record["id"], level=record["level"])
+        if record["inserted"]:
+            await self.update_leaderboard("money", {record["id"]: record["money"]})
+
+        return _to_orm(User, record)
+
+    # endregion
+
+    # region Settings
+    async def get_all_settings(self, guild: discord.Guild) -> typing.Dict[str, str]:
+        """
+        Gets all the settings for a guild from the database.
+
+        This bypasses the settings cache.
+        """
+        settings = await self.pool.fetchval("SELECT settings FROM guild WHERE id = $1", guild.id)
+
+        return settings or {}
+
+    async def _store_setting(self, guild: discord.Guild, setting_name: str, value: str) -> Guild:
+        """
+        Writes a setting to the database.
+        """
+        record = await self.pool.fetchrow("UPDATE guild SET settings = coalesce(settings, '') || hstore($2, $3) "
+                                          "WHERE id = $1 RETURNING *", guild.id, setting_name, value)
+        if record is None:
+            raise NoResultFound("No row was found for one()")
+
+        return _to_orm(Guild, record)
+
+    # endregion
+
+    # region Currency
+    async def update_user_currency(self, member: discord.Member, currency_to_add: int) -> User:
+        """
+        Updates the user's current currency.
+        """
+        sql = ('INSERT INTO "user" (id, xp, level, money, last_modified) VALUES ($1, 0, 1, $2, $3) '
+               'ON CONFLICT (id) DO UPDATE SET money = "user".money + EXCLUDED.money, '
+               'last_modified = EXCLUDED.last_modified '
+               'RETURNING *')
+        record = await self.pool.fetchrow(sql, member.id, currency_to_add, datetime.datetime.now())
+        await self.update_leaderboard("money", {record["id"]: record["money"]})
+
+        return _to_orm(User, record)
+
+    async def apply_monetary_decay(self, factor: float, hours: int = 1,
+                                   floor: int = 1343) -> typing.Tuple[int, int]:
+        """
+        Decays the money of every user with negative money, or more than the floor, in one UPDATE.
+
+        :return: A tuple of (users decayed, total money decayed).
+        """
+        rate = factor * hours
+        sql = ('WITH decayed AS ('
+               '    UPDATE "user" SET money = ceil("user".money * exp($1::float8)) '
+               '    FROM "user" AS old '
+               '    WHERE old.id = "user".id AND (old.money < 0 OR old.money > $2) '
+               '    RETURNING old.money - "user".money AS decay'
+               ') '
+               'SELECT count(*) AS users, coalesce(sum(decay), 0) AS total FROM decayed')
+        record = await self.pool.fetchrow(sql, rate, floor)
+
+        await self.decay_leaderboard("money", rate, floor)
+        return record["users"], int(record["total"])
+
+    # endregion
+
+    # region Rolestate
+    async def bulk_save_rolestates(self, rolestates: typing.Sequence[typing.Tuple[int, int, typing.List[int], str]]):
+        """
+        Upserts many rolestates at once.
+
+        Guilds and users that don't exist yet are created first.
+        """
+        guild_ids = list({rs[0] for rs in rolestates})
+        user_ids = list({rs[1] for rs in rolestates})
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("INSERT INTO guild (id, settings, roleme_roles, colourme_roles, stocks_enabled) "
+                                   "SELECT v.id, '', '{}', '{}', false FROM unnest($1::bigint[]) AS v(id) "
+                                   "ON CONFLICT (id) DO NOTHING", guild_ids)
+                created = await conn.fetch('INSERT INTO "user" (id, xp, level, money) '
+                                           'SELECT v.id, 0, 1, 200 FROM unnest($1::bigint[]) AS v(id) '
+                                           'ON CONFLICT (id) DO NOTHING '
+                                           'RETURNING id, money', user_ids)
+                await conn.executemany("INSERT INTO rolestate (guild_id, user_id, roles, nick) "
+                                       "VALUES ($1, $2, $3, $4) "
+                                       "ON CONFLICT (user_id, guild_id) DO UPDATE "
+                                       "SET roles = EXCLUDED.roles, nick = EXCLUDED.nick", rolestates)
+
+        # New users start with some money, so they need to be on that leaderboard too.
+        if created:
+            await self.update_leaderboard("money", {row["id"]: row["money"] for row in created})
+
+    # endregion
+
+    # region Events
+    async def get_event_settings(self, guild: discord.Guild) -> typing.List[EventSetting]:
+        """
+        Gets every event setting for a guild.
+
+        This bypasses the event settings cache.
+        """
+        records = await self.pool.fetch("SELECT * FROM event_setting WHERE guild_id = $1 ORDER BY id", guild.id)
+
+        return [_to_orm(EventSetting, record) for record in records]
+
+    async def get_all_event_settings(self, guild_ids: typing.Sequence[int]) -> typing.List[EventSetting]:
+        """
+        Gets every event setting for many guilds at once.
+
+        This bypasses the event settings cache.
+        """
+        records = await self.pool.fetch("SELECT * FROM event_setting WHERE guild_id = ANY($1::bigint[]) ORDER BY id",
+                                        list(guild_ids))
+
+        return [_to_orm(EventSetting, record) for record in records]
+
+    # endregion
+
+    # region Stocks
+    async def get_market(self) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets every stock in every guild with stocks enabled, along with how many of its shares are owned.
+
+        :return: A list of rows with channel_id, guild_id, price, amount and owned.
+        """
+        sql = ("SELECT stock.channel_id, stock.guild_id, stock.price, stock.amount, "
+               "coalesce(owned.total, 0) AS owned "
+               "FROM stock "
+               "JOIN guild ON guild.id = stock.guild_id "
+               "LEFT JOIN (SELECT stock_id, sum(amount) AS total FROM user__stock GROUP BY stock_id) owned "
+               "ON owned.stock_id = stock.channel_id "
+               "WHERE guild.stocks_enabled")
+
+        return await self.pool.fetch(sql)
+
+    async def get_market_snapshot(self, guild: discord.Guild) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets every stock in a guild, along with how many of its shares are owned.
+
+        :return: A list of rows with channel_id, price, amount and owned.
+        """
+        return await self.pool.fetch("SELECT stock.channel_id, stock.price, stock.amount, "
+                                     "coalesce(sum(user__stock.amount), 0) AS owned "
+                                     "FROM stock "
+                                     "LEFT JOIN user__stock ON user__stock.stock_id = stock.channel_id "
+                                     "WHERE stock.guild_id = $1 "
+                                     "GROUP BY stock.channel_id "
+                                     "ORDER BY stock.channel_id", guild.id)
+
+    async def get_stock_leaderboard(self, guild: discord.Guild, *, by: str = "value",
+                                    limit: int = 10) -> typing.List[typing.Mapping[str, typing.Any]]:
+        """
+        Gets the top stock holders in a guild.
+
+        :param by: Either "value" to rank by the value of the shares held, or "amount" to rank by the number held.
+        :return: A list of rows with user_id, owned and value.
+        """
+        order = "owned" if by == "amount" else "value"
+        sql = ("SELECT user__stock.user_id, sum(user__stock.amount) AS owned, "
+               "sum(user__stock.amount * stock.price) AS value "
+               "FROM user__stock "
+               "JOIN stock ON stock.channel_id = user__stock.stock_id "
+               "WHERE stock.guild_id = $1 "
+               "GROUP BY user__stock.user_id "
+               "ORDER BY {} DESC "
+               "LIMIT $2".format(order))
+
+        return await self.pool.fetch(sql, guild.id, limit)
+
+    async def bulk_update_stocks(self, channel_ids: typing.Sequence[int], prices: typing.Sequence[float],
+                                 amounts: typing.Sequence[int]):
+        """
+        Updates the price and amount of many stocks at once.
+        """
+        await self.pool.execute("UPDATE stock SET price = v.price, amount = v.amount "
+                                "FROM unnest($1::bigint[], $2::double precision[], $3::integer[]) "
+                                "AS v(channel_id, price, amount) "
+                                "WHERE stock.channel_id = v.channel_id",
+                                list(channel_ids), list(prices), list(amounts))
+
+    # endregion
+
+    # region Tags
+    async def get_tags_and_aliases(self, guild: discord.Guild) \
+            -> typing.Tuple[typing.List[Tag], typing.List[TagAlias]]:
+        """
+        Gets every tag and alias for a guild from the database.
+
+        This bypasses the tag cache.
+        """
+        async with self.pool.acquire() as conn:
+            tags = await conn.fetch("SELECT * FROM tag WHERE guild_id = $1 ORDER BY id", guild.id)
+            aliases = await conn.fetch("SELECT * FROM tag_alias WHERE guild_id = $1 ORDER BY id", guild.id)
+
+        return [_to_orm(Tag, record) for record in tags], [_to_orm(TagAlias, record) for record in aliases]
+
+    # endregion
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, Integer, DateTime, func, String, ForeignKey, Boolean, Float
+from sqlalchemy import Column, BigInteger, Integer, DateTime, func, String, ForeignKey, Boolean, Float, Index
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY, HSTORE
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import MutableDict
@@ -115,6 +115,10 @@ class UserStock(Base):
     A secondary table that represents a user and stock pair.
     """
     __tablename__ = "user__stock"
+    __table_args__ = (
+        # Used for aggregating holdings per stock.
+        Index("ix_user__stock_stock_id_user_id", "stock_id", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
 
@@ -276,6 +280,10 @@ class RoleState(Base):
     Represents the role state of a user.
     """
     __tablename__ = "rolestate"
+    __table_args__ = (
+        # Used for upserting rolestates.
+        Index("ix_rolestate_user_id_guild_id", "user_id", "guild_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
 
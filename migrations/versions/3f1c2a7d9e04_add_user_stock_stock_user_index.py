@@ -0,0 +1,24 @@
+"""add user__stock stock_id user_id index
+
+Revision ID: 3f1c2a7d9e04
+Revises: b9286b9eae48
+Create Date: 2026-10-16 12:04:31.218404
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9e04'
+down_revision = 'b9286b9eae48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user__stock_stock_id_user_id', 'user__stock', ['stock_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user__stock_stock_id_user_id', table_name='user__stock')
@@ -0,0 +1,31 @@
+"""add unique rolestate user_id guild_id index
+
+Revision ID: 8c5e1b0f4a2d
+Revises: 3f1c2a7d9e04
+Create Date: 2026-10-16 19:42:08.553170
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c5e1b0f4a2d'
+down_revision = '3f1c2a7d9e04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the newest rolestate for each member, and drop the rest.
+    op.execute("DELETE FROM rolestate WHERE id IN ("
+               "    SELECT id FROM ("
+               "        SELECT id, row_number() OVER (PARTITION BY user_id, guild_id ORDER BY id DESC) AS n "
+               "        FROM rolestate"
+               "    ) AS ranked WHERE n > 1"
+               ")")
+    op.create_index('ix_rolestate_user_id_guild_id', 'rolestate', ['user_id', 'guild_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_rolestate_user_id_guild_id', table_name='rolestate')